@@ -0,0 +1,68 @@
+"""Organizer-scoped access control.
+
+``@event_access()`` loads the event named by the ``event_id`` URL argument
+and checks that the current organizer (or an admin) owns it. With a child
+model it also loads the child named by ``guest_id`` or ``campaign_id`` and
+checks that it belongs to the event, in the same query (the child is outer
+joined onto the event). The view receives the loaded objects as ``event``
+and ``guest`` / ``campaign`` keyword arguments.
+
+Together with the user loaded once per request by Flask-Login, a protected
+request costs two queries before the view runs.
+"""
+from functools import wraps
+
+from flask import abort, flash, jsonify, redirect, url_for
+from flask_login import current_user
+
+from models import db, Event, Guest, InvitationCampaign, Organizer
+
+# Child model -> name of its URL argument (without "_id") and view keyword
+CHILD_ARGS = {Guest: 'guest', InvitationCampaign: 'campaign'}
+
+
+def load_organizer(user_id):
+    """Flask-Login user loader; Flask-Login keeps the result for the rest of the request."""
+    return db.session.get(Organizer, int(user_id))
+
+
+def can_manage(event):
+    return current_user.is_admin or event.organizerId == current_user.id
+
+
+def load_event(event_id, child=None, child_id=None):
+    """``(event, child)`` in one query; ``child`` is None when it is not part of the event."""
+    if child is None:
+        return db.session.get(Event, event_id), None
+    row = db.session.query(Event, child) \
+        .outerjoin(child, db.and_(child.eventId == Event.id, child.id == child_id)) \
+        .filter(Event.id == event_id).first()
+    return row if row is not None else (None, None)
+
+
+def event_access(child=None, page=False):
+    """Require the current user to manage the URL's event (and ``child``).
+
+    Denied requests get a JSON 403, or a flash message and a redirect to
+    the dashboard for ``page`` views. Unknown events are a 404.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(event_id, *args, **kwargs):
+            name = CHILD_ARGS.get(child)
+            child_id = kwargs.get(f'{name}_id') if name else None
+            event, found = load_event(event_id, child, child_id)
+            if event is None:
+                abort(404)
+            if not can_manage(event):
+                if page:
+                    flash('Unauthorized access')
+                    return redirect(url_for('routes.dashboard'))
+                return jsonify({'error': 'Unauthorized'}), 403
+            if name:
+                if found is None:
+                    return jsonify({'error': f'{name.capitalize()} not found for this event'}), 404
+                kwargs[name] = found
+            return view(event_id, *args, event=event, **kwargs)
+        return wrapper
+    return decorator
@@ -1,87 +1,239 @@
-from models import Event, Guest
+from models import db, ArchivedEvent, Event, Guest, EventQuestion, GuestAnswer, RsvpDailyRollup
+from sqlalchemy import and_, case, func, or_, true
 from datetime import datetime
-import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
 
 def get_event_analytics(event_id):
-    """Get analytics for a specific event"""
+    """Get analytics for a specific event from its daily rollups"""
     try:
         event = Event.query.get(event_id)
         if not event:
             return None
 
-        # Get all guests for the event
-        guests = Guest.query.filter_by(eventId=event_id).all()
-        
-        # Convert guest data to DataFrame
-        guest_data = [{
-            'status': guest.status,
-            'response_date': guest.updatedAt,
-            'plus_ones': guest.plusOneCount
-        } for guest in guests]
-        
-        df = pd.DataFrame(guest_data)
-        
-        # Response timeline
-        if not df.empty and 'response_date' in df.columns:
-            timeline = df['response_date'].value_counts().sort_index()
-            # Convert Timestamps to string format
-            timeline_dict = {
-                date.strftime('%Y-%m-%d'): count 
-                for date, count in timeline.items()
-            }
-        else:
-            timeline_dict = {}
+        # Current funnel: one grouped query instead of loading every guest
+        counts = {'pending': 0, 'confirmed': 0, 'declined': 0, 'waitlisted': 0}
+        plus_ones = 0
+        rows = db.session.query(Guest.status, func.count(Guest.id), func.sum(Guest.plusOneCount)) \
+            .filter(Guest.eventId == event_id).group_by(Guest.status).all()
+        for status, count, plus_one_total in rows:
+            counts[status] = count
+            if status == 'confirmed':
+                plus_ones = int(plus_one_total or 0)
+        total = sum(counts.values())
+        responded = total - counts['pending']
+
+        # Response timeline, one row per day that saw a status change
+        timeline = []
+        total_responses = total_changes = 0
+        for rollup in RsvpDailyRollup.query.filter_by(eventId=event_id).order_by(RsvpDailyRollup.day):
+            activity = rollup.responses + rollup.changes
+            timeline.append({
+                'day': rollup.day.strftime('%Y-%m-%d'),
+                'responses': rollup.responses,
+                'changes': rollup.changes,
+                'confirmed': rollup.confirmed,
+                'declined': rollup.declined,
+                'change_rate': rollup.changes / activity if activity else 0
+            })
+            total_responses += rollup.responses
+            total_changes += rollup.changes
 
-        # Calculate statistics
         stats = {
-            'total_guests': len(guests),
-            'response_rate': len(df[df['status'].isin(['confirmed', 'declined'])]) / len(df) if not df.empty else 0,
-            'confirmation_rate': len(df[df['status'] == 'confirmed']) / len(df) if not df.empty else 0,
-            'total_attending': df[df['status'] == 'confirmed']['plus_ones'].sum() + len(df[df['status'] == 'confirmed']) if not df.empty else 0
+            'total_guests': total,
+            'response_rate': responded / total if total else 0,
+            'confirmation_rate': counts['confirmed'] / total if total else 0,
+            'total_attending': counts['confirmed'] + plus_ones,
+            'change_rate': total_changes / (total_responses + total_changes) if total_changes else 0
         }
 
         return {
-            'timeline': timeline_dict,
+            'timeline': timeline,
+            'funnel': {'invited': total, 'responded': responded, **counts},
             'stats': stats
         }
-    except Exception as e:
-        print(f"Analytics error: {e}")
+    except Exception:
+        logger.exception("Analytics error", extra={'event_id': event_id})
         return {
-            'timeline': {},
+            'timeline': [],
+            'funnel': {'invited': 0, 'responded': 0, 'pending': 0, 'confirmed': 0, 'declined': 0, 'waitlisted': 0},
             'stats': {
                 'total_guests': 0,
                 'response_rate': 0,
                 'confirmation_rate': 0,
-                'total_attending': 0
+                'total_attending': 0,
+                'change_rate': 0
             }
         }
 
-def get_organizer_analytics(organizer_id):
-    """Get analytics for all events of an organizer"""
-    try:
-        events = Event.query.filter_by(organizerId=organizer_id).all()
-        
-        total_guests = 0
-        total_responses = 0
-        total_confirmed = 0
-        
-        for event in events:
-            guests = Guest.query.filter_by(eventId=event.id).all()
-            total_guests += len(guests)
-            total_responses += len([g for g in guests if g.status != 'pending'])
-            total_confirmed += len([g for g in guests if g.status == 'confirmed'])
-        
-        return {
-            'total_events': len(events),
-            'total_guests': total_guests,
-            'average_response_rate': total_responses / total_guests if total_guests > 0 else 0,
-            'average_confirmation_rate': total_confirmed / total_guests if total_guests > 0 else 0
-        }
-    except Exception as e:
-        print(f"Organizer analytics error: {e}")
-        return {
-            'total_events': 0,
-            'total_guests': 0,
-            'average_response_rate': 0,
-            'average_confirmation_rate': 0
-        }
\ No newline at end of file
+DASHBOARD_SCOPES = ('upcoming', 'past')
+
+def _local_now():
+    """Now, comparable with event dates: those are naive local times, as entered."""
+    return datetime.now()
+
+def _organizer_totals(organizer_id, now):
+    """One-row subqueries: live event and guest totals, and archived event totals."""
+    live = db.session.query(
+        func.count(func.distinct(Event.id)).label('live_events'),
+        func.count(func.distinct(case((Event.date >= now, Event.id)))).label('upcoming_events'),
+        func.count(Guest.id).label('live_guests'),
+        func.coalesce(func.sum(case((Guest.status != 'pending', 1), else_=0)), 0).label('live_responded'),
+        func.coalesce(func.sum(case((Guest.status == 'confirmed', 1), else_=0)), 0).label('live_confirmed')
+    ).select_from(Event).outerjoin(Guest, Guest.eventId == Event.id) \
+        .filter(Event.organizerId == organizer_id).subquery('live')
+    # Archived events count with their frozen final stats
+    archived = db.session.query(
+        func.count(ArchivedEvent.id).label('archived_events'),
+        func.coalesce(func.sum(ArchivedEvent.guests), 0).label('archived_guests'),
+        func.coalesce(func.sum(ArchivedEvent.guests - ArchivedEvent.pending), 0).label('archived_responded'),
+        func.coalesce(func.sum(ArchivedEvent.confirmed), 0).label('archived_confirmed')
+    ).filter(ArchivedEvent.organizerId == organizer_id).subquery('archived')
+    return live, archived
+
+def _totals(row):
+    guests = int(row.live_guests) + int(row.archived_guests)
+    responded = int(row.live_responded) + int(row.archived_responded)
+    confirmed = int(row.live_confirmed) + int(row.archived_confirmed)
+    return {
+        'total_events': row.live_events + row.archived_events,
+        'upcoming_events': row.upcoming_events,
+        'past_events': row.live_events - row.upcoming_events,
+        'archived_events': row.archived_events,
+        'total_guests': guests,
+        'average_response_rate': responded / guests if guests > 0 else 0,
+        'average_confirmation_rate': confirmed / guests if guests > 0 else 0
+    }
+
+def parse_dashboard_cursor(value):
+    """``(date, event id)`` from a ``next_cursor`` value; raises ValueError."""
+    if not value:
+        return None
+    day, _, event_id = value.partition('|')
+    return datetime.fromisoformat(day), int(event_id)
+
+def get_dashboard_summary(organizer_id, scope='upcoming', cursor=None, limit=24):
+    """A page of the organizer's event cards and their totals, in one query.
+
+    Upcoming events are listed soonest first and past events latest first,
+    a page at a time after ``cursor`` (the ``next_cursor`` of the previous
+    page). The page is a grouped subquery of events with their guest counts,
+    joined onto the one-row totals, so every page, even an empty one, is a
+    single round trip. Raises ValueError for a scope not in DASHBOARD_SCOPES.
+    """
+    if scope not in DASHBOARD_SCOPES:
+        raise ValueError(f'Unknown dashboard scope: {scope!r}')
+    now = _local_now()
+    confirmed = Guest.status == 'confirmed'
+    page = db.session.query(
+        Event.id, Event.title, Event.date, Event.location, Event.capacity, Event.seatsTaken,
+        func.count(Guest.id).label('guests'),
+        func.sum(case((confirmed, 1), else_=0)).label('confirmed'),
+        func.sum(case((Guest.status == 'pending', 1), else_=0)).label('pending'),
+        func.sum(case((Guest.status == 'declined', 1), else_=0)).label('declined'),
+        func.sum(case((Guest.status == 'waitlisted', 1), else_=0)).label('waitlisted'),
+        func.sum(case((confirmed, func.coalesce(Guest.plusOneCount, 0)), else_=0)).label('plus_ones')
+    ).outerjoin(Guest, Guest.eventId == Event.id).filter(Event.organizerId == organizer_id)
+    if scope == 'upcoming':
+        page = page.filter(Event.date >= now)
+        if cursor:
+            page = page.filter(or_(Event.date > cursor[0], and_(Event.date == cursor[0], Event.id > cursor[1])))
+        order = (Event.date, Event.id)
+    else:  # past
+        page = page.filter(Event.date < now)
+        if cursor:
+            page = page.filter(or_(Event.date < cursor[0], and_(Event.date == cursor[0], Event.id < cursor[1])))
+        order = (Event.date.desc(), Event.id.desc())
+    # One extra row tells whether there is a next page
+    page = page.group_by(Event.id).order_by(*order).limit(limit + 1).subquery('page')
+
+    live, archived = _organizer_totals(organizer_id, now)
+    page_order = (page.c.date, page.c.id) if scope == 'upcoming' else (page.c.date.desc(), page.c.id.desc())
+    rows = db.session.query(live, archived, page) \
+        .select_from(live.join(archived, true()).outerjoin(page, true())) \
+        .order_by(*page_order).all()
+
+    events = []
+    for row in rows:
+        if row.id is None:  # Empty page: only the totals
+            continue
+        events.append({
+            'id': row.id,
+            'title': row.title,
+            'date': row.date.isoformat(),
+            'location': row.location,
+            'guests': row.guests,
+            'confirmed': int(row.confirmed or 0),
+            'pending': int(row.pending or 0),
+            'declined': int(row.declined or 0),
+            'waitlisted': int(row.waitlisted or 0),
+            'total_attending': int(row.confirmed or 0) + int(row.plus_ones or 0),
+            'capacity': row.capacity,
+            'seats_left': None if row.capacity is None else max(0, row.capacity - row.seatsTaken)
+        })
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = f"{events[-1]['date']}|{events[-1]['id']}"
+    return {
+        'scope': scope,
+        'events': events,
+        'next_cursor': next_cursor,
+        'totals': _totals(rows[0])
+    }
+
+def get_response_breakdown(event_id):
+    """Per-option counts for every custom question of an event.
+
+    Counts come from one GROUP BY over the indexed GuestAnswer rows of
+    confirmed guests; ``headcount`` includes each guest's plus ones.
+    """
+    questions = EventQuestion.query.filter_by(eventId=event_id).order_by(EventQuestion.position).all()
+    if not questions:
+        return []
+
+    rows = db.session.query(
+        GuestAnswer.questionId,
+        GuestAnswer.choice,
+        GuestAnswer.flag,
+        func.count(Guest.id),
+        func.sum(1 + func.coalesce(Guest.plusOneCount, 0))
+    ).join(Guest, Guest.id == GuestAnswer.guestId).filter(
+        GuestAnswer.eventId == event_id,
+        Guest.status == 'confirmed'
+    ).group_by(GuestAnswer.questionId, GuestAnswer.choice, GuestAnswer.flag).all()
+
+    counts = {}
+    for question_id, choice, flag, guests, headcount in rows:
+        if flag is not None:
+            value = 'Yes' if flag else 'No'
+        else:
+            value = choice
+        bucket = counts.setdefault(question_id, {})
+        previous = bucket.get(value, (0, 0))
+        bucket[value] = (previous[0] + guests, previous[1] + int(headcount or 0))
+
+    breakdown = []
+    for question in questions:
+        bucket = counts.get(question.id, {})
+        if question.kind == 'choice':
+            values = list(question.options or [])
+            values += [v for v in bucket if v is not None and v not in values]
+        elif question.kind == 'acknowledgement':
+            values = ['Yes', 'No']
+        else:
+            values = [None]  # Text answers are only counted
+        options = [{
+            'value': value,
+            'guests': bucket.get(value, (0, 0))[0],
+            'headcount': bucket.get(value, (0, 0))[1]
+        } for value in values]
+        breakdown.append({
+            'key': question.key,
+            'label': question.label,
+            'kind': question.kind,
+            'answered': sum(o['guests'] for o in options),
+            'options': options if question.kind != 'text' else []
+        })
+    return breakdown
\ No newline at end of file
@@ -2,22 +2,41 @@ from flask import Flask, redirect, url_for
 from flask_login import LoginManager
 from models import db, Organizer
 from routes import routes
-from reminder import init_scheduler
 from config import Config
+from tracing import init_tracing
+from http_cache import init_http_cache
+from migrations import upgrade_command, dedupe_command
+from scheduler import scheduler_command
+from archive import archive_command, restore_command
+from rsvp_ingest import init_rsvp_ingest
+from db_routing import init_db_routing
+from mail_compose import init_mail_compose
+from rate_limit import init_rate_limit
+from access import load_organizer
 import bcrypt
 from flask_mail import Mail
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timezone
 from dotenv import load_dotenv
+import logging
 import os
 
-def create_app():
+logger = logging.getLogger(__name__)
+
+def create_app(config_class=Config):
     load_dotenv()  # Load environment variables at the very beginning
     
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+    trusted_proxies = app.config.get('TRUSTED_PROXIES', 0)
+    if trusted_proxies:
+        # Take the client address from X-Forwarded-For, as set by that many proxies
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+    init_tracing(app)
     
     # Initialize extensions
     db.init_app(app)
+    init_db_routing(app, db)
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'routes.login'
@@ -25,13 +44,20 @@ def create_app():
     # Initialize Flask-Mail
     mail = Mail(app)
     app.mail = mail  # Attach mail instance to app for global access
+    init_mail_compose(app)
+    init_rate_limit(app)
     
-    @login_manager.user_loader
-    def load_user(user_id):
-        return db.session.get(Organizer, int(user_id))
+    login_manager.user_loader(load_organizer)
     
     # Register blueprints
     app.register_blueprint(routes)
+    init_http_cache(app)
+    init_rsvp_ingest(app)
+    app.cli.add_command(upgrade_command)
+    app.cli.add_command(dedupe_command)
+    app.cli.add_command(scheduler_command)
+    app.cli.add_command(archive_command)
+    app.cli.add_command(restore_command)
     
     @app.context_processor
     def inject_now():
@@ -61,11 +87,8 @@ def create_app():
                     # If admin exists but is not marked as admin, update them
                     admin.is_admin = True
                     db.session.commit()
-        except Exception as e:
-            print(f"Database initialization error: {e}")
-    
-    # Initialize scheduler with app context
-    init_scheduler(app)
+        except Exception:
+            logger.exception("Database initialization error")
     
     GOOGLE_ANALYTICS_ID = os.getenv('GOOGLE_ANALYTICS_ID')
 
@@ -0,0 +1,231 @@
+"""Archival of past events.
+
+Events that ended more than ``ARCHIVE_AFTER_DAYS`` ago are moved out of the
+live tables so queries on Events, Guests and their children stop paying for
+them. Archiving an event:
+
+1. writes every row of the event (questions, guests, answers, campaigns and
+   their recipients, change log and daily rollups) as gzip-compressed JSON
+   lines into an ``ArchivedEvents`` row, together with the final RSVP counts
+   that dashboards keep showing, and commits;
+2. deletes the live rows child tables first, ``ARCHIVE_BATCH_SIZE`` rows per
+   committed statement, so no long lock is held on hot tables.
+
+An interrupted run is finished by the next one. ``restore_event`` puts the
+rows back with their original ids.
+"""
+import gzip
+import json
+import logging
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select
+
+from models import (db, ArchivedEvent, CampaignRecipient, Event, EventQuestion, Guest, GuestAnswer,
+                    InvitationCampaign, RsvpChange, RsvpDailyRollup)
+
+logger = logging.getLogger(__name__)
+
+# Parents first: the order rows are restored in, and the reverse of the delete order
+ARCHIVED_MODELS = (Event, EventQuestion, Guest, GuestAnswer, InvitationCampaign, CampaignRecipient,
+                   RsvpChange, RsvpDailyRollup)
+
+
+def _event_rows_condition(model, event_id):
+    if model is Event:
+        return Event.id == event_id
+    if model is CampaignRecipient:
+        return CampaignRecipient.campaignId.in_(
+            select(InvitationCampaign.id).where(InvitationCampaign.eventId == event_id))
+    return model.eventId == event_id
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot archive {type(value).__name__} values')
+
+
+def _from_json(table, row):
+    """Turn an archived row back into column values, skipping dropped columns."""
+    values = {}
+    for name, value in row.items():
+        column = table.c.get(name)
+        if column is None:
+            continue
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, db.Date):
+            value = date.fromisoformat(value)
+        values[name] = value
+    return values
+
+
+def export_event_rows(event_id, batch_size):
+    """Every row of the event as gzip-compressed JSON lines; returns ``(payload, row_count)``."""
+    lines = []
+    for model in ARCHIVED_MODELS:
+        table = model.__table__
+        query = select(table).where(_event_rows_condition(model, event_id))
+        if 'id' not in table.c:
+            batches = [db.session.execute(query).mappings().all()]
+        else:
+            batches = _keyset_batches(query, table, batch_size)
+        for rows in batches:
+            lines.extend(json.dumps({'table': table.name, 'row': dict(row)}, default=_json_default)
+                         for row in rows)
+    return gzip.compress('\n'.join(lines).encode('utf-8')), len(lines)
+
+
+def _keyset_batches(query, table, batch_size):
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(table.c.id > last_id).order_by(table.c.id)
+                                  .limit(batch_size)).mappings().all()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield rows
+
+
+def final_stats(event_id):
+    """RSVP counts frozen into the archive."""
+    counts = {'pending': 0, 'confirmed': 0, 'declined': 0, 'waitlisted': 0}
+    plus_ones = 0
+    rows = db.session.query(Guest.status, func.count(Guest.id), func.sum(Guest.plusOneCount)) \
+        .filter(Guest.eventId == event_id).group_by(Guest.status).all()
+    for status, count, plus_one_total in rows:
+        counts[status] = count
+        if status == 'confirmed':
+            plus_ones = int(plus_one_total or 0)
+    return dict(counts, guests=sum(counts.values()), attending=counts['confirmed'] + plus_ones)
+
+
+def delete_event_rows(event_id, batch_size):
+    """Delete the live rows of an event, children first, one committed batch at a time."""
+    deleted = 0
+    for model in reversed(ARCHIVED_MODELS):
+        table = model.__table__
+        condition = _event_rows_condition(model, event_id)
+        if 'id' not in table.c:
+            deleted += db.session.execute(delete(table).where(condition)).rowcount
+            db.session.commit()
+            continue
+        while True:
+            ids = db.session.execute(select(table.c.id).where(condition).limit(batch_size)).scalars().all()
+            if not ids:
+                break
+            db.session.execute(delete(table).where(table.c.id.in_(ids)))
+            db.session.commit()
+            deleted += len(ids)
+    return deleted
+
+
+def archive_event(event_id, batch_size=None):
+    """Archive one event and delete its live rows; returns the ArchivedEvent, or None if it is gone."""
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 500)
+    archived = db.session.get(ArchivedEvent, event_id)
+    if archived is None:
+        event = db.session.get(Event, event_id)
+        if event is None:
+            return None
+        payload, row_count = export_event_rows(event_id, batch_size)
+        archived = ArchivedEvent(id=event.id, organizerId=event.organizerId, title=event.title,
+                                 date=event.date, location=event.location, payload=payload,
+                                 rows=row_count, archivedAt=datetime.utcnow(), **final_stats(event_id))
+        db.session.add(archived)
+        db.session.commit()
+    delete_event_rows(event_id, batch_size)
+    archived.deletedAt = datetime.utcnow()
+    db.session.commit()
+    logger.info('Event archived', extra={'event_id': event_id, 'rows': archived.rows})
+    return archived
+
+
+def archive_past_events(older_than_days=None, limit=None, batch_size=None):
+    """Archive up to ``limit`` events older than the cutoff; returns their ids.
+
+    Events whose archival was interrupted are finished first.
+    """
+    config = current_app.config
+    days = config.get('ARCHIVE_AFTER_DAYS', 365) if older_than_days is None else older_than_days
+    limit = limit or config.get('ARCHIVE_EVENTS_PER_RUN', 20)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    unfinished = db.session.query(ArchivedEvent.id).filter(ArchivedEvent.deletedAt.is_(None)) \
+        .order_by(ArchivedEvent.id).limit(limit).all()
+    ids = [row.id for row in unfinished]
+    if len(ids) < limit:
+        due = db.session.query(Event.id).filter(Event.date < cutoff, Event.id.notin_(ids)) \
+            .order_by(Event.date).limit(limit - len(ids)).all()
+        ids += [row.id for row in due]
+    for event_id in ids:
+        archive_event(event_id, batch_size)
+    return ids
+
+
+def archived_rows(archived):
+    """``(table_name, row)`` pairs stored in an archive, parents first."""
+    for line in gzip.decompress(archived.payload).decode('utf-8').splitlines():
+        record = json.loads(line)
+        yield record['table'], record['row']
+
+
+def restore_event(event_id, batch_size=None):
+    """Put an archived event back into the live tables with its original ids.
+
+    The rows are inserted in one transaction, so a failed restore leaves the
+    archive untouched. Returns the number of rows restored.
+    """
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 500)
+    archived = db.session.get(ArchivedEvent, event_id)
+    if archived is None:
+        raise LookupError(f'Event {event_id} is not archived')
+    if archived.deletedAt is None:
+        delete_event_rows(event_id, batch_size)  # Interrupted archival; start from the archive
+
+    tables = {model.__table__.name: model.__table__ for model in ARCHIVED_MODELS}
+    table, rows = None, []
+    restored = 0
+    for table_name, row in archived_rows(archived):
+        # Rows are grouped by table, parents first; flush a table before its children
+        if rows and (tables[table_name] is not table or len(rows) >= batch_size):
+            restored += _insert_rows(table, rows)
+        table = tables[table_name]
+        rows.append(_from_json(table, row))
+    if rows:
+        restored += _insert_rows(table, rows)
+
+    db.session.delete(archived)
+    db.session.commit()
+    logger.info('Event restored from archive', extra={'event_id': event_id, 'rows': restored})
+    return restored
+
+
+def _insert_rows(table, rows):
+    count = len(rows)
+    db.session.execute(insert(table), rows)
+    rows.clear()
+    return count
+
+
+@click.command('archive-events')
+@click.option('--older-than-days', type=int, help='Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--limit', type=int, help='Events per run; defaults to ARCHIVE_EVENTS_PER_RUN.')
+@click.option('--batch-size', type=int, help='Rows per committed delete; defaults to ARCHIVE_BATCH_SIZE.')
+@with_appcontext
+def archive_command(older_than_days, limit, batch_size):
+    """Archive events that ended long ago."""
+    ids = archive_past_events(older_than_days, limit, batch_size)
+    click.echo(f'{len(ids)} events archived')
+
+
+@click.command('restore-event')
+@click.argument('event_id', type=int)
+@with_appcontext
+def restore_command(event_id):
+    """Restore an archived event."""
+    click.echo(f'{restore_event(event_id)} rows restored')
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the RSVP Manager.
+
+Each benchmark runs against a throwaway SQLite database and prints its
+throughput. Run: python benchmark.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+def make_bench_app(database_uri, **settings):
+    """Create an app bound to a benchmark database."""
+    from app import create_app
+    from config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        TESTING = True
+        MAIL_SUPPRESS_SEND = True
+        SERVER_NAME = "localhost"
+        TRACE_SAMPLE_RATE = 0.0
+        LOG_LEVEL = "ERROR"
+
+    for key, value in settings.items():
+        setattr(BenchConfig, key, value)
+    return create_app(BenchConfig)
+
+def seed_event(app, guest_count):
+    """Create one organizer, one event and ``guest_count`` guests; return their tokens."""
+    from models import db, Organizer, Event, Guest
+    with app.app_context():
+        organizer = Organizer(name="Bench", email="bench@example.com", passwordHash="x")
+        db.session.add(organizer)
+        db.session.flush()
+        event = Event(title="Bench Event", date=datetime.now() + timedelta(days=30),
+                      organizerId=organizer.id)
+        event.set_custom_fields({"meal_options": ["Fish", "Veg", "Beef"]})
+        db.session.add(event)
+        db.session.flush()
+        tokens = [f"bench-{i}" for i in range(guest_count)]
+        db.session.add_all([Guest(eventId=event.id, name=f"Guest {i}", email=f"g{i}@example.com",
+                                  uniqueAccessToken=token) for i, token in enumerate(tokens)])
+        db.session.commit()
+        return tokens
+
+def bench_rsvp_ingest(submissions=2000, guest_count=500, threads=8):
+    """RSVP submissions per second, committed directly vs. queued and batched."""
+    print(f"\nRSVP ingestion: {submissions} submissions from {threads} threads over {guest_count} guests")
+    from rsvp_ingest import ingest_queue
+
+    for mode in ("direct", "queued"):
+        with tempfile.TemporaryDirectory() as tmp:
+            app = make_bench_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                                 RSVP_INGEST_MODE=mode, RSVP_INGEST_FLUSH_INTERVAL=0.2)
+            tokens = seed_event(app, guest_count)
+            per_thread = submissions // threads
+            errors = []
+
+            def worker(offset):
+                client = app.test_client()
+                for i in range(per_thread):
+                    token = tokens[(offset * per_thread + i) % len(tokens)]
+                    status = "confirmed" if i % 3 else "declined"
+                    response = client.post(f"/rsvp/{token}", json={
+                        "status": status,
+                        "plus_one_count": i % 3,
+                        "responses": {"meal_choice": ["Fish", "Veg", "Beef"][i % 3]}
+                    })
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+            start = time.perf_counter()
+            pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            acked = time.perf_counter() - start
+            if mode == "queued":
+                ingest_queue.flush()
+            applied = time.perf_counter() - start
+
+            total = per_thread * threads
+            print(f"   {mode:>6}: {total / acked:8.0f} acknowledged/s, "
+                  f"{total / applied:8.0f} applied/s sustained ({len(errors)} errors)")
+
+def bench_mail_compose(messages=2000):
+    """Invitations composed and serialized per second, Flask-Mail vs. precompiled and shared parts."""
+    print(f"\nMail composition: {messages} invitations with logo and QR code")
+    from flask import render_template
+    from flask_mail import Message
+    from models import Event, Guest
+    from email_utils import build_invitation_message
+    from qr_generator import generate_rsvp_qr
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_bench_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        seed_event(app, 100)
+        with app.app_context(), app.test_request_context():
+            event = Event.query.first()
+            guests = Guest.query.all()
+            qr_png = generate_rsvp_qr(guests[0].uniqueAccessToken).getvalue()
+            with open(os.path.join(app.static_folder, "icon", "logo.png"), "rb") as f:
+                logo = f.read()
+
+            def flask_mail_message(guest):
+                html = render_template("invite.html", guest=guest, event=event, rsvp_url="https://example.com/rsvp",
+                                       has_qr=True)
+                msg = Message(subject=f"You're Invited: {event.title}", sender="RSVP Manager <bench@example.com>",
+                              recipients=[guest.email], html=html)
+                msg.attach("logo.png", "image/png", logo, "inline", headers={"Content-ID": "<logo>"})
+                msg.attach("rsvp_qr_code.png", "image/png", qr_png, "inline", headers={"Content-ID": "<qrcode>"})
+                return msg
+
+            for label, build in (("flask-mail", flask_mail_message),
+                                 ("composed", lambda guest: build_invitation_message(guest, event, qr_png))):
+                start = time.perf_counter()
+                size = 0
+                for i in range(messages):
+                    size += len(build(guests[i % len(guests)]).as_bytes())
+                elapsed = time.perf_counter() - start
+                print(f"   {label:>10}: {messages / elapsed:8.0f} messages/s ({size // messages} bytes each)")
+
+def main():
+    """Run all benchmarks."""
+    print("RSVP Manager - Benchmarks")
+    print("=" * 50)
+    bench_rsvp_ingest()
+    bench_mail_compose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Invitation campaigns.
+
+A campaign snapshots the guests of an event that match a filter into
+CampaignRecipient rows, then sends their invitations in throttled batches
+from the scheduler. Each recipient's state is committed as soon as its
+message is handed to the mail server, so a campaign interrupted at any point
+resumes with the recipients still queued. QR codes for a batch are generated
+on a thread pool while earlier messages of the batch are being sent.
+"""
+import logging
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, select, literal, exists, func
+from sqlalchemy.orm import joinedload
+
+from models import db, Guest, InvitationCampaign, CampaignRecipient
+from email_utils import build_invitation_message
+from qr_generator import generate_rsvp_qr
+from tracing import span, job_trace
+
+logger = logging.getLogger(__name__)
+
+GUEST_FILTERS = ('all', 'pending', 'confirmed', 'declined', 'not_invited')
+
+
+def _filter_guests(query, event, guest_filter):
+    query = query.where(Guest.eventId == event.id)
+    if guest_filter in ('pending', 'confirmed', 'declined'):
+        query = query.where(Guest.status == guest_filter)
+    elif guest_filter == 'not_invited':
+        # invitedAt covers every path (add guest, resend, campaigns); the
+        # recipient check covers campaign invitations sent before it existed
+        query = query.where(Guest.invitedAt.is_(None), ~exists().where(
+            CampaignRecipient.guestId == Guest.id,
+            CampaignRecipient.state == 'sent'
+        ))
+    return query
+
+
+def count_campaign_guests(event, guest_filter):
+    """Number of guests a campaign with ``guest_filter`` would invite."""
+    if guest_filter not in GUEST_FILTERS:
+        raise ValueError(f'Unknown guest filter: {guest_filter}')
+    return db.session.execute(_filter_guests(select(func.count(Guest.id)), event, guest_filter)).scalar()
+
+
+def create_campaign(event, guest_filter, base_url, organizer_id=None):
+    """Create a campaign and queue every matching guest with one INSERT ... SELECT."""
+    if guest_filter not in GUEST_FILTERS:
+        raise ValueError(f'Unknown guest filter: {guest_filter}')
+
+    campaign = InvitationCampaign(eventId=event.id, createdBy=organizer_id,
+                                  guestFilter=guest_filter, baseUrl=base_url)
+    db.session.add(campaign)
+    db.session.flush()
+
+    guests = _filter_guests(select(literal(campaign.id), Guest.id, literal('queued')), event, guest_filter)
+    db.session.execute(insert(CampaignRecipient).from_select(['campaignId', 'guestId', 'state'], guests))
+    db.session.commit()
+    return campaign
+
+
+def _generate_qr(app, base_url, token):
+    with app.test_request_context(base_url=base_url):
+        return generate_rsvp_qr(token)
+
+
+def run_campaign_batch(campaign, batch_size, send_rate, qr_workers):
+    """Send up to ``batch_size`` queued invitations; returns the number attempted."""
+    app = current_app._get_current_object()
+    recipients = CampaignRecipient.query.options(joinedload(CampaignRecipient.guest)) \
+        .filter_by(campaignId=campaign.id, state='queued') \
+        .order_by(CampaignRecipient.id).limit(batch_size).all()
+    if not recipients:
+        campaign.state = 'completed'
+        campaign.finishedAt = datetime.utcnow()
+        db.session.commit()
+        return 0
+
+    event = campaign.event
+    interval = 1.0 / send_rate if send_rate else 0
+    with ThreadPoolExecutor(max_workers=qr_workers) as pool, \
+            app.test_request_context(base_url=campaign.baseUrl), \
+            app.mail.connect() as connection:
+        # Start every QR code now so they are ready by the time the sender gets there
+        qr_futures = [pool.submit(_generate_qr, app, campaign.baseUrl, r.guest.uniqueAccessToken)
+                      for r in recipients]
+        for recipient, qr_future in zip(recipients, qr_futures):
+            started = time.monotonic()
+            try:
+                msg = build_invitation_message(recipient.guest, event, qr_future.result())
+                with span('mail', 'campaign_invitation', guest_id=recipient.guestId):
+                    connection.send(msg)
+                recipient.state = 'sent'
+                recipient.sentAt = recipient.guest.invitedAt = datetime.utcnow()
+                recipient.error = None
+            except smtplib.SMTPRecipientsRefused as e:
+                recipient.state = 'bounced'
+                recipient.error = str(e)[:255]
+            except Exception as e:
+                logger.exception("Campaign invitation failed",
+                                 extra={'campaign_id': campaign.id, 'guest_id': recipient.guestId})
+                recipient.state = 'failed'
+                recipient.error = str(e)[:255]
+            db.session.commit()
+
+            # Re-read the campaign so a pause takes effect mid-batch
+            db.session.refresh(campaign, ['state'])
+            if campaign.state != 'running':
+                break
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+    return len(recipients)
+
+
+def process_campaigns():
+    """Scheduler job: advance every running campaign by one batch."""
+    config = current_app.config
+    campaign_ids = [c.id for c in InvitationCampaign.query.filter_by(state='running').all()]
+    for campaign_id in campaign_ids:
+        campaign = db.session.get(InvitationCampaign, campaign_id)
+        try:
+            with job_trace(f'campaign {campaign_id}'):
+                run_campaign_batch(campaign,
+                                   batch_size=config.get('CAMPAIGN_BATCH_SIZE', 50),
+                                   send_rate=config.get('CAMPAIGN_SEND_RATE', 5),
+                                   qr_workers=config.get('CAMPAIGN_QR_WORKERS', 4))
+        except Exception:
+            db.session.rollback()
+            logger.exception("Campaign batch failed", extra={'campaign_id': campaign_id})
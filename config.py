@@ -5,7 +5,14 @@ load_dotenv()
 
 class Config:
     SECRET_KEY = os.urandom(24)
-    SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    # Read replicas: comma-separated URLs; reads of @read_only views go to them
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {f'replica_{i}': url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    DB_REPLICA_MAX_LAG = 10  # Seconds a replica may trail the primary before reads fall back
+    DB_REPLICA_LAG_CHECK_INTERVAL = 5  # Seconds between lag checks per replica
+    DB_REPLICA_STICKY_SECONDS = 10  # Reads stay on the primary this long after a client writes
+    DB_REPLICA_HEARTBEAT_SECONDS = 5  # How often the scheduler writes the heartbeat
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
     
@@ -17,6 +24,22 @@ class Config:
     QR_CODE_BOX_SIZE = 10
     QR_CODE_BORDER = 4
     
+    # Bulk guest operations
+    BULK_CHUNK_SIZE = 500  # Guest IDs per set-based statement
+    
+    # RSVP ingestion: 'direct' commits each RSVP in its request, 'queued'
+    # acknowledges immediately and applies submissions in batches from a
+    # thread in each web worker; a killed worker loses what it still queues
+    RSVP_INGEST_MODE = os.getenv('RSVP_INGEST_MODE', 'direct')
+    RSVP_INGEST_BATCH_SIZE = 500
+    RSVP_INGEST_FLUSH_INTERVAL = 0.5  # Seconds
+    
+    # Invitation campaigns
+    CAMPAIGN_BATCH_SIZE = 50  # Invitations sent per scheduler run
+    CAMPAIGN_SEND_RATE = 5  # Messages per second
+    CAMPAIGN_QR_WORKERS = 4  # Threads generating QR codes ahead of the sender
+    CAMPAIGN_POLL_SECONDS = 15
+    
     # File upload settings
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
@@ -28,4 +51,62 @@ class Config:
     MAIL_USE_SSL = os.getenv('MAIL_USE_SSL', 'false').lower() in ['true', '1', 'yes']
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
-    MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', MAIL_USERNAME)
\ No newline at end of file
+    MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', MAIL_USERNAME)
+
+    # Logging and tracing settings
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))  # Fraction of requests traced
+    TRACE_BUFFER_SIZE = 200  # Finished traces kept for /admin/traces
+    TRACE_MAX_SPANS = 500  # Spans kept per trace
+    TRACE_SLOW_MS = 1000  # Requests slower than this are logged
+
+    # HTTP caching settings
+    STATIC_MAX_AGE = 365 * 24 * 3600  # Fingerprinted static files are immutable
+    PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 300))  # Seconds; 0 disables the public page cache
+    PAGE_CACHE_SIZE = 200  # Cached pages kept per process, least recently used dropped first
+    PAGE_CACHE_QUERY_ARGS = ()  # Query arguments that select a different cached page; others are ignored
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 500  # Bytes
+
+    # Scheduler service settings (python scheduler.py)
+    APP_BASE_URL = os.getenv('APP_BASE_URL')  # e.g. https://rsvp.example.com, for links in scheduled emails
+    SCHEDULER_LOCK_TTL = 900  # Seconds a job lease lasts; keep above the longest job run
+    SCHEDULER_MISFIRE_GRACE = 300  # Seconds a run may start late before it is skipped
+    SCHEDULER_HISTORY_DAYS = 14  # Job run history kept for /admin/jobs
+    # Job intervals count from this UTC time; daily jobs run at its time of day
+    SCHEDULER_EPOCH = os.getenv('SCHEDULER_EPOCH', '2024-01-01T03:00:00')
+
+    # Archival of past events (a daily scheduler job, or flask archive-events)
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 365))  # Days after the event date
+    ARCHIVE_EVENTS_PER_RUN = 20
+    ARCHIVE_BATCH_SIZE = 500  # Rows per committed delete
+
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted (0 when clients connect directly);
+    # anonymous clients are rate limited by the address they report
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+
+    # Rate limits of mail-sending endpoints: scope -> (burst, refills per hour)
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ['true', '1', 'yes']
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # 'memory' (one process) or 'database' (shared)
+    RATE_LIMIT_MEMORY_KEYS = 10000  # Buckets the memory backend keeps before dropping refilled and idle ones
+    RATE_LIMITS = {
+        'reminders': (3, 6),
+        'invitations': (30, 300),
+        'campaigns': (5, 10),
+        'contact': (3, 10),  # Per client IP
+        'password_reset': (3, 10),  # Per client IP
+    }
+    MAIL_DAILY_QUOTA_ORGANIZER = int(os.getenv('MAIL_DAILY_QUOTA_ORGANIZER', 2000))  # Emails a day
+    MAIL_DAILY_QUOTA_IP = int(os.getenv('MAIL_DAILY_QUOTA_IP', 20))  # Emails a day from anonymous forms
+
+    # Organizer dashboard (/api/dashboard/summary)
+    DASHBOARD_PAGE_SIZE = 24  # Event cards per page
+    DASHBOARD_MAX_PAGE_SIZE = 100
+
+    # Calendar files (.ics invitation attachments and organizer feeds)
+    CALENDAR_ATTACH_INVITES = True
+    CALENDAR_EVENT_HOURS = 2  # Events have no end time; calendars show them this long
+    CALENDAR_UID_DOMAIN = os.getenv('CALENDAR_UID_DOMAIN', 'rsvp-manager')  # Keep stable: calendars match events by UID
+    CALENDAR_REFRESH_MINUTES = 60  # Polling interval suggested to feed subscribers
+    CALENDAR_CACHE_SIZE = 2000  # Rendered events kept per process
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""Read-replica routing.
+
+Replicas are configured as ``replica_*`` entries of ``SQLALCHEMY_BINDS``
+(from ``DATABASE_REPLICA_URLS``). Views decorated with ``@read_only`` send
+their SELECTs to a replica; everything else, and any statement that writes,
+uses the primary. Routing falls back to the primary when:
+
+- the session has already written in this request, or is flushing;
+- the client wrote within ``DB_REPLICA_STICKY_SECONDS``, so organizers see
+  their own changes on the next page;
+- a replica's heartbeat row trails the primary's by more than
+  ``DB_REPLICA_MAX_LAG`` seconds, or cannot be read. The scheduler service
+  writes the heartbeat on the primary.
+"""
+import logging
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import DateTime, text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica'
+HEARTBEAT_QUERY = text('SELECT beatAt FROM ReplicaHeartbeats WHERE id = 1').columns(beatAt=DateTime)
+
+# engine -> (checked_at, healthy)
+_replica_health = {}
+
+
+def replica_bind_keys(binds):
+    return [key for key in (binds or {}) if isinstance(key, str) and key.startswith(REPLICA_PREFIX)]
+
+
+def replica_lag(replica, primary):
+    """Seconds the replica's heartbeat trails the primary's; None if unknown."""
+    with primary.connect() as conn:
+        primary_beat = conn.execute(HEARTBEAT_QUERY).scalar()
+    with replica.connect() as conn:
+        replica_beat = conn.execute(HEARTBEAT_QUERY).scalar()
+    if primary_beat is None or replica_beat is None:
+        return None
+    return max(0.0, (primary_beat - replica_beat).total_seconds())
+
+
+def _is_healthy(replica, primary, config):
+    now = time.monotonic()
+    checked = _replica_health.get(replica)
+    if checked is not None and now - checked[0] < config.get('DB_REPLICA_LAG_CHECK_INTERVAL', 5):
+        return checked[1]
+    try:
+        lag = replica_lag(replica, primary)
+    except Exception:
+        logger.exception('Replica lag check failed', extra={'replica': replica.url.render_as_string()})
+        lag = None
+    healthy = lag is not None and lag <= config.get('DB_REPLICA_MAX_LAG', 10)
+    if not healthy:
+        logger.warning('Replica unavailable, reading from primary',
+                       extra={'replica': replica.url.render_as_string(), 'lag': lag})
+    _replica_health[replica] = (now, healthy)
+    return healthy
+
+
+def reset_replica_health():
+    _replica_health.clear()
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs of read-only views to a healthy replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or getattr(clause, 'is_dml', False):
+                self.info['wrote'] = True
+            elif getattr(clause, 'is_select', False) and g.get('_db_read_only') \
+                    and not self.info.get('wrote'):
+                replica = self._pick_replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _pick_replica(self):
+        engines = self._db.engines
+        keys = replica_bind_keys(engines)
+        if not keys:
+            return None
+        primary = engines[None]
+        healthy = [engines[k] for k in keys if _is_healthy(engines[k], primary, current_app.config)]
+        return random.choice(healthy) if healthy else None
+
+
+def read_only(view):
+    """Serve the view's queries from a replica unless the client just wrote."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('_db_primary_until', 0) <= time.time():
+            g._db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_db_routing(app, db):
+    """Remember writes so the client's next reads stay on the primary."""
+    if not replica_bind_keys(app.config.get('SQLALCHEMY_BINDS')):
+        return
+    sticky = app.config.get('DB_REPLICA_STICKY_SECONDS', 10)
+
+    @app.after_request
+    def stick_to_primary_after_write(response):
+        if db.session.registry.has() and db.session.info.get('wrote'):
+            session['_db_primary_until'] = time.time() + sticky
+        return response
@@ -1,121 +1,69 @@
-from flask_mail import Message, Attachment
-from flask import render_template, url_for, current_app
+from datetime import datetime
+from flask import url_for, current_app
+from mail_compose import composer
+from tracing import span
+import logging
 
-def send_invitation_email(guest, event, qr_image_io=None):
-    """Send invitation email to guest, with optional QR code attachment."""
-    try:
-        app = current_app
-        mail = app.mail
-        rsvp_url = url_for('routes.rsvp_page', token=guest.uniqueAccessToken, _external=True)
-        html = render_template('invite.html', guest=guest, event=event, rsvp_url=rsvp_url)
-        
-        # Use a friendly display name with the email
-        sender = f"RSVP Manager <{app.config['MAIL_USERNAME']}>"
-        
-        msg = Message(
-            subject=f"You're Invited: {event.title}",
-            sender=sender,
-            recipients=[guest.email],
-            html=html
-        )
+logger = logging.getLogger(__name__)
+
+def _send(msg, connection=None):
+    """Send over an open connection when sending many messages, else over a new one."""
+    (connection or current_app.mail).send(msg)
+
+def build_invitation_message(guest, event, qr_image=None):
+    """Build the invitation Message for a guest, with an optional QR code (PNG bytes or BytesIO)."""
+    rsvp_url = url_for('routes.rsvp_page', token=guest.uniqueAccessToken, _external=True)
+    qr_png = qr_image.getvalue() if hasattr(qr_image, 'getvalue') else qr_image
+    return composer().invitation(guest, event, rsvp_url, qr_png)
 
-        if qr_image_io:
-            msg.attach(
-                filename='rsvp_qr_code.png',
-                content_type='image/png',
-                data=qr_image_io.read(),
-                disposition='inline',
-                headers={'Content-ID': '<qrcode>'}
-            )
+def send_invitation_email(guest, event, qr_image_io=None, connection=None):
+    """Send invitation email to guest, with optional QR code attachment.
 
-        mail.send(msg)
+    Marks the guest invited (``invitedAt``) on success; the caller commits.
+    """
+    try:
+        msg = build_invitation_message(guest, event, qr_image_io)
+        with span('mail', 'invitation', guest_id=guest.id):
+            _send(msg, connection)
+        guest.invitedAt = datetime.utcnow()
         return True
-    except Exception as e:
-        print(f"Error sending invite to {guest.email}: {e}")
+    except Exception:
+        logger.exception("Error sending invite", extra={'guest_id': guest.id, 'event_id': event.id})
         return False
 
-def send_reminder_email(guest, event, recipient_type=None):
+def send_reminder_email(guest, event, recipient_type=None, connection=None):
     """Send reminder email to guest using the dedicated RSVP email as sender. recipient_type can be 'pending' or 'confirmed'."""
     try:
-        app = current_app
-        mail = app.mail
         rsvp_url = url_for('routes.rsvp_page', token=guest.uniqueAccessToken, _external=True)
         # Use custom subject and message based on recipient_type or guest.status
-        status = recipient_type or guest.status
-        if status == 'pending':
-            subject = f"Reminder: Your RSVP is still pending for {event.title}"
-        elif status == 'confirmed':
-            subject = f"Don't forget about {event.title}!"
-        else:
-            subject = f"Reminder: {event.title} is coming up!"
-        html = render_template('reminder.html', guest=guest, event=event, rsvp_url=rsvp_url, recipient_type=status)
-        sender = f"RSVP Manager <{app.config['MAIL_USERNAME']}>"
-        msg = Message(
-            subject=subject,
-            sender=sender,
-            recipients=[guest.email],
-            html=html
-        )
-        mail.send(msg)
+        msg = composer().reminder(guest, event, rsvp_url, recipient_type or guest.status)
+        with span('mail', 'reminder', guest_id=guest.id):
+            _send(msg, connection)
         return True
-    except Exception as e:
-        print(f"Error sending reminder to {guest.email}: {e}")
+    except Exception:
+        logger.exception("Error sending reminder", extra={'guest_id': guest.id, 'event_id': event.id})
         return False
 
 def send_password_reset_email(email, token):
     try:
-        app = current_app
-        mail = app.mail
         reset_url = url_for('routes.reset_password', token=token, _external=True)
-        html = render_template('reset_email.html', reset_url=reset_url)
-        sender = f"Trisect RSVP Manager <{app.config['MAIL_USERNAME']}>"
-        msg = Message(
-            subject="Password Reset Request",
-            sender=sender,
-            recipients=[email],
-            html=html
-        )
-        mail.send(msg)
+        msg = composer().password_reset(email, reset_url)
+        with span('mail', 'password_reset'):
+            _send(msg)
         return True
-    except Exception as e:
-        print(f"Error sending password reset to {email}: {e}")
+    except Exception:
+        logger.exception("Error sending password reset")
         return False
 
 def send_contact_email(name, user_email, message):
     """Send the contact form submission to the admin."""
     try:
-        app = current_app
-        mail = app.mail
-        
-        # The email is sent to the administrator's email, configured as MAIL_USERNAME
-        admin_email = app.config['MAIL_USERNAME']
-        
-        # To make it clear who sent the message, we set the sender's email as a reply-to address
-        # and include their name in the email body.
-        subject = f"New Contact Form Submission from {name}"
-        
-        html_body = f"""
-        <p>You have a new contact form submission from:</p>
-        <ul>
-            <li><b>Name:</b> {name}</li>
-            <li><b>Email:</b> {user_email}</li>
-        </ul>
-        <p><b>Message:</b></p>
-        <p>{message}</p>
-        """
-        
-        sender_display = f"Trisect RSVP Manager <{app.config['MAIL_USERNAME']}>"
-
-        msg = Message(
-            subject=subject,
-            sender=sender_display,
-            recipients=[admin_email],
-            html=html_body,
-            reply_to=user_email
-        )
-        
-        mail.send(msg)
+        # Sent to the administrator (MAIL_USERNAME) with the visitor as Reply-To;
+        # the template escapes everything the visitor typed
+        msg = composer().contact(name, user_email, message)
+        with span('mail', 'contact'):
+            _send(msg)
         return True
-    except Exception as e:
-        print(f"Error sending contact form email: {e}")
-        return False 
\ No newline at end of file
+    except Exception:
+        logger.exception("Error sending contact form email")
+        return False
@@ -0,0 +1,128 @@
+"""Adding, importing and de-duplicating guests.
+
+A guest is unique per event by normalized email (the ``uq_guest_event_email``
+index). Adding a guest whose address is already on the list updates that
+guest instead of inserting a copy, CSV imports are applied as chunked
+set-based upserts, and ``merge_duplicate_guests`` folds copies created before
+the index existed into one guest.
+"""
+import csv
+import secrets
+from io import StringIO
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Guest, RsvpChange, normalize_email
+
+
+def upsert_guest(event_id, name, email, phone=None):
+    """Add a guest or update the one with the same address; returns ``(guest, created)``."""
+    normalized = normalize_email(email)
+    guest = Guest.query.filter_by(eventId=event_id, normalizedEmail=normalized).first()
+    if guest is None:
+        guest = Guest(eventId=event_id, name=name, email=email, phone=phone,
+                      uniqueAccessToken=secrets.token_urlsafe(32))
+        db.session.add(guest)
+        try:
+            db.session.commit()
+            return guest, True
+        except IntegrityError:
+            db.session.rollback()  # Added concurrently; update that one instead
+            guest = Guest.query.filter_by(eventId=event_id, normalizedEmail=normalized).one()
+    guest.name = name
+    if phone:
+        guest.phone = phone
+    db.session.commit()
+    return guest, False
+
+
+def parse_guest_csv(text):
+    """Rows of a guest CSV with Name, Email and optional Phone columns (as exported)."""
+    reader = csv.DictReader(StringIO(text))
+    rows = []
+    for row in reader:
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        rows.append({'name': row.get('name', ''), 'email': row.get('email', ''), 'phone': row.get('phone') or None})
+    return rows
+
+
+def import_guests(event_id, rows, chunk_size=500):
+    """Upsert ``rows`` into the event's guest list; returns created/updated/skipped counts.
+
+    Later rows win over earlier rows with the same address. Existing guests
+    get the imported name (and phone, when given); their RSVP is untouched.
+    """
+    latest = {}
+    skipped = 0
+    for row in rows:
+        if not row['name'] or '@' not in row['email']:
+            skipped += 1
+            continue
+        latest[normalize_email(row['email'])] = row
+
+    created = updated = 0
+    keys = list(latest)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        existing = dict(db.session.query(Guest.normalizedEmail, Guest.id)
+                        .filter(Guest.eventId == event_id, Guest.normalizedEmail.in_(chunk)))
+        updates, inserts = [], []
+        for key in chunk:
+            row = latest[key]
+            if key in existing:
+                values = {'id': existing[key], 'name': row['name'], 'email': row['email']}
+                if row['phone']:
+                    values['phone'] = row['phone']
+                updates.append(values)
+            else:
+                inserts.append({'eventId': event_id, 'name': row['name'], 'email': row['email'],
+                                'normalizedEmail': key, 'phone': row['phone'],
+                                'uniqueAccessToken': secrets.token_urlsafe(32)})
+        if updates:
+            db.session.execute(update(Guest), updates)
+        if inserts:
+            db.session.execute(insert(Guest), inserts)
+        created += len(inserts)
+        updated += len(updates)
+    db.session.commit()
+    return {'created': created, 'updated': updated, 'skipped': skipped}
+
+
+def merge_duplicate_guests(guests):
+    """Fold guests sharing an address into the one with the most advanced RSVP.
+
+    The kept guest inherits a missing phone number, the latest reminder time,
+    the change history and one invitation record per campaign. Returns it.
+    """
+    keeper = max(guests, key=lambda g: (Guest.STATUS_RANK.get(g.status, 0),
+                                        g.updatedAt or g.createdAt, -g.id))
+    others = [g for g in guests if g is not keeper]
+    other_ids = [g.id for g in others]
+
+    if not keeper.phone:
+        keeper.phone = next((g.phone for g in others if g.phone), None)
+    reminded = [g.lastReminderSent for g in guests if g.lastReminderSent]
+    if reminded:
+        keeper.lastReminderSent = max(reminded)
+    invited = [g.invitedAt for g in guests if g.invitedAt]
+    if invited:
+        keeper.invitedAt = max(invited)
+
+    # One recipient per campaign, preferring one the invitation was sent to
+    campaigns = {r.campaignId: r for r in keeper.campaign_recipients}
+    for guest in others:
+        for recipient in list(guest.campaign_recipients):
+            kept = campaigns.get(recipient.campaignId)
+            if kept is None or (recipient.state == 'sent' and kept.state != 'sent'):
+                if kept is not None:
+                    db.session.delete(kept)
+                    db.session.flush()  # Free the (campaign, guest) slot first
+                recipient.guest = keeper
+                campaigns[recipient.campaignId] = recipient
+
+    RsvpChange.query.filter(RsvpChange.guestId.in_(other_ids)) \
+        .update({'guestId': keeper.id}, synchronize_session=False)
+    for guest in others:  # Cascades to the duplicates' answers
+        db.session.delete(guest)
+    return keeper
@@ -0,0 +1,251 @@
+"""HTTP caching and compression.
+
+- Static URLs get a content fingerprint (``?v=<hash>``) so they can be served
+  with a far-future ``Cache-Control`` and ``immutable``.
+- Precompressed ``.br``/``.gz`` siblings of static files (written by
+  ``flask compress-static``) are served to clients that accept them. Their
+  names carry the fingerprint of the content they were made from
+  (``styles.css.<hash>.gz``), so a file edited since is served uncompressed
+  rather than as stale bytes under its new fingerprint.
+- Rendered HTML is gzip-compressed and answered with ETag/304.
+- ``cached_page`` keeps a full-page copy of anonymous public GET pages, in
+  a bounded LRU keyed on the path and the query arguments allowed by
+  ``PAGE_CACHE_QUERY_ARGS`` (others are ignored, so they cannot grow it).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+import click
+from flask import request, session, current_app, send_from_directory, make_response
+from flask.cli import with_appcontext
+from flask_login import current_user
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+_fingerprints = {}
+_page_cache = OrderedDict()  # Least recently used first
+_page_cache_lock = threading.Lock()
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json')
+COMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def static_fingerprint(app, filename):
+    """Short content hash of a static file, cached per (path, mtime)."""
+    path = safe_join(app.static_folder, filename)
+    if path is None:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:12]
+    _fingerprints[path] = (mtime, digest)
+    return digest
+
+
+def accepts_encoding(encoding):
+    """Whether the client accepts ``encoding``, honouring q-values (``gzip;q=0`` refuses it)."""
+    return request.accept_encodings[encoding] > 0
+
+
+def _accepted_encoding():
+    if brotli is not None and accepts_encoding('br'):
+        return 'br'
+    if accepts_encoding('gzip'):
+        return 'gzip'
+    return None
+
+
+def compressed_name(filename, fingerprint, encoding):
+    """Name of the precompressed copy of ``filename`` made from the given content."""
+    return f"{filename}.{fingerprint}{COMPRESSED_SUFFIXES[encoding]}"
+
+
+def serve_static(filename):
+    """Static view that prefers precompressed variants of the current content."""
+    app = current_app
+    encoding = _accepted_encoding()
+    fingerprint = static_fingerprint(app, filename) if encoding else None
+    if fingerprint:
+        name = compressed_name(filename, fingerprint, encoding)
+        compressed = safe_join(app.static_folder, name)
+        if compressed and os.path.isfile(compressed):
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(app.static_folder, name, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    response = app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def cached_page(view):
+    """Full-page cache for anonymous GET requests to public pages.
+
+    Pages are only cached when nothing request-specific (a logged-in user or
+    pending flash messages) would end up in the HTML.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        ttl = current_app.config.get('PAGE_CACHE_TTL', 0)
+        if (not ttl or request.method != 'GET' or current_user.is_authenticated
+                or session.get('_flashes')):
+            return view(*args, **kwargs)
+
+        key = _page_key()
+        with _page_cache_lock:
+            entry = _page_cache.get(key)
+            if entry is not None:
+                _page_cache.move_to_end(key)
+        if entry is None or entry['expires'] <= time.monotonic():
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            entry = _store_page(key, response, ttl)
+            status = 'MISS'
+        else:
+            status = 'HIT'
+
+        # Serve the stored body, compressed once per cache fill
+        if accepts_encoding('gzip'):
+            response = make_response(entry['gzip'])
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(entry['etag'] + '-gz')
+        else:
+            response = make_response(entry['body'])
+            response.set_etag(entry['etag'])
+        response.headers['Content-Type'] = entry['content_type']
+        response.headers['X-Page-Cache'] = status
+        return response
+    return wrapper
+
+
+def _page_key():
+    allowed = current_app.config.get('PAGE_CACHE_QUERY_ARGS', ())
+    args = sorted((name, value) for name in allowed for value in request.args.getlist(name))
+    return request.path + ('?' + urlencode(args) if args else '')
+
+
+def _store_page(key, response, ttl):
+    body = response.get_data()
+    level = current_app.config.get('COMPRESS_LEVEL', 6)
+    entry = {
+        'expires': time.monotonic() + ttl,
+        'body': body,
+        'gzip': gzip.compress(body, compresslevel=level, mtime=0),
+        'etag': hashlib.sha1(body).hexdigest(),
+        'content_type': response.headers['Content-Type']
+    }
+    with _page_cache_lock:
+        _page_cache[key] = entry
+        _page_cache.move_to_end(key)
+        while len(_page_cache) > current_app.config.get('PAGE_CACHE_SIZE', 200):
+            _page_cache.popitem(last=False)
+    return entry
+
+
+def clear_page_cache():
+    with _page_cache_lock:
+        _page_cache.clear()
+
+
+def _finalize_response(response):
+    """Add caching headers, compress and answer conditional requests."""
+    if request.endpoint == 'static':
+        if request.args.get('v'):
+            max_age = current_app.config.get('STATIC_MAX_AGE', 31536000)
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.cache_control.immutable = True
+        return response
+
+    if (request.method != 'GET' or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    min_size = current_app.config.get('COMPRESS_MIN_SIZE', 500)
+    if (accepts_encoding('gzip')
+            and 'Content-Encoding' not in response.headers
+            and response.content_length and response.content_length >= min_size):
+        # mtime=0 keeps the output (and therefore the ETag) deterministic
+        response.set_data(gzip.compress(response.get_data(),
+                                        compresslevel=current_app.config.get('COMPRESS_LEVEL', 6),
+                                        mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+
+    if not response.headers.get('ETag'):
+        response.add_etag()
+    if 'Cache-Control' not in response.headers:
+        # Pages may show user-specific content; let browsers revalidate instead
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command():
+    """Write .gz (and .br, when Brotli is installed) copies of static assets.
+
+    Copies made from earlier versions of a file are removed.
+    """
+    app = current_app
+    written = 0
+    for root, _dirs, files in os.walk(app.static_folder):
+        for name in files:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            fingerprint = static_fingerprint(app, os.path.relpath(path, app.static_folder).replace(os.sep, '/'))
+            with open(path, 'rb') as f:
+                data = f.read()
+            copies = {compressed_name(name, fingerprint, 'gzip'): lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                copies[compressed_name(name, fingerprint, 'br')] = lambda: brotli.compress(data)
+            stale = re.compile(re.escape(name) + r'(\.[0-9a-f]+)?\.(gz|br)$')
+            for other in files:
+                if stale.match(other) and other not in copies:
+                    os.remove(os.path.join(root, other))
+            for copy, compress in copies.items():
+                if not os.path.exists(os.path.join(root, copy)):
+                    with open(os.path.join(root, copy), 'wb') as f:
+                        f.write(compress())
+                    written += 1
+    click.echo(f'Wrote {written} compressed files.')
+
+
+def init_http_cache(app):
+    """Register fingerprinted static URLs, compression and conditional GET."""
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = static_fingerprint(app, values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+
+    app.view_functions['static'] = serve_static
+    app.after_request(_finalize_response)
+    app.cli.add_command(compress_static_command)
@@ -0,0 +1,134 @@
+"""iCalendar (RFC 5545) output: invitation attachments and organizer feeds.
+
+An event's VEVENT is rendered once per version (``Event.updatedAt``) and
+kept in a bounded in-process cache, so attaching it to every invitation of
+a campaign, or serving it in a feed that calendar clients poll every few
+minutes, does not render it again. A feed's ETag is derived from the ids
+and versions of its events alone: a conditional request is answered with
+304 after one narrow query, without loading or rendering any event.
+
+Event dates are stored without a time zone and shown to guests as entered,
+so they are written as floating times (local wherever the calendar is).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask import current_app
+
+from models import db, Event
+
+PRODID = '-//Trisect//RSVP Manager//EN'
+
+_vevents = OrderedDict()  # (event id, version) -> VEVENT text, least recently used first
+_vevents_lock = threading.Lock()
+
+
+def escape_text(value):
+    """Escape a TEXT property value."""
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+
+
+def fold(line):
+    """Fold a content line into CRLF-terminated lines of at most 75 octets."""
+    data = line.encode('utf-8')
+    parts = []
+    limit = 75
+    while len(data) > limit:
+        cut = limit
+        while data[cut] & 0xC0 == 0x80:  # Do not split a UTF-8 sequence
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+        limit = 74  # Continuation lines start with a space
+    parts.append(data)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def event_version(event):
+    return event.updatedAt or event.createdAt
+
+
+def _utc_stamp(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def _render_vevent(event):
+    config = current_app.config
+    version = event_version(event)
+    end = event.date + timedelta(hours=config.get('CALENDAR_EVENT_HOURS', 2))
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:event-{event.id}@{config.get('CALENDAR_UID_DOMAIN', 'rsvp-manager')}",
+        f'DTSTAMP:{_utc_stamp(version)}',
+        f'LAST-MODIFIED:{_utc_stamp(version)}',
+        f'SEQUENCE:{int(version.timestamp())}',  # Grows with every change, so updates replace the old copy
+        f"DTSTART:{event.date.strftime('%Y%m%dT%H%M%S')}",
+        f"DTEND:{end.strftime('%Y%m%dT%H%M%S')}",
+        f'SUMMARY:{escape_text(event.title)}',
+    ]
+    if event.location:
+        lines.append(f'LOCATION:{escape_text(event.location)}')
+    if event.description:
+        lines.append(f'DESCRIPTION:{escape_text(event.description)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+def vevent(event):
+    """The event's VEVENT, rendered at most once per event version."""
+    key = (event.id, event_version(event))
+    with _vevents_lock:
+        text = _vevents.get(key)
+        if text is not None:
+            _vevents.move_to_end(key)
+            return text
+    text = _render_vevent(event)
+    with _vevents_lock:
+        _vevents[key] = text
+        while len(_vevents) > current_app.config.get('CALENDAR_CACHE_SIZE', 2000):
+            _vevents.popitem(last=False)
+    return text
+
+
+def calendar(vevents, method=None, name=None):
+    """A VCALENDAR document (bytes) around already rendered VEVENTs."""
+    head = ['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN']
+    if method:
+        head.append(f'METHOD:{method}')
+    if name:
+        head.append(f'X-WR-CALNAME:{escape_text(name)}')
+        refresh = current_app.config.get('CALENDAR_REFRESH_MINUTES', 60)
+        head.append(f'REFRESH-INTERVAL;VALUE=DURATION:PT{refresh}M')
+    return (''.join(fold(line) for line in head) + ''.join(vevents) + 'END:VCALENDAR\r\n').encode('utf-8')
+
+
+def event_calendar(event):
+    """A calendar file with just this event, for invitation attachments."""
+    return calendar([vevent(event)], method='PUBLISH')
+
+
+def feed_versions(organizer_id):
+    """``[(event id, version)]`` of the organizer's events: all a feed ETag needs."""
+    return db.session.query(Event.id, db.func.coalesce(Event.updatedAt, Event.createdAt)) \
+        .filter(Event.organizerId == organizer_id).order_by(Event.date, Event.id).all()
+
+
+def feed_etag(organizer, versions):
+    digest = hashlib.sha1(f'{organizer.id}:{organizer.name}'.encode('utf-8'))
+    for event_id, version in versions:
+        digest.update(f'|{event_id}:{version}'.encode('ascii'))
+    return digest.hexdigest()
+
+
+def organizer_feed(organizer):
+    """The organizer's subscribable calendar with all of their (live) events."""
+    events = Event.query.filter_by(organizerId=organizer.id).order_by(Event.date, Event.id).all()
+    return calendar([vevent(event) for event in events], name=f'{organizer.name} - Events')
+
+
+def clear_calendar_cache():
+    with _vevents_lock:
+        _vevents.clear()
@@ -0,0 +1,171 @@
+"""Mail composition.
+
+Mail templates are compiled once when the app starts, and MIME parts that
+are the same in every message (the logo, an event's calendar file) are
+encoded once and shared by all messages, so composing a message only
+renders and encodes its HTML and, for invitations, the guest's QR code.
+Messages are ``multipart/related``: the HTML refers to its images by
+Content-ID. Invitations are wrapped in ``multipart/mixed`` with the event's
+``.ics`` attached. Cc, Reply-To, extra headers, a plain-text ``body`` and
+attachments added with ``Message.attach`` are kept as Flask-Mail keeps them.
+Everything user-supplied is rendered through autoescaped templates.
+"""
+import os
+from email import policy
+from email.encoders import encode_base64
+from email.mime.base import MIMEBase
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+from flask import current_app
+from flask_mail import Message, sanitize_address, sanitize_addresses, sanitize_subject
+
+from ical import event_calendar, event_version
+from tracing import span
+
+MAIL_TEMPLATES = ('invite.html', 'reminder.html', 'reset_email.html', 'contact_email.html')
+LOGO_FILE = os.path.join('icon', 'logo.png')  # Under the static folder
+CALENDAR_PARTS_KEPT = 64  # Events whose encoded .ics part is kept
+
+
+def inline_image(data, content_id, filename):
+    """A base64-encoded PNG part the HTML can show as ``cid:<content_id>``."""
+    part = MIMEImage(data, 'png')
+    part.add_header('Content-ID', f'<{content_id}>')
+    part.add_header('Content-Disposition', 'inline', filename=filename)
+    return part
+
+
+class ComposedMessage(Message):
+    """A Message built from rendered HTML and already encoded inline parts.
+
+    Flask-Mail re-encodes every attachment each time a message is
+    serialized; these parts are encoded when they are created and may be
+    shared between messages.
+    """
+
+    def __init__(self, inline_parts=(), attachment_parts=(), **kwargs):
+        super().__init__(**kwargs)
+        self.inline_parts = list(inline_parts)
+        self.attachment_parts = list(attachment_parts)
+
+    def _message(self):
+        encoding = self.charset or 'utf-8'
+        msg = MIMEMultipart('related')
+        msg.attach(MIMEText(self.html, 'html', encoding))
+        for part in self.inline_parts:
+            msg.attach(part)
+        if self.body:
+            related, msg = msg, MIMEMultipart('alternative')
+            msg.attach(MIMEText(self.body, 'plain', encoding))
+            msg.attach(related)
+        attachments = self.attachment_parts + [_attachment_part(a) for a in self.attachments]
+        if attachments:
+            body, msg = msg, MIMEMultipart('mixed')
+            msg.attach(body)
+            for part in attachments:
+                msg.attach(part)
+
+        # The headers Flask-Mail's own _message() writes; Bcc is only in send_to
+        if self.subject:
+            msg['Subject'] = sanitize_subject(self.subject, encoding)
+        msg['From'] = sanitize_address(self.sender, encoding)
+        msg['To'] = ', '.join(sanitize_addresses(self.recipients, encoding))
+        msg['Date'] = formatdate(self.date, localtime=True)
+        msg['Message-ID'] = self.msgId
+        if self.cc:
+            msg['Cc'] = ', '.join(sanitize_addresses(self.cc, encoding))
+        if self.reply_to:
+            msg['Reply-To'] = sanitize_address(self.reply_to, encoding)
+        for name, value in (self.extra_headers or {}).items():
+            msg[name] = value
+        msg.policy = policy.SMTP
+        return msg
+
+
+def _attachment_part(attachment):
+    """A part for an attachment added with Flask-Mail's ``Message.attach``."""
+    part = MIMEBase(*attachment.content_type.split('/'))
+    part.set_payload(attachment.data)
+    encode_base64(part)
+    if attachment.filename is not None:
+        part.add_header('Content-Disposition', attachment.disposition, filename=attachment.filename)
+    for name, value in attachment.headers.items():
+        part.add_header(name, value)
+    return part
+
+
+class MailComposer:
+    """Precompiled mail templates and shared MIME parts of one app."""
+
+    def __init__(self, app):
+        self.templates = {name: app.jinja_env.get_template(name) for name in MAIL_TEMPLATES}
+        with open(os.path.join(app.static_folder, LOGO_FILE), 'rb') as f:
+            self.logo = inline_image(f.read(), 'logo', 'logo.png')
+        self.attach_calendar = app.config.get('CALENDAR_ATTACH_INVITES', True)
+        self._calendar_parts = {}  # (event id, version) -> encoded .ics part
+
+    def calendar_part(self, event):
+        """The event's ``.ics`` attachment, encoded once per event version."""
+        key = (event.id, event_version(event))
+        part = self._calendar_parts.get(key)
+        if part is None:
+            part = MIMEText(event_calendar(event).decode('utf-8'), 'calendar', 'utf-8')
+            part.set_param('method', 'PUBLISH')
+            part.add_header('Content-Disposition', 'attachment', filename='invite.ics')
+            if len(self._calendar_parts) >= CALENDAR_PARTS_KEPT:
+                self._calendar_parts.clear()
+            self._calendar_parts[key] = part
+        return part
+
+    def render(self, template_name, **context):
+        with span('template', template_name):
+            return self.templates[template_name].render(**context)
+
+    def invitation(self, guest, event, rsvp_url, qr_png=None):
+        html = self.render('invite.html', guest=guest, event=event, rsvp_url=rsvp_url, has_qr=bool(qr_png))
+        parts = [self.logo]
+        if qr_png:
+            parts.append(inline_image(qr_png, 'qrcode', 'rsvp_qr_code.png'))
+        attachments = [self.calendar_part(event)] if self.attach_calendar else []
+        return ComposedMessage(parts, attachments, subject=f"You're Invited: {event.title}",
+                               sender=_sender('RSVP Manager'), recipients=[guest.email], html=html)
+
+    def reminder(self, guest, event, rsvp_url, status):
+        if status == 'pending':
+            subject = f"Reminder: Your RSVP is still pending for {event.title}"
+        elif status == 'confirmed':
+            subject = f"Don't forget about {event.title}!"
+        else:
+            subject = f"Reminder: {event.title} is coming up!"
+        html = self.render('reminder.html', guest=guest, event=event, rsvp_url=rsvp_url, recipient_type=status)
+        return ComposedMessage([self.logo], subject=subject, sender=_sender('RSVP Manager'),
+                               recipients=[guest.email], html=html)
+
+    def password_reset(self, email, reset_url):
+        html = self.render('reset_email.html', reset_url=reset_url)
+        return ComposedMessage([self.logo], subject="Password Reset Request",
+                               sender=_sender('Trisect RSVP Manager'), recipients=[email], html=html)
+
+    def contact(self, name, user_email, message):
+        """The contact form submission, sent to the administrator with Reply-To the sender."""
+        html = self.render('contact_email.html', name=name, email=user_email, message=message)
+        # Collapse line breaks so the sender's name cannot add headers
+        subject = f"New Contact Form Submission from {' '.join(name.split())}"
+        return ComposedMessage(subject=subject, sender=_sender('Trisect RSVP Manager'),
+                               recipients=[current_app.config['MAIL_USERNAME']], html=html,
+                               reply_to=user_email.strip())
+
+
+def _sender(display_name):
+    return f"{display_name} <{current_app.config['MAIL_USERNAME']}>"
+
+
+def composer():
+    return current_app.extensions['mail_compose']
+
+
+def init_mail_compose(app):
+    app.extensions['mail_compose'] = MailComposer(app)
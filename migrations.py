@@ -0,0 +1,243 @@
+"""Schema and data upgrades for existing databases.
+
+``db.create_all()`` only creates missing tables, so changes to tables that
+already exist are applied here by ``flask db-upgrade``. Every step is
+idempotent and works in small committed batches, so it can be re-run safely
+and never holds long locks on hot tables.
+"""
+import logging
+from datetime import datetime, time
+
+import click
+from flask.cli import with_appcontext
+
+from sqlalchemy import exists, func, inspect, text
+
+from models import db, Event, Guest, JobRun, Organizer, RsvpChange, record_status_changes
+from guest_import import merge_duplicate_guests
+from seating import recount_seats, seats_taken_subquery
+
+logger = logging.getLogger(__name__)
+
+UPGRADE_STEPS = []
+
+
+def upgrade_step(fn):
+    UPGRADE_STEPS.append(fn)
+    return fn
+
+
+def add_column_if_missing(table, column, ddl):
+    """Add ``column`` to an existing ``table``; returns whether it was added."""
+    if column in {c['name'] for c in inspect(db.engine).get_columns(table)}:
+        return False
+    db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    db.session.commit()
+    return True
+
+
+def create_index_if_missing(model, name):
+    index = next(i for i in model.__table__.indexes if i.name == name)
+    index.create(db.engine, checkfirst=True)
+
+
+def iter_batches(query, model, batch_size):
+    """Yield lists of rows ordered by primary key, one batch at a time."""
+    last_id = 0
+    while True:
+        rows = query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def dedupe_guests(batch_size, dry_run=False):
+    """Merge guests of an event that share a normalized email, a batch of groups at a time."""
+    groups = db.session.query(Guest.eventId, Guest.normalizedEmail) \
+        .filter(Guest.normalizedEmail.isnot(None)) \
+        .group_by(Guest.eventId, Guest.normalizedEmail) \
+        .having(func.count(Guest.id) > 1) \
+        .order_by(Guest.eventId, Guest.normalizedEmail)
+    if dry_run:
+        found = groups.all()
+        removed = sum(Guest.query.filter_by(eventId=e, normalizedEmail=n).count() - 1 for e, n in found)
+        return f'{len(found)} duplicated addresses, {removed} guests would be merged away'
+
+    merged = removed = 0
+    while True:
+        batch = groups.limit(batch_size).all()
+        if not batch:
+            break
+        for event_id, normalized in batch:
+            guests = Guest.query.filter_by(eventId=event_id, normalizedEmail=normalized).all()
+            merge_duplicate_guests(guests)
+            merged += 1
+            removed += len(guests) - 1
+        db.session.flush()
+        for event_id in {event_id for event_id, _ in batch}:
+            recount_seats(event_id)  # Merged-away copies may have held seats
+        db.session.commit()
+        db.session.expunge_all()
+    return f'{merged} duplicated addresses merged, {removed} guests removed'
+
+
+# Columns added to existing tables, as (table, column, DDL)
+NEW_COLUMNS = [
+    ('Guests', 'normalizedEmail', 'VARCHAR(255)'),
+    ('Guests', 'waitlistedAt', 'DATETIME'),
+    ('Events', 'capacity', 'INTEGER'),
+    ('Events', 'seatsTaken', 'INTEGER NOT NULL DEFAULT 0'),
+    ('Events', 'updatedAt', 'DATETIME(6)'),
+    ('Organizers', 'calendarToken', 'VARCHAR(64)'),
+    ('JobRuns', 'scheduledAt', 'DATETIME'),
+    ('Guests', 'invitedAt', 'DATETIME'),
+]
+
+
+@upgrade_step
+def add_new_columns(batch_size):
+    """Add model columns missing from existing tables.
+
+    Runs first: later steps load models, which needs every mapped column.
+    """
+    added = [f'{table}.{column}' for table, column, ddl in NEW_COLUMNS
+             if add_column_if_missing(table, column, ddl)]
+    if db.engine.dialect.name == 'mysql':
+        db.session.execute(text("ALTER TABLE Guests MODIFY status "
+                                "ENUM('pending', 'confirmed', 'declined', 'waitlisted') DEFAULT 'pending'"))
+        db.session.commit()
+    return f'added {", ".join(added)}' if added else 'nothing to add'
+
+
+@upgrade_step
+def normalize_guest_emails(batch_size):
+    """Backfill Guests.normalizedEmail, merge duplicates, then enforce uniqueness."""
+    max_id = db.session.query(func.max(Guest.id)).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        Guest.query.filter(Guest.id > start, Guest.id <= start + batch_size,
+                           Guest.normalizedEmail.is_(None)) \
+            .update({'normalizedEmail': func.lower(func.trim(Guest.email))}, synchronize_session=False)
+        db.session.commit()
+    result = dedupe_guests(batch_size)
+    create_index_if_missing(Guest, 'uq_guest_event_email')
+    return result
+
+
+@upgrade_step
+def convert_custom_field_blobs(batch_size):
+    """Turn json.dumps() strings stored in JSON columns into questions and answers."""
+    events = 0
+    for batch in iter_batches(Event.query, Event, batch_size):
+        for event in batch:
+            if isinstance(event.customFields, str):
+                event.customFields = event.get_custom_fields()
+            event.sync_questions()
+        db.session.commit()
+        db.session.expunge_all()
+        events += len(batch)
+
+    guests = 0
+    for batch in iter_batches(Guest.query.filter(Guest.responses.isnot(None)), Guest, batch_size):
+        for guest in batch:
+            responses = guest.get_responses()
+            if isinstance(guest.responses, str):
+                guest.responses = responses
+            if responses:
+                guest.set_answers(responses)
+        db.session.commit()
+        db.session.expunge_all()
+        guests += len(batch)
+
+    return f'{events} events and {guests} guest responses checked'
+
+
+@upgrade_step
+def seed_rsvp_rollups(batch_size):
+    """Seed the change log and daily rollups of events that predate them.
+
+    Only each guest's current answer is known, so it is logged once as a
+    change from 'pending' on the day of the guest's last update.
+    """
+    seeded = 0
+    unseeded = Event.query.filter(~exists().where(RsvpChange.eventId == Event.id))
+    for batch in iter_batches(unseeded, Event, batch_size):
+        for event in batch:
+            for status in ('confirmed', 'declined'):
+                rows = db.session.query(Guest.id, Guest.updatedAt) \
+                    .filter(Guest.eventId == event.id, Guest.status == status).all()
+                by_day = {}
+                for guest_id, updated_at in rows:
+                    by_day.setdefault(updated_at.date(), []).append((guest_id, 'pending'))
+                for day, guests in by_day.items():
+                    record_status_changes(event.id, guests, status, datetime.combine(day, time()))
+                seeded += len(rows)
+        db.session.commit()
+        db.session.expunge_all()
+    return f'{seeded} guest responses seeded'
+
+
+@upgrade_step
+def recount_event_seats(batch_size):
+    """Set Events.seatsTaken from confirmed guests, in id ranges."""
+    max_id = db.session.query(func.max(Event.id)).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        Event.query.filter(Event.id > start, Event.id <= start + batch_size) \
+            .update({'seatsTaken': seats_taken_subquery(Event.id)}, synchronize_session=False)
+        db.session.commit()
+    return f'{max_id} events recounted'
+
+
+@upgrade_step
+def index_event_dates(batch_size):
+    """Index Events.date for the reminder and archival range scans."""
+    create_index_if_missing(Event, 'ix_Events_date')
+    return 'done'
+
+
+@upgrade_step
+def version_event_calendars(batch_size):
+    """Backfill Events.updatedAt, which versions calendar data, and index calendar tokens."""
+    max_id = db.session.query(func.max(Event.id)).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        Event.query.filter(Event.id > start, Event.id <= start + batch_size, Event.updatedAt.is_(None)) \
+            .update({'updatedAt': func.coalesce(Event.createdAt, func.current_timestamp())},
+                    synchronize_session=False)
+        db.session.commit()
+    create_index_if_missing(Organizer, 'uq_organizer_calendar_token')
+    return f'{max_id} events checked'
+
+
+@upgrade_step
+def index_job_schedules(batch_size):
+    """Make each (job, fire time) claimable once."""
+    create_index_if_missing(JobRun, 'uq_job_run_schedule')
+    return 'done'
+
+
+def run_upgrades(batch_size=500):
+    db.create_all()
+    results = []
+    for step in UPGRADE_STEPS:
+        result = step(batch_size)
+        logger.info('Upgrade step finished', extra={'step': step.__name__, 'result': result})
+        results.append((step.__name__, result))
+    return results
+
+
+@click.command('db-upgrade')
+@click.option('--batch-size', default=500, show_default=True, help='Rows per committed batch.')
+@with_appcontext
+def upgrade_command(batch_size):
+    """Apply schema and data upgrades to an existing database."""
+    for name, result in run_upgrades(batch_size):
+        click.echo(f'{name}: {result}')
+
+
+@click.command('dedupe-guests')
+@click.option('--batch-size', default=500, show_default=True, help='Duplicated addresses per committed batch.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be merged.')
+@with_appcontext
+def dedupe_command(batch_size, dry_run):
+    """Merge guests of an event that share an email address."""
+    click.echo(dedupe_guests(batch_size, dry_run=dry_run))
@@ -1,18 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import validates
 from datetime import datetime
 import json
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Organizer(db.Model, UserMixin):
     __tablename__ = 'Organizers'
+    __table_args__ = (
+        db.Index('uq_organizer_calendar_token', 'calendarToken', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(255), unique=True, nullable=False)
     passwordHash = db.Column(db.String(255), nullable=False)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
+    calendarToken = db.Column(db.String(64), nullable=True)  # Secret of the ICS feed URL; None until requested
     createdAt = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp())
     
     events = db.relationship('Event', backref='organizer', lazy=True)
@@ -23,54 +31,417 @@ class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, index=True)  # Reminder and archival range scans
     location = db.Column(db.String(255))
     organizerId = db.Column(db.Integer, db.ForeignKey('Organizers.id', ondelete='CASCADE'))
     customFields = db.Column(db.JSON)
+    capacity = db.Column(db.Integer, nullable=True)  # Seats including plus ones; None is unlimited
+    seatsTaken = db.Column(db.Integer, nullable=False, default=0)  # Only changed through seating.py
     createdAt = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp())
+    # Last change of what calendars show (title, description, date, location); versions cached ICS
+    updatedAt = db.Column(db.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql'), default=datetime.utcnow)
     
     guests = db.relationship('Guest', backref='event', lazy=True)
+    questions = db.relationship('EventQuestion', backref='event', lazy=True,
+                                order_by='EventQuestion.position', cascade='all, delete-orphan')
+    
+    @validates('title', 'description', 'date', 'location')
+    def _touch(self, key, value):
+        if getattr(self, key) != value:
+            self.updatedAt = datetime.utcnow()
+        return value
     
     def get_custom_fields(self):
-        return json.loads(self.customFields) if self.customFields else {}
+        """Parsed custom fields, memoized until customFields is reassigned."""
+        return _memoized_json(self, 'customFields', '_custom_fields_cache')
+    
+    def set_custom_fields(self, custom_fields):
+        self.customFields = custom_fields
+        self.sync_questions()
+    
+    def sync_questions(self):
+        """Create, update or remove EventQuestion rows to match customFields."""
+        wanted = questions_for_fields(self.get_custom_fields())
+        existing = {q.key: q for q in self.questions}
+        for position, (key, label, kind, options) in enumerate(wanted):
+            question = existing.pop(key, None)
+            if question is None:
+                question = EventQuestion(key=key)
+                self.questions.append(question)
+            question.label = label
+            question.kind = kind
+            question.options = options
+            question.position = position
+        for question in existing.values():
+            self.questions.remove(question)
     
     def get_rsvp_stats(self):
         confirmed = sum(1 for g in self.guests if g.status == 'confirmed')
         declined = sum(1 for g in self.guests if g.status == 'declined')
         pending = sum(1 for g in self.guests if g.status == 'pending')
+        waitlisted = sum(1 for g in self.guests if g.status == 'waitlisted')
         total_plus_ones = sum(g.plusOneCount for g in self.guests if g.status == 'confirmed')
         
         return {
             'confirmed': confirmed,
             'declined': declined,
             'pending': pending,
+            'waitlisted': waitlisted,
             'total_attending': confirmed + total_plus_ones
         }
+    
+    def seats_left(self):
+        return None if self.capacity is None else max(0, self.capacity - self.seatsTaken)
 
 class Guest(db.Model):
     __tablename__ = 'Guests'
+    __table_args__ = (
+        db.Index('uq_guest_event_email', 'eventId', 'normalizedEmail', unique=True),
+    )
+    
+    # Higher ranks win when duplicate guests are merged
+    STATUS_RANK = {'pending': 0, 'declined': 1, 'waitlisted': 2, 'confirmed': 3}
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     eventId = db.Column(db.Integer, db.ForeignKey('Events.id', ondelete='CASCADE'))
     name = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(255), nullable=False)
+    normalizedEmail = db.Column(db.String(255))
     phone = db.Column(db.String(20))
-    status = db.Column(db.Enum('pending', 'confirmed', 'declined'), default='pending')
+    status = db.Column(db.Enum('pending', 'confirmed', 'declined', 'waitlisted'), default='pending')
+    waitlistedAt = db.Column(db.DateTime, nullable=True)  # Waitlist order
     responses = db.Column(db.JSON)
     plusOneCount = db.Column(db.Integer, default=0)
     uniqueAccessToken = db.Column(db.String(255), unique=True, nullable=False)
     lastReminderSent = db.Column(db.TIMESTAMP, nullable=True)
+    invitedAt = db.Column(db.DateTime, nullable=True)  # Last invitation handed to the mail server, by any path
     createdAt = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp())
     updatedAt = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp(),
                          onupdate=db.func.current_timestamp())
     
+    answers = db.relationship('GuestAnswer', backref='guest', lazy=True, cascade='all, delete-orphan')
+    
+    @validates('email')
+    def _normalize_email(self, key, email):
+        self.normalizedEmail = normalize_email(email)
+        return email
+    
     def get_responses(self):
-        return json.loads(self.responses) if self.responses else {}
+        """Parsed RSVP responses, memoized until responses is reassigned."""
+        return _memoized_json(self, 'responses', '_responses_cache')
+    
+    def set_answers(self, responses):
+        """Store responses as typed GuestAnswer rows for the event's questions."""
+        questions = {q.key: q for q in self.event.questions}
+        existing = {a.questionId: a for a in self.answers}
+        for key, value in responses.items():
+            question = questions.get(key)
+            if question is None:
+                continue
+            answer = existing.get(question.id)
+            if answer is None:
+                answer = GuestAnswer(question=question, eventId=self.eventId)
+                self.answers.append(answer)
+            answer.set_value(question.kind, value)
     
-    def update_status(self, status, plus_one_count=None, responses=None):
+    def update_status(self, status, plus_one_count=None, responses=None, at=None, changes=None):
+        """Set the guest's answer and log the status change.
+
+        With a ``changes`` list the change is appended to it, for the caller
+        to log many at once with ``log_status_changes``.
+        """
+        at = at or datetime.utcnow()
+        if status != self.status:
+            change = status_change(self.eventId, self.id, self.status, status, at, plus_one_count)
+            if changes is None:
+                log_status_changes([change])
+            else:
+                changes.append(change)
         self.status = status
         if plus_one_count is not None:
             self.plusOneCount = plus_one_count
         if responses:
-            self.responses = json.dumps(responses)
-        self.updatedAt = datetime.utcnow()
\ No newline at end of file
+            self.responses = responses
+            self.set_answers(responses)
+        # An explicit value replaces the onupdate default, so the column is
+        # written once and records when the guest answered, not when a
+        # queued submission was applied
+        self.updatedAt = at
+
+class EventQuestion(db.Model):
+    """A custom question asked on an event's RSVP form."""
+    __tablename__ = 'EventQuestions'
+    __table_args__ = (
+        db.UniqueConstraint('eventId', 'key', name='uq_event_question_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    eventId = db.Column(db.Integer, db.ForeignKey('Events.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)  # Key used in RSVP responses, e.g. 'meal_choice'
+    label = db.Column(db.String(255), nullable=False)
+    kind = db.Column(db.Enum('choice', 'text', 'acknowledgement'), nullable=False)
+    options = db.Column(db.JSON)  # Allowed values for 'choice' questions
+    position = db.Column(db.Integer, default=0)
+
+class GuestAnswer(db.Model):
+    """A guest's typed answer to one EventQuestion."""
+    __tablename__ = 'GuestAnswers'
+    __table_args__ = (
+        db.UniqueConstraint('guestId', 'questionId', name='uq_guest_answer_question'),
+        db.Index('ix_guest_answer_question_choice', 'questionId', 'choice'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    guestId = db.Column(db.Integer, db.ForeignKey('Guests.id', ondelete='CASCADE'), nullable=False)
+    questionId = db.Column(db.Integer, db.ForeignKey('EventQuestions.id', ondelete='CASCADE'), nullable=False)
+    eventId = db.Column(db.Integer, db.ForeignKey('Events.id', ondelete='CASCADE'), nullable=False, index=True)
+    choice = db.Column(db.String(255))  # 'choice' questions
+    text = db.Column(db.Text)  # 'text' questions
+    flag = db.Column(db.Boolean)  # 'acknowledgement' questions
+    
+    question = db.relationship('EventQuestion', backref=db.backref('answers', cascade='all, delete-orphan'))
+    
+    def set_value(self, kind, value):
+        self.choice = str(value)[:255] if kind == 'choice' and value not in (None, '') else None
+        self.text = value if kind == 'text' and value else None
+        self.flag = bool(value) if kind == 'acknowledgement' else None
+
+class InvitationCampaign(db.Model):
+    """A batch of invitations sent to the guests of an event matching a filter."""
+    __tablename__ = 'InvitationCampaigns'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    eventId = db.Column(db.Integer, db.ForeignKey('Events.id', ondelete='CASCADE'), nullable=False, index=True)
+    createdBy = db.Column(db.Integer, db.ForeignKey('Organizers.id', ondelete='SET NULL'))
+    guestFilter = db.Column(db.String(20), nullable=False, default='all')
+    state = db.Column(db.Enum('running', 'paused', 'completed'), nullable=False, default='running')
+    baseUrl = db.Column(db.String(255), nullable=False)  # Used to build RSVP links outside a request
+    createdAt = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp())
+    finishedAt = db.Column(db.TIMESTAMP, nullable=True)
+    
+    event = db.relationship('Event', backref=db.backref('campaigns', lazy=True, cascade='all, delete-orphan'))
+    
+    def get_progress(self):
+        """Recipient counts per state plus the campaign state."""
+        counts = dict(db.session.query(CampaignRecipient.state, db.func.count(CampaignRecipient.id))
+                      .filter(CampaignRecipient.campaignId == self.id)
+                      .group_by(CampaignRecipient.state).all())
+        progress = {state: counts.get(state, 0) for state in CampaignRecipient.STATES}
+        progress['total'] = sum(progress.values())
+        return {
+            'id': self.id,
+            'state': self.state,
+            'guestFilter': self.guestFilter,
+            'createdAt': self.createdAt.strftime('%Y-%m-%d %H:%M') if self.createdAt else None,
+            'progress': progress
+        }
+
+class CampaignRecipient(db.Model):
+    """Delivery state of one guest's invitation within a campaign."""
+    __tablename__ = 'CampaignRecipients'
+    __table_args__ = (
+        db.UniqueConstraint('campaignId', 'guestId', name='uq_campaign_recipient_guest'),
+        db.Index('ix_campaign_recipient_state', 'campaignId', 'state'),
+    )
+    
+    STATES = ('queued', 'sent', 'failed', 'bounced')
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    campaignId = db.Column(db.Integer, db.ForeignKey('InvitationCampaigns.id', ondelete='CASCADE'), nullable=False)
+    guestId = db.Column(db.Integer, db.ForeignKey('Guests.id', ondelete='CASCADE'), nullable=False, index=True)
+    state = db.Column(db.Enum(*STATES), nullable=False, default='queued')
+    error = db.Column(db.String(255))
+    sentAt = db.Column(db.TIMESTAMP, nullable=True)
+    
+    guest = db.relationship('Guest', backref=db.backref('campaign_recipients', lazy=True,
+                                                         cascade='all, delete-orphan'))
+
+class RsvpChange(db.Model):
+    """Append-only log of guest status changes."""
+    __tablename__ = 'RsvpChanges'
+    __table_args__ = (
+        db.Index('ix_rsvp_change_event_time', 'eventId', 'changedAt'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    eventId = db.Column(db.Integer, db.ForeignKey('Events.id', ondelete='CASCADE'), nullable=False)
+    guestId = db.Column(db.Integer, db.ForeignKey('Guests.id', ondelete='SET NULL'), nullable=True)
+    fromStatus = db.Column(db.String(20))
+    toStatus = db.Column(db.String(20), nullable=False)
+    plusOneCount = db.Column(db.Integer)
+    changedAt = db.Column(db.DateTime, nullable=False)
+
+class RsvpDailyRollup(db.Model):
+    """Per-event, per-day counters maintained on every status change."""
+    __tablename__ = 'RsvpDailyRollups'
+    
+    eventId = db.Column(db.Integer, db.ForeignKey('Events.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    responses = db.Column(db.Integer, nullable=False, default=0)  # First answers (pending -> answered)
+    changes = db.Column(db.Integer, nullable=False, default=0)  # Answers changed after the first one
+    confirmed = db.Column(db.Integer, nullable=False, default=0)  # Changes into 'confirmed'
+    declined = db.Column(db.Integer, nullable=False, default=0)  # Changes into 'declined'
+
+ROLLUP_COUNTERS = ('responses', 'changes', 'confirmed', 'declined')
+
+def rollup_deltas(from_status, to_status):
+    """Counter increments for one status change."""
+    deltas = dict.fromkeys(ROLLUP_COUNTERS, 0)
+    if from_status in (None, 'pending'):
+        deltas['responses'] += 1 if to_status != 'pending' else 0
+    elif (from_status, to_status) != ('waitlisted', 'confirmed'):  # Promotion is not a change of answer
+        deltas['changes'] += 1
+    if to_status in ('confirmed', 'declined'):
+        deltas[to_status] += 1
+    return deltas
+
+def bump_daily_rollup(event_id, day, deltas):
+    """Atomically add ``deltas`` to an event's rollup row for ``day``."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    table = RsvpDailyRollup.__table__
+    values = dict.fromkeys(ROLLUP_COUNTERS, 0)
+    values.update(deltas, eventId=event_id, day=day)
+    dialect = db.session.get_bind(mapper=RsvpDailyRollup).dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update({k: table.c[k] + stmt.inserted[k] for k in deltas})
+    else:
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(index_elements=['eventId', 'day'],
+                                          set_={k: table.c[k] + stmt.excluded[k] for k in deltas})
+    db.session.execute(stmt)
+
+def status_change(event_id, guest_id, from_status, to_status, at, plus_one_count=None):
+    """An RsvpChanges row, as ``log_status_changes`` takes it."""
+    return {'eventId': event_id, 'guestId': guest_id, 'fromStatus': from_status,
+            'toStatus': to_status, 'plusOneCount': plus_one_count, 'changedAt': at}
+
+def log_status_changes(changes):
+    """Insert ``status_change`` rows in one statement and bump each (event, day) rollup once."""
+    changes = [c for c in changes if c['fromStatus'] != c['toStatus']]
+    if not changes:
+        return
+    db.session.execute(RsvpChange.__table__.insert(), changes)
+    rollups = {}
+    for change in changes:
+        totals = rollups.setdefault((change['eventId'], change['changedAt'].date()),
+                                    dict.fromkeys(ROLLUP_COUNTERS, 0))
+        for key, value in rollup_deltas(change['fromStatus'], change['toStatus']).items():
+            totals[key] += value
+    for (event_id, day), totals in rollups.items():
+        bump_daily_rollup(event_id, day, totals)
+
+def record_status_changes(event_id, guests, to_status, at, plus_one_count=None):
+    """Log status changes for ``(guest_id, from_status)`` pairs and update the day's rollup."""
+    log_status_changes([status_change(event_id, guest_id, from_status, to_status, at, plus_one_count)
+                        for guest_id, from_status in guests])
+
+class JobLock(db.Model):
+    """Lease held by the scheduler process currently running a job."""
+    __tablename__ = 'JobLocks'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    lockedUntil = db.Column(db.DateTime, nullable=False)
+
+class JobRun(db.Model):
+    """History of scheduled job executions."""
+    __tablename__ = 'JobRuns'
+    __table_args__ = (
+        db.Index('ix_job_run_name_started', 'jobName', 'startedAt'),
+        db.Index('uq_job_run_schedule', 'jobName', 'scheduledAt', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    jobName = db.Column(db.String(100), nullable=False)
+    owner = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.Enum('running', 'ok', 'error'), nullable=False, default='running')
+    scheduledAt = db.Column(db.DateTime, nullable=True)  # Fire time the run belongs to; claims it once
+    startedAt = db.Column(db.DateTime, nullable=False)
+    finishedAt = db.Column(db.DateTime)
+    durationMs = db.Column(db.Integer)
+    error = db.Column(db.Text)
+
+class ReplicaHeartbeat(db.Model):
+    """Single row rewritten on the primary; replicas' copies show their lag."""
+    __tablename__ = 'ReplicaHeartbeats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beatAt = db.Column(db.DateTime, nullable=False)
+
+class RateLimitBucket(db.Model):
+    """Token bucket of one rate-limited client and scope (database backend)."""
+    __tablename__ = 'RateLimitBuckets'
+    
+    key = db.Column(db.String(191), primary_key=True)  # '<scope>:organizer:<id>' or '<scope>:ip:<address>'
+    tokens = db.Column(db.Float, nullable=False)
+    updatedAt = db.Column(db.DateTime, nullable=False)
+
+class MailQuota(db.Model):
+    """Messages a client sent on one (UTC) day (database backend)."""
+    __tablename__ = 'MailQuotas'
+    
+    key = db.Column(db.String(191), primary_key=True)  # 'organizer:<id>' or 'ip:<address>'
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchivedEvent(db.Model):
+    """A past event moved out of the live tables, with its final stats.
+
+    ``payload`` holds every row of the event as gzip-compressed JSON lines;
+    see archive.py.
+    """
+    __tablename__ = 'ArchivedEvents'
+    
+    id = db.Column(db.Integer, primary_key=True)  # The event's original id
+    organizerId = db.Column(db.Integer, db.ForeignKey('Organizers.id', ondelete='CASCADE'), index=True)
+    title = db.Column(db.String(255), nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    location = db.Column(db.String(255))
+    guests = db.Column(db.Integer, nullable=False, default=0)
+    confirmed = db.Column(db.Integer, nullable=False, default=0)
+    declined = db.Column(db.Integer, nullable=False, default=0)
+    pending = db.Column(db.Integer, nullable=False, default=0)
+    waitlisted = db.Column(db.Integer, nullable=False, default=0)
+    attending = db.Column(db.Integer, nullable=False, default=0)  # Confirmed guests plus their plus ones
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    payload = db.deferred(db.Column(db.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=False))
+    archivedAt = db.Column(db.DateTime, nullable=False)
+    deletedAt = db.Column(db.DateTime)  # Set once the live rows are gone
+
+def normalize_email(email):
+    """Comparison form of an email address: trimmed and lower-cased."""
+    return email.strip().lower() if email else email
+
+def questions_for_fields(custom_fields):
+    """(key, label, kind, options) for the RSVP questions an event's custom fields imply."""
+    questions = []
+    if custom_fields.get('meal_options'):
+        questions.append(('meal_choice', 'Meal Preference', 'choice', list(custom_fields['meal_options'])))
+    if custom_fields.get('dress_code'):
+        questions.append(('dress_code_ack', 'Dress Code Acknowledged', 'acknowledgement', None))
+    if custom_fields.get('additional_info'):
+        questions.append(('additional_notes', 'Additional Notes', 'text', None))
+    return questions
+
+def _memoized_json(instance, attr, cache_attr):
+    """Parse a JSON column once per assigned value.
+
+    Older rows hold a json.dumps() string inside the JSON column; those are
+    decoded here until ``flask db-upgrade`` rewrites them.
+    """
+    raw = getattr(instance, attr)
+    cached = instance.__dict__.get(cache_attr)
+    if cached is not None and cached[0] is raw:
+        return cached[1]
+    if not raw:
+        parsed = {}
+    elif isinstance(raw, str):
+        parsed = json.loads(raw)
+    else:
+        parsed = raw
+    instance.__dict__[cache_attr] = (raw, parsed)
+    return parsed
\ No newline at end of file
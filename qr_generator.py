@@ -2,6 +2,10 @@ import qrcode
 from io import BytesIO
 from flask import url_for
 from config import Config
+from tracing import span
+import logging
+
+logger = logging.getLogger(__name__)
 
 def generate_rsvp_qr(guest_token, size=10):
     """Generate QR code for RSVP link"""
@@ -13,19 +17,20 @@ def generate_rsvp_qr(guest_token, size=10):
             border=4,
         )
         
-        # Create RSVP URL with _external=True to get full URL
-        rsvp_url = url_for('routes.rsvp_page', token=guest_token, _external=True)
-        qr.add_data(rsvp_url)
-        qr.make(fit=True)
+        with span('qr', 'generate'):
+            # Create RSVP URL with _external=True to get full URL
+            rsvp_url = url_for('routes.rsvp_page', token=guest_token, _external=True)
+            qr.add_data(rsvp_url)
+            qr.make(fit=True)
 
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save to BytesIO
-        img_io = BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
+            img = qr.make_image(fill_color="black", back_color="white")
+            
+            # Save to BytesIO
+            img_io = BytesIO()
+            img.save(img_io, 'PNG')
+            img_io.seek(0)
         
         return img_io
-    except Exception as e:
-        print(f"QR Generation error: {e}")
+    except Exception:
+        logger.exception("QR Generation error")
         return None
\ No newline at end of file
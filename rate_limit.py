@@ -0,0 +1,256 @@
+"""Rate limits and daily mail quotas.
+
+Mail-sending endpoints are limited twice, before any mail work starts:
+
+- ``@rate_limit(scope)`` takes a token from a bucket per organizer (or per
+  client IP for anonymous forms). A bucket holds ``burst`` tokens and
+  refills at ``per_hour`` tokens an hour (``RATE_LIMITS``).
+- ``charge_mail_quota(n)`` counts the messages a request is about to send
+  against a daily quota (``MAIL_DAILY_QUOTA_ORGANIZER`` /
+  ``MAIL_DAILY_QUOTA_IP``) and refuses the whole request if they do not fit.
+
+State lives in one process with ``RATE_LIMIT_BACKEND = 'memory'``, or in
+the database (RateLimitBuckets, MailQuotas) with ``'database'``, so that
+every web node shares it. Refusals raise ``RateLimitExceeded``, answered
+with a 429 for JSON requests and a flash message for form posts.
+"""
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, flash, jsonify, redirect, request
+from flask_login import current_user
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import TooManyRequests
+
+from models import db, MailQuota, RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(TooManyRequests):
+    def __init__(self, scope, key, retry_after, description):
+        self.seconds = max(1, math.ceil(retry_after))
+        super().__init__(description=description, retry_after=self.seconds)
+        self.scope = scope
+        self.key = key
+
+
+def seconds_until_tomorrow():
+    now = datetime.utcnow()
+    return 86400 - (now.hour * 3600 + now.minute * 60 + now.second)
+
+
+def refill(tokens, elapsed, burst, per_hour):
+    return min(burst, tokens + elapsed * per_hour / 3600.0)
+
+
+class MemoryBackend:
+    """Buckets and quotas of this process only.
+
+    At most ``max_keys`` buckets are kept. When there are more, buckets that
+    have refilled (and so are the same as no bucket) are dropped, then the
+    least recently used ones, so anonymous requests from many addresses
+    cannot grow the table without limit.
+    """
+
+    def __init__(self, max_keys=10000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time, burst, per_hour), least recently used first
+        self._max_keys = max_keys
+        self._quotas = {}  # key -> count, for self._day
+        self._day = None
+
+    def take(self, key, burst, per_hour, cost=1):
+        """Take ``cost`` tokens; returns 0, or the seconds until they are available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _, _ = self._buckets.pop(key, (burst, now, burst, per_hour))
+            tokens = refill(tokens, now - updated, burst, per_hour)
+            wait = 0 if tokens >= cost else (cost - tokens) * 3600.0 / per_hour
+            self._buckets[key] = (tokens - cost if not wait else tokens, now, burst, per_hour)
+            if len(self._buckets) > self._max_keys:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        for key, (tokens, updated, burst, per_hour) in list(self._buckets.items()):
+            if refill(tokens, now - updated, burst, per_hour) >= burst:
+                del self._buckets[key]
+        # Leave some room, so the next new keys do not scan the table again
+        while len(self._buckets) > self._max_keys * 9 // 10:
+            self._buckets.popitem(last=False)
+
+    def charge(self, key, count, limit):
+        """Add ``count`` to today's total if it stays within ``limit``; returns whether it did."""
+        with self._lock:
+            today = datetime.utcnow().date()
+            if self._day != today:
+                self._day, self._quotas = today, {}
+            used = self._quotas.get(key, 0)
+            if used + count > limit:
+                return False
+            self._quotas[key] = used + count
+            return True
+
+    def usage(self, limit=50):
+        with self._lock:
+            quotas = dict(self._quotas) if self._day == datetime.utcnow().date() else {}
+        return sorted(quotas.items(), key=lambda item: -item[1])[:limit]
+
+
+class DatabaseBackend:
+    """Buckets and quotas shared by every process through the database.
+
+    Bucket rows are read with ``SELECT ... FOR UPDATE``, and quotas change
+    with conditional UPDATEs, so concurrent requests on several nodes cannot
+    overspend. Each change is its own short transaction on a connection of
+    its own, leaving whatever the request's session has staged untouched.
+    """
+
+    def take(self, key, burst, per_hour, cost=1):
+        table = RateLimitBucket.__table__
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(select(table.c.tokens, table.c.updatedAt)
+                                         .where(table.c.key == key).with_for_update()).first()
+                if row is None:
+                    connection.execute(insert(table).values(key=key, tokens=burst - cost, updatedAt=now))
+                    return 0
+                tokens = refill(row.tokens, (now - row.updatedAt).total_seconds(), burst, per_hour)
+                wait = 0
+                if tokens < cost:
+                    wait = (cost - tokens) * 3600.0 / per_hour
+                else:
+                    tokens -= cost
+                connection.execute(update(table).where(table.c.key == key).values(tokens=tokens, updatedAt=now))
+                return wait
+        except IntegrityError:  # Created concurrently
+            return self.take(key, burst, per_hour, cost)
+
+    def charge(self, key, count, limit):
+        table = MailQuota.__table__
+        today = datetime.utcnow().date()
+        this_day = (table.c.key == key) & (table.c.day == today)
+        try:
+            with db.engine.begin() as connection:
+                charged = connection.execute(update(table).where(this_day, table.c.count + count <= limit)
+                                             .values(count=table.c.count + count)).rowcount
+                if charged:
+                    return True
+                if count > limit or connection.execute(select(table.c.count).where(this_day)).first() is not None:
+                    return False
+                connection.execute(insert(table).values(key=key, day=today, count=count))
+                return True
+        except IntegrityError:  # Created concurrently
+            return self.charge(key, count, limit)
+
+    def usage(self, limit=50):
+        rows = MailQuota.query.filter_by(day=datetime.utcnow().date()) \
+            .order_by(MailQuota.count.desc()).limit(limit)
+        return [(row.key, row.count) for row in rows]
+
+
+class RateLimiter:
+    def __init__(self):
+        self.backend = None
+        self.counters = Counter()  # (scope, 'allowed' | 'limited') in this process
+        self._counter_lock = threading.Lock()
+
+    def init_app(self, app):
+        kind = app.config.get('RATE_LIMIT_BACKEND', 'memory')
+        if kind not in ('memory', 'database'):
+            raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {kind}')
+        self.backend = (MemoryBackend(app.config.get('RATE_LIMIT_MEMORY_KEYS', 10000)) if kind == 'memory'
+                        else DatabaseBackend())
+
+    def count(self, scope, outcome):
+        with self._counter_lock:
+            self.counters[(scope, outcome)] += 1
+
+    def check(self, scope, key):
+        burst, per_hour = current_app.config['RATE_LIMITS'][scope]
+        wait = self.backend.take(f'{scope}:{key}', burst, per_hour)
+        if wait:
+            self.count(scope, 'limited')
+            logger.warning('Rate limit exceeded', extra={'scope': scope, 'key': key})
+            raise RateLimitExceeded(scope, key, wait, 'Too many requests, please try again later.')
+        self.count(scope, 'allowed')
+
+    def charge(self, key, count, limit):
+        if not self.backend.charge(key, count, limit):
+            self.count('mail_quota', 'limited')
+            logger.warning('Daily mail quota exceeded', extra={'key': key, 'messages': count})
+            raise RateLimitExceeded('mail_quota', key, seconds_until_tomorrow(),
+                                    f'This would exceed the daily limit of {limit} emails.')
+        self.count('mail_quota', 'allowed')
+
+    def overview(self):
+        """Counters and today's quota usage for the admin page."""
+        with self._counter_lock:
+            counters = dict(self.counters)
+        scopes = sorted({scope for scope, _ in counters})
+        return {
+            'backend': type(self.backend).__name__,
+            'scopes': [{'scope': scope, 'allowed': counters.get((scope, 'allowed'), 0),
+                        'limited': counters.get((scope, 'limited'), 0)} for scope in scopes],
+            'usage': self.backend.usage()
+        }
+
+
+limiter = RateLimiter()
+
+
+def client_key(by):
+    if by == 'organizer' and current_user.is_authenticated:
+        return f'organizer:{current_user.id}'
+    return f'ip:{request.remote_addr}'
+
+
+def check_rate_limit(scope, by='organizer'):
+    """Take a token from the caller's ``scope`` bucket, or raise RateLimitExceeded."""
+    if current_app.config.get('RATE_LIMIT_ENABLED', True):
+        limiter.check(scope, client_key(by))
+
+
+def rate_limit(scope, by='organizer'):
+    """Check the ``scope`` limit before the view runs; GET requests, which send nothing, are free."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                check_rate_limit(scope, by)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def charge_mail_quota(count, by='organizer'):
+    """Count ``count`` messages against the caller's daily quota, or raise RateLimitExceeded."""
+    if count <= 0 or not current_app.config.get('RATE_LIMIT_ENABLED', True):
+        return
+    key = client_key(by)
+    config = current_app.config
+    limit = config['MAIL_DAILY_QUOTA_ORGANIZER'] if key.startswith('organizer:') else config['MAIL_DAILY_QUOTA_IP']
+    limiter.charge(key, count, limit)
+
+
+def init_rate_limit(app):
+    limiter.init_app(app)
+
+    @app.errorhandler(RateLimitExceeded)
+    def rate_limit_exceeded(error):
+        if request.is_json:
+            response = jsonify({'success': False, 'error': error.description, 'message': error.description})
+            response.status_code = 429
+        else:
+            flash(error.description, 'error')
+            response = redirect(request.url)
+        response.headers['Retry-After'] = str(error.seconds)
+        return response
@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, abort
 from flask_login import login_user, logout_user, login_required, current_user
-from models import db, Organizer, Event, Guest
+from models import db, Organizer, Event, Guest, GuestAnswer, InvitationCampaign, CampaignRecipient, ArchivedEvent, record_status_changes
 from qr_generator import generate_rsvp_qr
-from analytics import get_event_analytics, get_organizer_analytics
+from analytics import (get_event_analytics, get_response_breakdown, get_dashboard_summary,
+                       parse_dashboard_cursor, DASHBOARD_SCOPES)
 from email_utils import send_invitation_email, send_reminder_email, send_password_reset_email, send_contact_email
 import bcrypt
 import secrets
@@ -14,9 +15,28 @@ import csv
 from io import StringIO
 from itsdangerous import URLSafeTimedSerializer
 from functools import wraps
+from tracing import recent_traces
+from http_cache import cached_page
+from rsvp_ingest import ingest_queue
+from db_routing import read_only
+from scheduler import job_overview
+from campaigns import create_campaign, count_campaign_guests, GUEST_FILTERS
+from guest_import import upsert_guest, parse_guest_csv, import_guests
+from seating import apply_rsvp, rebalance_seats, recount_seats, NoSeatsError
+from archive import restore_event
+from access import event_access
+from rate_limit import rate_limit, check_rate_limit, charge_mail_quota, limiter
+from ical import feed_versions, feed_etag, organizer_feed
+from sqlalchemy.exc import IntegrityError
+import logging
+
+logger = logging.getLogger(__name__)
 
 routes = Blueprint('routes', __name__)
 
+GUEST_STATUSES = ('pending', 'confirmed', 'declined', 'waitlisted')
+RSVP_CHOICES = ('pending', 'confirmed', 'declined')  # What guests may answer
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -28,11 +48,13 @@ def admin_required(f):
 
 # Index route
 @routes.route('/')
+@cached_page
 def index():
     return render_template('index.html')
 
 # Homepage route (alternative)
 @routes.route('/home')
+@cached_page
 def home():
     return render_template('index.html')
 
@@ -86,10 +108,62 @@ def logout():
 # Dashboard and event management
 @routes.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
-    events = Event.query.filter_by(organizerId=current_user.id).all()
-    analytics = get_organizer_analytics(current_user.id)
-    return render_template('/organizer.html', events=events, analytics=analytics)
+    # The first page of upcoming events comes with the page; the browser loads the rest
+    summary = get_dashboard_summary(current_user.id, 'upcoming',
+                                    limit=current_app.config.get('DASHBOARD_PAGE_SIZE', 24))
+    archived_events = ArchivedEvent.query.filter_by(organizerId=current_user.id) \
+        .order_by(ArchivedEvent.date.desc()).all()
+    return render_template('/organizer.html', summary=summary, archived_events=archived_events)
+
+@routes.route('/api/dashboard/summary')
+@login_required
+@read_only
+def dashboard_summary():
+    """Event cards and totals of the dashboard, a page at a time."""
+    scope = request.args.get('scope', 'upcoming')
+    if scope not in DASHBOARD_SCOPES:
+        return jsonify({'success': False, 'error': 'Invalid scope'}), 400
+    try:
+        cursor = parse_dashboard_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    config = current_app.config
+    limit = request.args.get('limit', config.get('DASHBOARD_PAGE_SIZE', 24), type=int)
+    limit = max(1, min(limit, config.get('DASHBOARD_MAX_PAGE_SIZE', 100)))
+    return jsonify({'success': True, **get_dashboard_summary(current_user.id, scope, cursor, limit)})
+
+@routes.route('/calendar/link', methods=['POST'])
+@login_required
+def calendar_link():
+    """Create the organizer's calendar feed URL, or replace it so the old one stops working."""
+    current_user.calendarToken = secrets.token_urlsafe(32)
+    db.session.commit()
+    flash('Your calendar feed link is ready. Subscribe to it from your calendar app.')
+    return redirect(url_for('routes.dashboard'))
+
+@routes.route('/calendar/<token>.ics')
+@read_only
+def calendar_feed(token):
+    organizer = Organizer.query.filter_by(calendarToken=token).first_or_404()
+    etag = feed_etag(organizer, feed_versions(organizer.id))
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(organizer_feed(organizer))
+        response.mimetype = 'text/calendar'
+    # Weak: the body may be served gzip-compressed under the same tag
+    response.set_etag(etag, weak=True)
+    return response
+
+def _capacity_from_form():
+    """The "Maximum Guests" field as a positive int, or None for unlimited."""
+    try:
+        capacity = int(request.form.get('max_guests') or 0)
+    except ValueError:
+        return None
+    return capacity if capacity > 0 else None
 
 @routes.route('/event/create', methods=['GET', 'POST'])
 @login_required
@@ -106,9 +180,10 @@ def create_event():
             description=request.form.get('description'),
             date=datetime.strptime(request.form.get('date'), '%Y-%m-%dT%H:%M'),
             location=request.form.get('location'),
-            organizerId=current_user.id,
-            customFields=json.dumps(custom_fields)
+            capacity=_capacity_from_form(),
+            organizerId=current_user.id
         )
+        new_event.set_custom_fields(custom_fields)
         
         db.session.add(new_event)
         db.session.commit()
@@ -118,43 +193,44 @@ def create_event():
 
 @routes.route('/event/<int:event_id>')
 @login_required
-def event_details(event_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        flash('Unauthorized access')
-        return redirect(url_for('routes.dashboard'))
-        
+@read_only
+@event_access(page=True)
+def event_details(event_id, event):
     analytics = get_event_analytics(event_id)
-    return render_template('/view.html', event=event, analytics=analytics)
+    breakdown = get_response_breakdown(event_id)
+    return render_template('/view.html', event=event, analytics=analytics, breakdown=breakdown)
+
+@routes.route('/event/<int:event_id>/reports/responses')
+@login_required
+@read_only
+@event_access()
+def response_report(event_id, event):
+    return jsonify({'eventId': event.id, 'questions': get_response_breakdown(event_id)})
 
 @routes.route('/event/<int:event_id>/guests', methods=['GET', 'POST'])
 @login_required
-def manage_guests(event_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-        
+@event_access()
+def manage_guests(event_id, event):
     if request.method == 'POST':
         data = request.get_json()
-        new_guest = Guest(
-            eventId=event_id,
-            name=data['name'],
-            email=data['email'],
-            phone=data.get('phone'),
-            uniqueAccessToken=secrets.token_urlsafe(32)
-        )
-        db.session.add(new_guest)
-        db.session.commit()
+        if data.get('sendInvite', False):
+            # Before the guest is written, so a refused invitation adds nobody
+            check_rate_limit('invitations')
+            charge_mail_quota(1)
+        # Adding an address that is already on the list updates that guest
+        new_guest, created = upsert_guest(event_id, data['name'], data['email'], data.get('phone'))
         
         qr_image_io = None
         if data.get('sendInvite', False):
             # Generate QR code
             qr_image_io = generate_rsvp_qr(new_guest.uniqueAccessToken)
             # Send invitation email
-            send_invitation_email(new_guest, event, qr_image_io=qr_image_io)
+            if send_invitation_email(new_guest, event, qr_image_io=qr_image_io):
+                db.session.commit()
             
         return jsonify({
             'success': True,
+            'existing': not created,
             'guest': {
                 'id': new_guest.id,
                 'name': new_guest.name,
@@ -168,7 +244,43 @@ def manage_guests(event_id):
         })
     
     guests = Guest.query.filter_by(eventId=event_id).all()
-    return render_template('/guest_list.html', event=event, guests=guests)
+    campaign = InvitationCampaign.query.filter_by(eventId=event_id) \
+        .order_by(InvitationCampaign.id.desc()).first()
+    return render_template('/guest_list.html', event=event, guests=guests,
+                           campaign=campaign.get_progress() if campaign else None,
+                           guest_filters=GUEST_FILTERS)
+
+@routes.route('/event/<int:event_id>/campaigns', methods=['POST'])
+@login_required
+@event_access()
+@rate_limit('campaigns')
+def start_campaign(event_id, event):
+    data = request.get_json() or {}
+    guest_filter = data.get('guestFilter', 'all')
+    if guest_filter not in GUEST_FILTERS:
+        return jsonify({'success': False, 'error': 'Invalid guest filter'}), 400
+    
+    charge_mail_quota(count_campaign_guests(event, guest_filter))
+    campaign = create_campaign(event, guest_filter, base_url=request.host_url,
+                               organizer_id=current_user.id)
+    return jsonify({'success': True, 'campaign': campaign.get_progress()})
+
+@routes.route('/event/<int:event_id>/campaigns/<int:campaign_id>', methods=['GET'])
+@login_required
+@event_access(InvitationCampaign)
+def campaign_progress(event_id, campaign_id, event, campaign):
+    return jsonify(campaign.get_progress())
+
+@routes.route('/event/<int:event_id>/campaigns/<int:campaign_id>/<any(pause, resume):action>', methods=['POST'])
+@login_required
+@event_access(InvitationCampaign)
+def change_campaign_state(event_id, campaign_id, action, event, campaign):
+    if campaign.state == 'completed':
+        return jsonify({'success': False, 'error': 'Campaign already completed'}), 400
+    
+    campaign.state = 'paused' if action == 'pause' else 'running'
+    db.session.commit()
+    return jsonify({'success': True, 'campaign': campaign.get_progress()})
 
 # RSVP handling
 @routes.route('/rsvp/<token>', methods=['GET', 'POST'])
@@ -180,37 +292,53 @@ def rsvp_page(token):
         if request.method == 'POST':
             try:
                 data = request.get_json()
-                if not data:
+                if not data or data.get('status') not in RSVP_CHOICES:
                     return jsonify({'success': False, 'error': 'Invalid request data'}), 400
+                try:
+                    plus_one_count = int(data.get('plus_one_count') or 0)
+                except (TypeError, ValueError):
+                    return jsonify({'success': False, 'error': 'Invalid plus one count'}), 400
+                
+                # Events with a capacity answer right away whether the guest got a seat
+                if current_app.config.get('RSVP_INGEST_MODE') == 'queued' and event.capacity is None:
+                    ingest_queue.submit(guest, data['status'], plus_one_count, data.get('responses', {}))
+                    return jsonify({'success': True, 'queued': True})
                 
-                guest.update_status(
-                    status=data['status'],
-                    plus_one_count=data.get('plus_one_count', 0),
-                    responses=data.get('responses', {})
-                )
+                db.session.refresh(guest, with_for_update=True)
+                try:
+                    status = apply_rsvp(
+                        guest,
+                        status=data['status'],
+                        plus_one_count=plus_one_count,
+                        responses=data.get('responses', {})
+                    )
+                except NoSeatsError as e:
+                    db.session.rollback()
+                    return jsonify({'success': False, 'error': f'Sorry, only {e.seats_left} more seats are available.'}), 409
                 db.session.commit()
-                return jsonify({'success': True})
-            except Exception as e:
+                return jsonify({'success': True, 'status': status})
+            except Exception:
                 db.session.rollback()
-                print(f"Error updating RSVP: {e}")
+                logger.exception("Error updating RSVP", extra={'guest_id': guest.id, 'event_id': guest.eventId})
                 return jsonify({'success': False, 'error': 'Failed to update RSVP'}), 500
         
-        return render_template('/rsvp_page.html', guest=guest, event=event)
-    except Exception as e:
-        print(f"Error in RSVP page: {e}")
+        # A queued submission that is not committed yet wins, so guests
+        # always see their own latest answer
+        pending = ingest_queue.pending_submission(token)
+        current = {
+            'status': pending.status if pending else guest.status,
+            'plus_one_count': pending.plus_one_count if pending else guest.plusOneCount,
+            'responses': (pending.responses if pending and pending.responses else guest.get_responses())
+        }
+        return render_template('/rsvp_page.html', guest=guest, event=event, current=current)
+    except Exception:
+        logger.exception("Error in RSVP page")
         return jsonify({'success': False, 'error': 'Invalid RSVP link'}), 404
 
 @routes.route('/event/<int:event_id>/guest/<int:guest_id>/qr')
 @login_required
-def get_guest_qr(event_id, guest_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-        
-    guest = Guest.query.get_or_404(guest_id)
-    if guest.eventId != event_id:
-        return jsonify({'error': 'Guest not found for this event'}), 404
-    
+@event_access(Guest)
+def get_guest_qr(event_id, guest_id, event, guest):
     qr_image = generate_rsvp_qr(guest.uniqueAccessToken)
     if qr_image:
         return send_file(
@@ -223,15 +351,8 @@ def get_guest_qr(event_id, guest_id):
 
 @routes.route('/event/<int:event_id>/guest/<int:guest_id>/qr/download')
 @login_required
-def download_guest_qr(event_id, guest_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-        
-    guest = Guest.query.get_or_404(guest_id)
-    if guest.eventId != event_id:
-        return jsonify({'error': 'Guest not found for this event'}), 404
-    
+@event_access(Guest)
+def download_guest_qr(event_id, guest_id, event, guest):
     qr_image = generate_rsvp_qr(guest.uniqueAccessToken)
     if qr_image:
         response = make_response(send_file(
@@ -246,10 +367,9 @@ def download_guest_qr(event_id, guest_id):
 
 @routes.route('/event/<int:event_id>/guests/remind', methods=['POST'])
 @login_required
-def send_bulk_reminders(event_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+@event_access()
+@rate_limit('reminders')
+def send_bulk_reminders(event_id, event):
     data = request.get_json()
     recipient_type = data.get('recipientType', 'pending')
     if recipient_type == 'pending':
@@ -258,19 +378,19 @@ def send_bulk_reminders(event_id):
         guests = [g for g in event.guests if g.status == 'confirmed']
     else:
         guests = [g for g in event.guests if g.status in ('pending', 'confirmed')]
+    charge_mail_quota(len(guests))
     count = 0
-    for guest in guests:
-        if send_reminder_email(guest, event, recipient_type=guest.status):
-            count += 1
+    with current_app.mail.connect() as connection:
+        for guest in guests:
+            if send_reminder_email(guest, event, recipient_type=guest.status, connection=connection):
+                count += 1
     return jsonify({'success': True, 'message': f'Reminders sent to {count} {recipient_type} guests.'})
 
 @routes.route('/event/<int:event_id>/guests/export')
 @login_required
-def export_guest_list(event_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
+@read_only
+@event_access()
+def export_guest_list(event_id, event):
     # Create CSV data
     si = StringIO()
     cw = csv.writer(si)
@@ -294,17 +414,29 @@ def export_guest_list(event_id):
     output.headers["Content-type"] = "text/csv"
     return output
 
-@routes.route('/event/<int:event_id>/guest/<int:guest_id>', methods=['GET', 'PUT'])
+@routes.route('/event/<int:event_id>/guests/import', methods=['POST'])
 @login_required
-def manage_single_guest(event_id, guest_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    guest = Guest.query.get_or_404(guest_id)
-    if guest.eventId != event_id:
-        return jsonify({'error': 'Guest not found for this event'}), 404
+@event_access()
+def import_guest_list(event_id, event):
+    """Upsert guests from a CSV with Name, Email and Phone columns."""
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+    try:
+        rows = parse_guest_csv(upload.read().decode('utf-8-sig'))
+    except (UnicodeDecodeError, csv.Error):
+        return jsonify({'success': False, 'error': 'Could not read the CSV file'}), 400
+    try:
+        result = import_guests(event_id, rows, current_app.config.get('BULK_CHUNK_SIZE', 500))
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'The guest list changed during the import, please retry'}), 409
+    return jsonify({'success': True, **result})
 
+@routes.route('/event/<int:event_id>/guest/<int:guest_id>', methods=['GET', 'PUT'])
+@login_required
+@event_access(Guest)
+def manage_single_guest(event_id, guest_id, event, guest):
     if request.method == 'GET':
         return jsonify({
             'id': guest.id,
@@ -318,32 +450,157 @@ def manage_single_guest(event_id, guest_id):
         guest.name = data.get('name', guest.name)
         guest.email = data.get('email', guest.email)
         guest.phone = data.get('phone', guest.phone)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Another guest already uses this email.'}), 409
         return jsonify({'success': True, 'message': 'Guest updated successfully.'})
 
 @routes.route('/event/<int:event_id>/guest/<int:guest_id>', methods=['DELETE'])
 @login_required
-def delete_guest(event_id, guest_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    guest = Guest.query.get_or_404(guest_id)
-    if guest.eventId != event_id:
-        return jsonify({'error': 'Guest not found for this event'}), 404
-    
+@event_access(Guest)
+def delete_guest(event_id, guest_id, event, guest):
     db.session.delete(guest)
+    db.session.flush()
+    rebalance_seats(event_id)
     db.session.commit()
     return jsonify({'success': True})
 
+BULK_ACTIONS = ('delete', 'update', 'set_status', 'resend')
+BULK_UPDATABLE_FIELDS = ('phone', 'plusOneCount')
+BULK_FILTER_KEYS = ('status', 'search')
+
+def _chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def _bulk_selection_error(data):
+    """Why the request's guest selection is invalid, or None.
+
+    A selection must name guests (a non-empty ``guestIds`` list) or narrow
+    them down (a ``filter`` with at least one valid criterion), so a
+    mistyped request can never act on the whole guest list.
+    """
+    if 'guestIds' in data:
+        if not isinstance(data['guestIds'], list) or not data['guestIds']:
+            return 'guestIds must be a non-empty list'
+        return None
+    criteria = data.get('filter')
+    if not isinstance(criteria, dict) or not criteria:
+        return 'Provide guestIds or a non-empty filter'
+    unknown = sorted(set(criteria) - set(BULK_FILTER_KEYS))
+    if unknown:
+        return f'Unknown filter keys: {", ".join(unknown)}'
+    if 'status' in criteria and criteria['status'] not in GUEST_STATUSES:
+        return 'Invalid filter status'
+    if 'search' in criteria and (not isinstance(criteria['search'], str) or not criteria['search'].strip()):
+        return 'Invalid filter search'
+    return None
+
+def _bulk_guest_ids(event_id, data, chunk_size):
+    """Guest IDs selected by an explicit ``guestIds`` list or a ``filter`` object."""
+    query = db.session.query(Guest.id).filter(Guest.eventId == event_id)
+    if 'guestIds' in data:
+        ids = [int(i) for i in data['guestIds']]
+        found = []
+        for chunk in _chunks(ids, chunk_size):
+            found.extend(row.id for row in query.filter(Guest.id.in_(chunk)))
+        return found
+
+    criteria = data['filter']  # Validated by _bulk_selection_error
+    if 'status' in criteria:
+        query = query.filter(Guest.status == criteria['status'])
+    if 'search' in criteria:
+        pattern = f"%{criteria['search'].strip()}%"
+        query = query.filter(db.or_(Guest.name.ilike(pattern), Guest.email.ilike(pattern)))
+    return [row.id for row in query.order_by(Guest.id)]
+
+@routes.route('/event/<int:event_id>/guests/bulk', methods=['POST'])
+@login_required
+@event_access()
+def bulk_guest_operation(event_id, event):
+    """Delete, update, override status or resend invites for many guests at once.
+
+    All changes run as chunked set-based statements inside one transaction.
+    """
+    data = request.get_json() or {}
+    action = data.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify({'success': False, 'error': f'Unknown action: {action}'}), 400
+    selection_error = _bulk_selection_error(data)
+    if selection_error:
+        return jsonify({'success': False, 'error': selection_error}), 400
+
+    values = {}
+    if action == 'update':
+        values = {k: v for k, v in (data.get('fields') or {}).items() if k in BULK_UPDATABLE_FIELDS}
+        if not values:
+            return jsonify({'success': False, 'error': 'No updatable fields given'}), 400
+        if 'plusOneCount' in values:
+            try:
+                values['plusOneCount'] = max(0, int(values['plusOneCount']))
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'Invalid plusOneCount'}), 400
+    elif action == 'set_status':
+        if data.get('status') not in GUEST_STATUSES:
+            return jsonify({'success': False, 'error': 'Invalid status'}), 400
+        now = datetime.utcnow()
+        values = {'status': data['status'], 'updatedAt': now,
+                  'waitlistedAt': now if data['status'] == 'waitlisted' else None}
+
+    chunk_size = current_app.config.get('BULK_CHUNK_SIZE', 500)
+    try:
+        guest_ids = _bulk_guest_ids(event_id, data, chunk_size)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Invalid guestIds'}), 400
+
+    if action == 'resend':
+        check_rate_limit('invitations')
+        charge_mail_quota(len(guest_ids))
+        sent = 0
+        with current_app.mail.connect() as connection:
+            for chunk in _chunks(guest_ids, chunk_size):
+                for guest in Guest.query.filter(Guest.id.in_(chunk)).all():
+                    qr_image_io = generate_rsvp_qr(guest.uniqueAccessToken)
+                    if send_invitation_email(guest, event, qr_image_io=qr_image_io, connection=connection):
+                        sent += 1
+                db.session.commit()  # Records invitedAt of the chunk's guests
+        return jsonify({'success': True, 'action': action, 'matched': len(guest_ids), 'affected': sent})
+
+    affected = 0
+    try:
+        for chunk in _chunks(guest_ids, chunk_size):
+            if action == 'delete':
+                GuestAnswer.query.filter(GuestAnswer.guestId.in_(chunk)).delete(synchronize_session=False)
+                CampaignRecipient.query.filter(CampaignRecipient.guestId.in_(chunk)).delete(synchronize_session=False)
+                affected += Guest.query.filter(Guest.eventId == event_id, Guest.id.in_(chunk)) \
+                    .delete(synchronize_session=False)
+            else:
+                if action == 'set_status':
+                    current = db.session.query(Guest.id, Guest.status) \
+                        .filter(Guest.eventId == event_id, Guest.id.in_(chunk)).all()
+                    record_status_changes(event_id, current, values['status'], values['updatedAt'])
+                affected += Guest.query.filter(Guest.eventId == event_id, Guest.id.in_(chunk)) \
+                    .update(values, synchronize_session=False)
+        # Organizer changes may free or overbook seats; recount and fill from the waitlist,
+        # unless guests were just moved onto it
+        if values.get('status') == 'waitlisted':
+            recount_seats(event_id)
+        else:
+            rebalance_seats(event_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("Bulk guest operation failed", extra={'event_id': event_id, 'action': action})
+        return jsonify({'success': False, 'error': 'Bulk operation failed'}), 500
+
+    return jsonify({'success': True, 'action': action, 'matched': len(guest_ids), 'affected': affected})
+
 @routes.route('/event/<int:event_id>/edit', methods=['GET', 'POST'])
 @login_required
-def edit_event(event_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        flash('Unauthorized access')
-        return redirect(url_for('routes.dashboard'))
-    
+@event_access(page=True)
+def edit_event(event_id, event):
     if request.method == 'POST':
         custom_fields = {
             'meal_options': request.form.getlist('meal_options[]'),
@@ -355,7 +612,12 @@ def edit_event(event_id):
         event.description = request.form.get('description')
         event.date = datetime.strptime(request.form.get('date'), '%Y-%m-%dT%H:%M')
         event.location = request.form.get('location')
-        event.customFields = json.dumps(custom_fields)
+        event.set_custom_fields(custom_fields)
+        capacity = _capacity_from_form()
+        if capacity != event.capacity:
+            event.capacity = capacity
+            db.session.flush()
+            rebalance_seats(event.id)
         
         db.session.commit()
         flash('Event updated successfully!')
@@ -365,23 +627,26 @@ def edit_event(event_id):
 
 @routes.route('/event/<int:event_id>/delete', methods=['POST'])
 @login_required
-def delete_event(event_id):
-    event = Event.query.get_or_404(event_id)
-    if not current_user.is_admin and event.organizerId != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
+@event_access()
+def delete_event(event_id, event):
     db.session.delete(event)
     db.session.commit()
     flash('Event deleted successfully!')
     return redirect(url_for('routes.dashboard'))
 
 @routes.route('/contact', methods=['GET', 'POST'])
+@cached_page
+@rate_limit('contact', by='ip')
 def contact():
     if request.method == 'POST':
         name = request.form.get('name')
         email = request.form.get('email')
         message = request.form.get('message')
         
+        if not name or not email or not message:
+            flash('Please fill in your name, email and message.', 'error')
+            return redirect(url_for('routes.contact'))
+        charge_mail_quota(1, by='ip')
         if send_contact_email(name, email, message):
             flash('Thank you for contacting us! We will get back to you soon.')
         else:
@@ -391,8 +656,10 @@ def contact():
     return render_template('contact.html')
 
 @routes.route('/forgot-password', methods=['GET', 'POST'])
+@rate_limit('password_reset', by='ip')
 def forgot_password():
     if request.method == 'POST':
+        charge_mail_quota(1, by='ip')
         email = request.form.get('email')
         user = Organizer.query.filter_by(email=email).first()
         if user:
@@ -440,6 +707,7 @@ def admin_index():
 @routes.route('/admin/dashboard')
 @login_required
 @admin_required
+@read_only
 def admin_dashboard():
     organizers = Organizer.query.order_by(Organizer.name).all()
     return render_template('admin/dashboard.html', organizers=organizers)
@@ -447,6 +715,55 @@ def admin_dashboard():
 @routes.route('/admin/organizer/<int:organizer_id>')
 @login_required
 @admin_required
+@read_only
 def admin_organizer_events(organizer_id):
     organizer = Organizer.query.get_or_404(organizer_id)
-    return render_template('admin/organizer_events.html', organizer=organizer)
\ No newline at end of file
+    return render_template('admin/organizer_events.html', organizer=organizer)
+
+@routes.route('/admin/traces')
+@login_required
+@admin_required
+def admin_traces():
+    traces = recent_traces(limit=100)
+    return render_template('admin/traces.html', traces=traces,
+                           sample_rate=current_app.config.get('TRACE_SAMPLE_RATE', 0))
+
+@routes.route('/admin/jobs')
+@login_required
+@admin_required
+@read_only
+def admin_jobs():
+    return render_template('admin/jobs.html', jobs=job_overview())
+
+@routes.route('/admin/rate-limits')
+@login_required
+@admin_required
+@read_only
+def admin_rate_limits():
+    return render_template('admin/rate_limits.html', overview=limiter.overview(),
+                           limits=current_app.config.get('RATE_LIMITS', {}))
+
+@routes.route('/admin/archive')
+@login_required
+@admin_required
+@read_only
+def admin_archive():
+    archived_events = ArchivedEvent.query.order_by(ArchivedEvent.archivedAt.desc()).limit(200).all()
+    return render_template('admin/archive.html', archived_events=archived_events,
+                           archive_after_days=current_app.config.get('ARCHIVE_AFTER_DAYS', 365))
+
+@routes.route('/admin/archive/<int:event_id>/restore', methods=['POST'])
+@login_required
+@admin_required
+def admin_restore_event(event_id):
+    try:
+        rows = restore_event(event_id)
+    except LookupError:
+        abort(404)
+    except Exception:
+        db.session.rollback()
+        logger.exception("Error restoring event", extra={'event_id': event_id})
+        flash('The event could not be restored.')
+        return redirect(url_for('routes.admin_archive'))
+    flash(f'Event restored ({rows} rows).')
+    return redirect(url_for('routes.event_details', event_id=event_id))
@@ -0,0 +1,195 @@
+"""Write-coalescing RSVP ingestion.
+
+With ``RSVP_INGEST_MODE = 'queued'`` an RSVP POST only appends the
+submission to an in-process queue and returns. A background flusher drains
+the queue every ``RSVP_INGEST_FLUSH_INTERVAL`` seconds (or as soon as
+``RSVP_INGEST_BATCH_SIZE`` submissions are waiting), keeps the latest
+submission per token and applies the batch in one transaction: one SELECT
+of the guests, their UPDATEs (batched by the ORM when they set the same
+columns), one INSERT of all status changes, one rollup upsert per event and
+day and one seat recount per event.
+
+Until a submission is committed, ``pending_submission(token)`` returns it so
+the submitting guest reads their own write. The queue lives in the worker
+process, so with several workers read-your-writes holds for requests served
+by the same one.
+
+The flusher is the one background thread a web worker runs: the queue is
+in the worker's memory, so no other process (such as the scheduler) can
+drain it. On a normal exit (a graceful restart, or a worker recycled after
+``max_requests``) ``close()`` stops the flusher and applies what is still
+queued. Submissions queued in a worker that is killed (SIGKILL, an
+out-of-memory kill, a worker timeout) or crashes are lost: at most
+``RSVP_INGEST_FLUSH_INTERVAL`` seconds' worth, but acknowledged to the
+guest. Use ``'direct'`` mode where that is not acceptable.
+"""
+import atexit
+import itertools
+import logging
+import threading
+from collections import deque, namedtuple
+from datetime import datetime
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, Guest, log_status_changes
+from seating import apply_rsvp, recount_seats, NoSeatsError
+
+logger = logging.getLogger(__name__)
+
+Submission = namedtuple('Submission', 'seq guest_id token status plus_one_count responses submitted_at')
+
+
+class RsvpIngestQueue:
+    """Append-only RSVP submission queue with a batching flusher thread."""
+
+    def __init__(self):
+        self.app = None
+        self._queue = deque()
+        self._latest = {}  # token -> newest submission not yet committed
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.applied = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('RSVP_INGEST_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('RSVP_INGEST_FLUSH_INTERVAL', 0.5)
+
+    def submit(self, guest, status, plus_one_count=None, responses=None):
+        """Queue an RSVP and return immediately."""
+        submission = Submission(next(self._seq), guest.id, guest.uniqueAccessToken, status,
+                                plus_one_count, responses, datetime.utcnow())
+        with self._lock:
+            self._queue.append(submission)
+            self._latest[submission.token] = submission
+            backlog = len(self._queue)
+        self._ensure_flusher()
+        if backlog >= self.batch_size:
+            self._wakeup.set()
+        return submission
+
+    def pending_submission(self, token):
+        """The guest's newest submission that has not been committed yet."""
+        return self._latest.get(token)
+
+    def backlog(self):
+        return len(self._queue)
+
+    def _ensure_flusher(self):
+        if self._closed or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if not self._closed and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name='rsvp-ingest-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("RSVP ingest flush failed")
+
+    def close(self):
+        """Stop the flusher and apply everything still queued; runs when the process exits."""
+        applied = self.applied
+        self._closed = True
+        self._wakeup.set()  # The flusher's last round may apply part of the queue
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        self.flush()
+        drained = self.applied - applied
+        if drained:
+            logger.info("Applied queued RSVPs at exit", extra={'guests': drained})
+        return drained
+
+    def flush(self):
+        """Apply everything queued so far; returns the number of guests updated."""
+        with self._flush_lock:
+            total = 0
+            while True:
+                with self._lock:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return total
+                total += self._apply(batch)
+
+    def _apply(self, batch):
+        # Last write wins per token; the queue is in submission order
+        latest = {}
+        for submission in batch:
+            latest[submission.token] = submission
+
+        with self.app.app_context():
+            try:
+                self._apply_batch(list(latest.values()))
+            except Exception:
+                db.session.rollback()
+                logger.exception("Batched RSVP apply failed; retrying one by one",
+                                 extra={'batch_size': len(latest)})
+                for submission in latest.values():
+                    try:
+                        self._apply_batch([submission])
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception("Dropping RSVP submission",
+                                         extra={'guest_id': submission.guest_id, 'status': submission.status})
+            finally:
+                db.session.remove()
+
+        with self._lock:
+            for token, submission in latest.items():
+                if self._latest.get(token) is submission:
+                    del self._latest[token]
+        self.applied += len(latest)
+        return len(latest)
+
+    def _apply_batch(self, submissions):
+        guests = Guest.query.options(selectinload(Guest.answers), joinedload(Guest.event)) \
+            .filter(Guest.id.in_([s.guest_id for s in submissions])).all()
+        by_id = {g.id: g for g in guests}
+        uncapped = set()
+        changes = []
+        for submission in submissions:
+            guest = by_id.get(submission.guest_id)
+            if guest is None:
+                continue  # Deleted while queued
+            if guest.event.capacity is None:
+                guest.update_status(
+                    status=submission.status,
+                    plus_one_count=submission.plus_one_count,
+                    responses=submission.responses,
+                    at=submission.submitted_at,
+                    changes=changes
+                )
+                uncapped.add(guest.eventId)
+                continue
+            # A capacity was set while the submission was queued
+            try:
+                apply_rsvp(guest, submission.status, submission.plus_one_count,
+                           submission.responses, at=submission.submitted_at)
+            except NoSeatsError:
+                logger.warning("Dropping RSVP submission, no seats left",
+                               extra={'guest_id': guest.id, 'event_id': guest.eventId})
+        log_status_changes(changes)
+        db.session.flush()
+        # One seat recount per event instead of a counter update per guest
+        for event_id in uncapped:
+            recount_seats(event_id)
+        db.session.commit()
+
+
+ingest_queue = RsvpIngestQueue()
+
+
+def init_rsvp_ingest(app):
+    if ingest_queue.app is None:
+        atexit.register(ingest_queue.close)
+    ingest_queue.init_app(app)
@@ -0,0 +1,281 @@
+"""Scheduler service.
+
+Scheduled jobs run in a dedicated process, never inside web workers:
+
+    python scheduler.py            # or: flask --app app run-scheduler
+
+Jobs are kept in a SQLAlchemy job store in the application database. Before
+every run the process takes a lease on the job in the JobLocks table, so
+two scheduler processes (running for redundancy, or by mistake) never run
+a job at the same time, and claims the run's fire time with a JobRuns row
+that is unique per (job, fire time), so a process that wakes up after the
+lease was released does not run the same fire time again. Every execution
+is recorded in JobRuns with its owner, duration and outcome.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+
+import click
+from apscheduler.events import EVENT_SCHEDULER_START
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobLock, JobRun, ReplicaHeartbeat
+from reminder import check_and_send_reminders
+from campaigns import process_campaigns
+from archive import archive_past_events
+from tracing import job_trace
+from db_routing import replica_bind_keys
+
+logger = logging.getLogger(__name__)
+
+OWNER = f'{socket.gethostname()}:{os.getpid()}'
+JOBSTORE_TABLE = 'apscheduler_jobs'
+
+_app = None
+_scheduler = None
+
+
+def prune_job_runs():
+    """Delete job history older than SCHEDULER_HISTORY_DAYS."""
+    days = current_app.config.get('SCHEDULER_HISTORY_DAYS', 14)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    JobRun.query.filter(JobRun.startedAt < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def write_replica_heartbeat():
+    """Touch the heartbeat row that replica lag is measured against."""
+    now = datetime.utcnow()
+    if not ReplicaHeartbeat.query.filter_by(id=1).update({'beatAt': now}, synchronize_session=False):
+        db.session.add(ReplicaHeartbeat(id=1, beatAt=now))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Another scheduler created the row; its beat will do
+
+
+# Every few seconds and idempotent: run by every scheduler without a lease or a JobRuns row,
+# which would add thousands of rows a day to the run history
+UNRECORDED_JOBS = {'write_replica_heartbeat'}
+
+JOBS = {
+    'check_and_send_reminders': check_and_send_reminders,
+    'process_campaigns': process_campaigns,
+    'prune_job_runs': prune_job_runs,
+    'write_replica_heartbeat': write_replica_heartbeat,
+    'archive_past_events': archive_past_events,
+}
+
+
+def job_triggers(config):
+    """Triggers of the jobs this deployment runs.
+
+    Intervals count from a fixed epoch (SCHEDULER_EPOCH, UTC), not from when
+    a scheduler started: daily jobs run at the epoch's time of day whenever
+    the service was last restarted, and every process computes the same
+    fire times.
+    """
+    epoch = datetime.fromisoformat(config.get('SCHEDULER_EPOCH', '2024-01-01T03:00:00')).replace(tzinfo=timezone.utc)
+    intervals = {
+        'check_and_send_reminders': timedelta(days=1),
+        'process_campaigns': timedelta(seconds=config.get('CAMPAIGN_POLL_SECONDS', 15)),
+        'prune_job_runs': timedelta(hours=6),
+        'archive_past_events': timedelta(days=1),
+    }
+    if replica_bind_keys(config.get('SQLALCHEMY_BINDS')):
+        intervals['write_replica_heartbeat'] = timedelta(seconds=config.get('DB_REPLICA_HEARTBEAT_SECONDS', 5))
+    return {name: IntervalTrigger(seconds=interval.total_seconds(), start_date=epoch, timezone=timezone.utc)
+            for name, interval in intervals.items()}
+
+
+def sync_jobs(scheduler, triggers):
+    """Store missing jobs and reschedule those whose trigger changed.
+
+    A stored job with the same trigger is left alone, so its next run time
+    (including one missed while no scheduler was running) survives restarts
+    and deploys.
+    """
+    for name, trigger in triggers.items():
+        job = scheduler.get_job(name)
+        if job is None:
+            scheduler.add_job('scheduler:run_job', trigger, args=[name], id=name, name=name)
+        elif (job.trigger.interval, job.trigger.start_date) != (trigger.interval, trigger.start_date):
+            logger.info('Job rescheduled', extra={'job': name, 'trigger': str(trigger)})
+            scheduler.reschedule_job(name, trigger=trigger)
+
+
+def acquire_lock(name, ttl, owner=OWNER):
+    """Take or renew the lease on ``name``; False if another owner holds it."""
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=ttl)
+    taken = JobLock.query.filter(
+        JobLock.name == name,
+        db.or_(JobLock.lockedUntil < now, JobLock.owner == owner)
+    ).update({'owner': owner, 'lockedUntil': until}, synchronize_session=False)
+    if not taken:
+        db.session.add(JobLock(name=name, owner=owner, lockedUntil=until))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Another process holds the lease
+        return False
+    return True
+
+
+def release_lock(name, owner=OWNER):
+    JobLock.query.filter_by(name=name, owner=owner).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def fire_time(job, now):
+    """The (naive UTC) fire time a run of ``job`` starting at ``now`` belongs to.
+
+    That is the trigger's latest fire time not after ``now``; every
+    scheduler process computes the same one from the shared job store.
+    None for triggers other than intervals.
+    """
+    trigger = job.trigger if job is not None else None
+    if not isinstance(trigger, IntervalTrigger):
+        return None
+    periods = (now - trigger.start_date).total_seconds() // trigger.interval_length
+    fired = trigger.start_date + timedelta(seconds=periods * trigger.interval_length)
+    return fired.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def execute_job(name, owner=OWNER, scheduled_at=None):
+    """Run job ``name`` under its lock and record the run; None if skipped.
+
+    With ``scheduled_at`` the run is skipped when that fire time of the job
+    has already been claimed by a run of any process.
+    """
+    ttl = current_app.config.get('SCHEDULER_LOCK_TTL', 900)
+    if not acquire_lock(name, ttl, owner):
+        logger.info('Job skipped, lock held by another scheduler', extra={'job': name})
+        return None
+
+    run = JobRun(jobName=name, owner=owner, scheduledAt=scheduled_at, startedAt=datetime.utcnow())
+    db.session.add(run)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        release_lock(name, owner)
+        logger.info('Job skipped, fire time already run', extra={'job': name, 'scheduled_at': str(scheduled_at)})
+        return None
+    start = time.perf_counter()
+    try:
+        with job_trace(name):
+            JOBS[name]()
+        run.status = 'ok'
+    except Exception:
+        db.session.rollback()
+        logger.exception('Scheduled job failed', extra={'job': name})
+        run.status = 'error'
+        run.error = traceback.format_exc()[-4000:]
+    finally:
+        run.finishedAt = datetime.utcnow()
+        run.durationMs = int((time.perf_counter() - start) * 1000)
+        db.session.commit()
+        release_lock(name, owner)
+    return run
+
+
+def run_job(name):
+    """Job store entry point; referenced by name so stored jobs survive restarts."""
+    base_url = _app.config.get('APP_BASE_URL')
+    # Jobs build external URLs, which needs a request context outside of requests
+    url_context = _app.test_request_context(base_url=base_url) if base_url else nullcontext()
+    with _app.app_context(), url_context:
+        try:
+            if name in UNRECORDED_JOBS:
+                JOBS[name]()
+            else:
+                execute_job(name, scheduled_at=fire_time(_scheduler.get_job(name), datetime.now(timezone.utc)))
+        finally:
+            db.session.remove()
+
+
+def create_scheduler(app):
+    """Build the blocking scheduler; it adds missing jobs to the job store when started."""
+    global _app, _scheduler
+    _app = app
+    _scheduler = scheduler = BlockingScheduler(
+        jobstores={'default': SQLAlchemyJobStore(url=app.config['SQLALCHEMY_DATABASE_URI'],
+                                                 tablename=JOBSTORE_TABLE)},
+        job_defaults={'coalesce': True, 'max_instances': 1,
+                      'misfire_grace_time': app.config.get('SCHEDULER_MISFIRE_GRACE', 300)},
+        timezone=timezone.utc
+    )
+    # The job store can only be read once the scheduler has started it
+    triggers = job_triggers(app.config)
+    scheduler.add_listener(lambda event: sync_jobs(scheduler, triggers), EVENT_SCHEDULER_START)
+    return scheduler
+
+
+def job_overview(history=20):
+    """Per-job next run, lock holder and recent run statistics for the admin page."""
+    next_runs = {}
+    if inspect(db.engine).has_table(JOBSTORE_TABLE):
+        rows = db.session.execute(text(f'SELECT id, next_run_time FROM {JOBSTORE_TABLE}'))
+        next_runs = {row.id: datetime.fromtimestamp(row.next_run_time, timezone.utc)
+                     for row in rows if row.next_run_time is not None}
+    locks = {lock.name: lock for lock in JobLock.query.all()}
+    stats = {row.jobName: row for row in db.session.query(
+        JobRun.jobName,
+        func.count(JobRun.id).label('runs'),
+        func.sum(db.case((JobRun.status == 'error', 1), else_=0)).label('errors'),
+        func.avg(JobRun.durationMs).label('avg_ms'),
+        func.max(JobRun.durationMs).label('max_ms')
+    ).group_by(JobRun.jobName)}
+
+    overview = []
+    for name in JOBS:
+        if name in UNRECORDED_JOBS:
+            continue
+        row = stats.get(name)
+        overview.append({
+            'name': name,
+            'next_run': next_runs.get(name),
+            'lock': locks.get(name),
+            'runs': row.runs if row else 0,
+            'errors': int(row.errors or 0) if row else 0,
+            'avg_ms': round(row.avg_ms or 0) if row else None,
+            'max_ms': row.max_ms if row else None,
+            'recent': JobRun.query.filter_by(jobName=name)
+                .order_by(JobRun.startedAt.desc()).limit(history).all()
+        })
+    return overview
+
+
+@click.command('run-scheduler')
+@with_appcontext
+def scheduler_command():
+    """Run the scheduler service in the foreground."""
+    click.echo(f'Scheduler {OWNER} starting with jobs: {", ".join(JOBS)}')
+    create_scheduler(current_app._get_current_object()).start()
+
+
+def main():
+    from app import app
+    logger.info('Scheduler starting', extra={'owner': OWNER, 'jobs': list(JOBS)})
+    try:
+        create_scheduler(app).start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+if __name__ == '__main__':
+    # Stored jobs reference ``scheduler:run_job``; run through that module, not __main__
+    import scheduler
+    scheduler.main()
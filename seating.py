@@ -0,0 +1,130 @@
+"""Event capacity and waitlist.
+
+``Event.seatsTaken`` counts the seats (guest plus their plus ones) held by
+confirmed guests. It is only changed with conditional UPDATE statements, so
+concurrent RSVPs can never take more seats than ``Event.capacity``: the
+database re-checks the condition against the latest committed count, and on
+MySQL the row lock taken by the UPDATE serializes seat changes per event
+until commit. A confirmation that does not fit puts the guest on the
+waitlist; seats freed by declines, smaller parties or deletions are offered
+to waitlisted guests in the order they joined.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+from models import db, Event, Guest, record_status_changes
+
+logger = logging.getLogger(__name__)
+
+
+class NoSeatsError(Exception):
+    """A confirmed guest asked for more seats than are left."""
+
+    def __init__(self, seats_left):
+        super().__init__(f'Only {seats_left} seats left')
+        self.seats_left = seats_left
+
+
+def party_size(status, plus_one_count):
+    return 1 + (plus_one_count or 0) if status == 'confirmed' else 0
+
+
+def claim_seats(event_id, seats):
+    """Take ``seats`` seats if they fit; returns whether they were taken."""
+    result = db.session.execute(
+        update(Event)
+        .where(Event.id == event_id,
+               db.or_(Event.capacity.is_(None), Event.seatsTaken + seats <= Event.capacity))
+        .values(seatsTaken=Event.seatsTaken + seats)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_seats(event_id, seats):
+    db.session.execute(
+        update(Event).where(Event.id == event_id)
+        .values(seatsTaken=Event.seatsTaken - seats)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def apply_rsvp(guest, status, plus_one_count=None, responses=None, at=None):
+    """Record a guest's RSVP, moving seats atomically; returns the resulting status.
+
+    A new confirmation that does not fit goes to the waitlist. An already
+    confirmed guest asking for a larger party keeps their seats and gets
+    ``NoSeatsError`` instead. The caller commits.
+    """
+    at = at or datetime.utcnow()
+    plus_ones = guest.plusOneCount if plus_one_count is None else plus_one_count
+    held = party_size(guest.status, guest.plusOneCount)
+    wanted = party_size(status, plus_ones)
+
+    if wanted > held and not claim_seats(guest.eventId, wanted - held):
+        if guest.status == 'confirmed':
+            seats_left = db.session.execute(
+                select(Event.capacity - Event.seatsTaken).where(Event.id == guest.eventId)).scalar()
+            raise NoSeatsError(max(0, seats_left or 0))
+        status = 'waitlisted'
+    elif wanted < held:
+        release_seats(guest.eventId, held - wanted)
+
+    if status == 'waitlisted' and guest.status != 'waitlisted':
+        guest.waitlistedAt = at
+    elif status != 'waitlisted':
+        guest.waitlistedAt = None
+    guest.update_status(status=status, plus_one_count=plus_one_count, responses=responses, at=at)
+
+    if wanted < held:
+        promote_waitlist(guest.eventId, at)
+    return status
+
+
+def promote_waitlist(event_id, at=None):
+    """Confirm waitlisted guests, oldest first, while their parties fit; returns their ids."""
+    at = at or datetime.utcnow()
+    promoted = []
+    waiting = db.session.query(Guest.id, Guest.plusOneCount) \
+        .filter(Guest.eventId == event_id, Guest.status == 'waitlisted') \
+        .order_by(Guest.waitlistedAt, Guest.id).all()
+    for guest_id, plus_ones in waiting:
+        seats = party_size('confirmed', plus_ones)
+        if not claim_seats(event_id, seats):
+            continue  # A smaller party further down may still fit
+        # Guard against a concurrent promotion or answer change of the same guest
+        changed = db.session.execute(
+            update(Guest).where(Guest.id == guest_id, Guest.status == 'waitlisted')
+            .values(status='confirmed', waitlistedAt=None, updatedAt=at)
+            .execution_options(synchronize_session='fetch')
+        ).rowcount
+        if not changed:
+            release_seats(event_id, seats)
+            continue
+        record_status_changes(event_id, [(guest_id, 'waitlisted')], 'confirmed', at, plus_one_count=plus_ones)
+        promoted.append(guest_id)
+    if promoted:
+        logger.info('Promoted guests from the waitlist', extra={'event_id': event_id, 'guest_ids': promoted})
+    return promoted
+
+
+def seats_taken_subquery(event_id):
+    """Seats held by an event's confirmed guests; ``event_id`` may be a column."""
+    return select(func.coalesce(func.sum(1 + func.coalesce(Guest.plusOneCount, 0)), 0)) \
+        .where(Guest.eventId == event_id, Guest.status == 'confirmed').scalar_subquery()
+
+
+def recount_seats(event_id):
+    """Recompute seatsTaken from the guest list, e.g. after organizer bulk changes."""
+    db.session.execute(
+        update(Event).where(Event.id == event_id).values(seatsTaken=seats_taken_subquery(event_id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rebalance_seats(event_id):
+    """Recount seats and fill any that were freed from the waitlist."""
+    recount_seats(event_id)
+    return promote_waitlist(event_id)
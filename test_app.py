@@ -10,6 +10,24 @@ from datetime import datetime, timedelta
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Use an in-memory database unless a real one is configured
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+def make_test_app(database_uri="sqlite://", **settings):
+    """Create an app bound to a throwaway database."""
+    from app import create_app
+    from config import Config
+
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        TESTING = True
+        MAIL_SUPPRESS_SEND = True
+        SERVER_NAME = "localhost"
+
+    for key, value in settings.items():
+        setattr(TestConfig, key, value)
+    return create_app(TestConfig)
+
 def test_imports():
     """Test that all required modules can be imported."""
     print("Testing imports...")
@@ -18,7 +36,7 @@ def test_imports():
         from models import db, Organizer, Event, Guest
         from config import Config
         from qr_generator import generate_rsvp_qr
-        from analytics import get_event_analytics, get_organizer_analytics
+        from analytics import get_event_analytics, get_dashboard_summary
         print("✅ All imports successful")
         return True
     except ImportError as e:
@@ -105,6 +123,1361 @@ def test_qr_generation():
         print(f"❌ QR generation error: {e}")
         return False
 
+def test_tracing():
+    """Test span collection, the trace ring buffer, failed requests and request IDs."""
+    print("\nTesting request tracing...")
+    try:
+        from tracing import job_trace, span, recent_traces
+        with job_trace("test_job") as trace:
+            with span("sql", "SELECT"):
+                pass
+            with span("mail", "invitation"):
+                pass
+        if [s["kind"] for s in trace.spans] != ["sql", "mail"]:
+            print("❌ Spans were not recorded")
+            return False
+        if recent_traces(limit=1)[0] is not trace:
+            print("❌ Finished trace missing from ring buffer")
+            return False
+        # Outside a trace spans are no-ops
+        with span("sql", "SELECT"):
+            pass
+
+        # Requests that raise are traced too, even when the exception propagates past after_request
+        app = make_test_app(TRACE_SAMPLE_RATE=1.0)
+        def boom():
+            raise RuntimeError("boom")
+        app.add_url_rule("/boom", "boom", boom)
+        client = app.test_client()
+        try:
+            client.get("/boom")
+            print("❌ Failing request did not raise")
+            return False
+        except RuntimeError:
+            pass
+        failed = recent_traces(limit=1)[0]
+        if failed.name != "GET /boom" or failed.status != 500:
+            print(f"❌ Failing request not traced: {failed.name} {failed.status}")
+            return False
+
+        # Client request IDs are kept only when they look like one
+        for sent, kept in (("abc-123_X.y", True), ("x" * 65, False), ("bad id;<script>", False)):
+            returned = client.get("/", headers={"X-Request-ID": sent}).headers["X-Request-ID"]
+            if (returned == sent) != kept or not returned:
+                print(f"❌ Request ID {sent!r} answered with {returned!r}")
+                return False
+        print("✅ Request tracing works")
+        return True
+    except Exception as e:
+        print(f"❌ Tracing error: {e}")
+        return False
+
+def test_custom_fields_migration():
+    """Test converting legacy JSON blobs into questions and typed answers."""
+    print("\nTesting custom field migration...")
+    try:
+        import json
+        from models import db, Organizer, Event, Guest, GuestAnswer
+        from migrations import run_upgrades
+        app = make_test_app()
+        with app.app_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            event = Event(title="Dinner", date=datetime.now() + timedelta(days=7),
+                          organizerId=organizer.id,
+                          customFields=json.dumps({"meal_options": ["Fish", "Veg"]}))
+            db.session.add(event)
+            db.session.flush()
+            guest = Guest(eventId=event.id, name="G", email="g@example.com",
+                          uniqueAccessToken="legacy", status="confirmed",
+                          responses=json.dumps({"meal_choice": "Veg"}))
+            db.session.add(guest)
+            db.session.commit()
+            event_id = event.id
+
+            run_upgrades(batch_size=1)
+            run_upgrades(batch_size=1)  # Steps are idempotent
+
+            event = db.session.get(Event, event_id)
+            if event.customFields != {"meal_options": ["Fish", "Veg"]}:
+                print("❌ Event custom fields were not decoded")
+                return False
+            if event.get_custom_fields() is not event.get_custom_fields():
+                print("❌ Custom fields are not memoized")
+                return False
+            answers = GuestAnswer.query.all()
+            if [(a.question.key, a.choice) for a in answers] != [("meal_choice", "Veg")]:
+                print("❌ Guest answers were not created")
+                return False
+        print("✅ Custom field migration works")
+        return True
+    except Exception as e:
+        print(f"❌ Custom field migration error: {e}")
+        return False
+
+def test_rsvp_ingest_queue():
+    """Test queued RSVPs: last write wins, guests read their own writes and exit drains the queue."""
+    print("\nTesting queued RSVP ingestion...")
+    try:
+        from sqlalchemy import event as sa_event
+        from models import db, Organizer, Event, Guest, RsvpChange, RsvpDailyRollup
+        from rsvp_ingest import ingest_queue, RsvpIngestQueue
+        app = make_test_app(RSVP_INGEST_MODE="queued", RSVP_INGEST_FLUSH_INTERVAL=60)
+        with app.app_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            event = Event(title="Party", date=datetime.now() + timedelta(days=7), organizerId=organizer.id)
+            db.session.add(event)
+            db.session.flush()
+            db.session.add(Guest(eventId=event.id, name="G", email="g@example.com", uniqueAccessToken="tok"))
+            db.session.add_all([Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com",
+                                      uniqueAccessToken=f"tok{i}") for i in range(4)])
+            db.session.commit()
+            engine = db.engine
+
+        client = app.test_client()
+        for i in range(4):
+            client.post(f"/rsvp/tok{i}", json={"status": "declined" if i % 2 else "confirmed"})
+        client.post("/rsvp/tok", json={"status": "declined"})
+        response = client.post("/rsvp/tok", json={"status": "confirmed", "plus_one_count": 2})
+        if not response.get_json().get("queued"):
+            print("❌ RSVP was not queued")
+            return False
+        if b"Your current response" not in client.get("/rsvp/tok").data:
+            print("❌ Queued RSVP not visible to the guest")
+            return False
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sa_event.listen(engine, "before_cursor_execute", count)
+        try:
+            ingest_queue.flush()
+        finally:
+            sa_event.remove(engine, "before_cursor_execute", count)
+        change_inserts = [s for s in statements if "RsvpChanges" in s]
+        rollup_upserts = [s for s in statements if "RsvpDailyRollups" in s]
+        if len(change_inserts) != 1 or len(rollup_upserts) != 1:
+            print(f"❌ Batch logged changes with {len(change_inserts)} inserts and {len(rollup_upserts)} upserts")
+            return False
+        with app.app_context():
+            if RsvpChange.query.count() != 5 or RsvpDailyRollup.query.one().responses != 5:
+                print("❌ Batched status changes not all logged")
+                return False
+            guest = Guest.query.filter_by(uniqueAccessToken="tok").first()
+            if (guest.status, guest.plusOneCount) != ("confirmed", 2):
+                print(f"❌ Expected last write to win, got {guest.status}")
+                return False
+        if ingest_queue.pending_submission("tok") is not None:
+            print("❌ Applied submission still pending")
+            return False
+
+        # A worker exiting normally applies its queue and stops its flusher
+        queue = RsvpIngestQueue()
+        queue.init_app(app)
+        with app.app_context():
+            queue.submit(Guest.query.filter_by(uniqueAccessToken="tok0").one(), "declined")
+        flusher = queue._thread
+        if queue.close() != 1 or flusher.is_alive() or queue.backlog():
+            print("❌ Queued RSVPs not applied at exit")
+            return False
+        with app.app_context():
+            if Guest.query.filter_by(uniqueAccessToken="tok0").one().status != "declined":
+                print("❌ RSVP applied at exit not committed")
+                return False
+        print("✅ Queued RSVP ingestion works")
+        return True
+    except Exception as e:
+        print(f"❌ RSVP ingestion error: {e}")
+        return False
+
+def test_rsvp_rollups():
+    """Test that status changes feed the daily rollups the analytics read."""
+    print("\nTesting RSVP rollups...")
+    try:
+        from models import db, Organizer, Event, Guest, RsvpChange
+        from analytics import get_event_analytics
+        app = make_test_app()
+        with app.app_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            event = Event(title="Party", date=datetime.now() + timedelta(days=7), organizerId=organizer.id)
+            db.session.add(event)
+            db.session.flush()
+            guests = [Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com",
+                            uniqueAccessToken=f"tok{i}") for i in range(3)]
+            db.session.add_all(guests)
+            db.session.commit()
+
+            day_one = datetime(2026, 5, 1, 12)
+            guests[0].update_status("confirmed", at=day_one)
+            guests[1].update_status("declined", at=day_one)
+            db.session.commit()
+            guests[1].update_status("confirmed", at=day_one + timedelta(days=1))
+            guests[1].update_status("confirmed", at=day_one + timedelta(days=1))
+            db.session.commit()
+
+            analytics = get_event_analytics(event.id)
+            timeline = {row["day"]: row for row in analytics["timeline"]}
+            first, second = timeline["2026-05-01"], timeline["2026-05-02"]
+            if (first["responses"], first["confirmed"], first["declined"]) != (2, 1, 1):
+                print(f"❌ Unexpected first-day rollup: {first}")
+                return False
+            if (second["responses"], second["changes"], second["change_rate"]) != (0, 1, 1):
+                print(f"❌ Unexpected second-day rollup: {second}")
+                return False
+            if analytics["funnel"] != {"invited": 3, "responded": 2, "pending": 1, "confirmed": 2, "declined": 0,
+                                      "waitlisted": 0}:
+                print(f"❌ Unexpected funnel: {analytics['funnel']}")
+                return False
+            if RsvpChange.query.filter_by(eventId=event.id).count() != 3:
+                print("❌ Unchanged status should not be logged")
+                return False
+        print("✅ RSVP rollups work")
+        return True
+    except Exception as e:
+        print(f"❌ RSVP rollup error: {e}")
+        return False
+
+def test_scheduler_locking():
+    """Test that a job runs only under its lock and that runs are recorded."""
+    print("\nTesting scheduler locking...")
+    try:
+        import threading
+        from datetime import timezone
+        from types import SimpleNamespace
+        from apscheduler.triggers.interval import IntervalTrigger
+        import scheduler
+        from models import db, JobLock, JobRun, ReplicaHeartbeat
+        from scheduler import JOBS, acquire_lock, execute_job, fire_time, release_lock
+        app = make_test_app()
+        if any(t.name.startswith("APScheduler") for t in threading.enumerate()):
+            print("❌ Web app started a scheduler thread")
+            return False
+
+        calls = []
+        JOBS["test_job"] = lambda: calls.append(1)
+        try:
+            with app.app_context():
+                if not acquire_lock("test_job", 60, owner="other"):
+                    print("❌ Could not take a free lock")
+                    return False
+                if execute_job("test_job", owner="me") is not None or calls:
+                    print("❌ Job ran while another scheduler held its lock")
+                    return False
+                release_lock("test_job", owner="other")
+                run = execute_job("test_job", owner="me")
+                if calls != [1] or run.status != "ok" or run.durationMs is None:
+                    print("❌ Job run was not recorded")
+                    return False
+                if not acquire_lock("test_job", 60, owner="other"):
+                    print("❌ Lock was not released after the run")
+                    return False
+                if JobRun.query.filter_by(jobName="test_job").count() != 1:
+                    print("❌ Skipped run was recorded")
+                    return False
+                release_lock("test_job", owner="other")
+
+                # A second scheduler waking up after the first run finished skips that fire time
+                start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+                job = SimpleNamespace(trigger=IntervalTrigger(seconds=15, start_date=start, timezone=timezone.utc))
+                fired = fire_time(job, start + timedelta(seconds=31))
+                if fired != datetime(2030, 1, 1, 0, 0, 30) or fire_time(job, start + timedelta(seconds=44)) != fired:
+                    print(f"❌ Wrong fire time: {fired}")
+                    return False
+                if execute_job("test_job", owner="me", scheduled_at=fired) is None:
+                    print("❌ Scheduled run did not run")
+                    return False
+                if execute_job("test_job", owner="other", scheduled_at=fired) is not None or calls != [1, 1]:
+                    print("❌ The same fire time ran twice")
+                    return False
+                if not acquire_lock("test_job", 60, owner="other"):
+                    print("❌ Lock kept after a skipped fire time")
+                    return False
+
+            # Restarts keep stored jobs and their next run times; daily jobs run at the epoch's time of day
+            from apscheduler.jobstores.memory import MemoryJobStore
+            from apscheduler.schedulers.background import BackgroundScheduler
+            store = BackgroundScheduler(jobstores={"default": MemoryJobStore()}, timezone=timezone.utc)
+            store.start(paused=True)
+            try:
+                scheduler.sync_jobs(store, scheduler.job_triggers(app.config))
+                daily = store.get_job("check_and_send_reminders")
+                if (daily.next_run_time.hour, daily.next_run_time.minute) != (3, 0):
+                    print(f"❌ Daily job not pinned to the epoch: {daily.next_run_time}")
+                    return False
+                missed = datetime.now(timezone.utc) - timedelta(minutes=1)
+                store.modify_job("check_and_send_reminders", next_run_time=missed)
+                scheduler.sync_jobs(store, scheduler.job_triggers(app.config))
+                if store.get_job("check_and_send_reminders").next_run_time != missed:
+                    print("❌ Restart moved a stored job's next run")
+                    return False
+                app.config["CAMPAIGN_POLL_SECONDS"] = 30
+                scheduler.sync_jobs(store, scheduler.job_triggers(app.config))
+                if store.get_job("process_campaigns").trigger.interval != timedelta(seconds=30):
+                    print("❌ Changed interval not rescheduled")
+                    return False
+            finally:
+                store.shutdown(wait=False)
+
+            # The frequent heartbeat updates its row without leases or run history
+            scheduler._app = app
+            for _ in range(3):
+                scheduler.run_job("write_replica_heartbeat")
+            with app.app_context():
+                if (ReplicaHeartbeat.query.count() != 1 or JobLock.query.filter_by(name="write_replica_heartbeat").count()
+                        or JobRun.query.filter_by(jobName="write_replica_heartbeat").count()):
+                    print("❌ Heartbeat was locked or recorded")
+                    return False
+                if any(job["name"] == "write_replica_heartbeat" for job in scheduler.job_overview()):
+                    print("❌ Heartbeat listed with the recorded jobs")
+                    return False
+        finally:
+            del JOBS["test_job"]
+        print("✅ Scheduler locking works")
+        return True
+    except Exception as e:
+        print(f"❌ Scheduler locking error: {e}")
+        return False
+
+def test_replica_routing():
+    """Test that read-only views read from a replica and fall back to the primary."""
+    print("\nTesting read-replica routing...")
+    try:
+        import tempfile
+        from flask import session
+        from models import db, Organizer, ReplicaHeartbeat
+        from db_routing import read_only, reset_replica_health
+        with tempfile.TemporaryDirectory() as tmp:
+            app = make_test_app(f"sqlite:///{os.path.join(tmp, 'primary.db')}",
+                                SQLALCHEMY_BINDS={"replica_0": f"sqlite:///{os.path.join(tmp, 'replica.db')}"})
+            beat = datetime.utcnow()
+            with app.app_context():
+                replica = db.engines["replica_0"]
+                db.metadata.create_all(replica)
+                db.session.add_all([Organizer(name="Primary", email="p@example.com", passwordHash="x"),
+                                    ReplicaHeartbeat(id=1, beatAt=beat)])
+                db.session.commit()
+                with replica.begin() as conn:
+                    conn.execute(ReplicaHeartbeat.__table__.insert(), {"id": 1, "beatAt": beat})
+
+            @read_only
+            def count_organizers():
+                return Organizer.query.count()
+
+            def read(**session_values):
+                with app.test_request_context():
+                    session.update(session_values)
+                    return count_organizers()
+
+            reset_replica_health()
+            if read() != 0:
+                print("❌ Read-only view did not use the replica")
+                return False
+            if read(_db_primary_until=datetime.now().timestamp() + 60) != 1:
+                print("❌ Read after write did not stay on the primary")
+                return False
+            with app.app_context():
+                db.session.merge(ReplicaHeartbeat(id=1, beatAt=beat + timedelta(minutes=5)))
+                db.session.commit()
+            reset_replica_health()
+            if read() != 1:
+                print("❌ Lagging replica was not bypassed")
+                return False
+            with app.app_context():
+                db.engines["replica_0"].dispose()
+                db.engines[None].dispose()
+            db.metadatas.pop("replica_0", None)  # Later apps have no such bind
+        print("✅ Read-replica routing works")
+        return True
+    except Exception as e:
+        print(f"❌ Replica routing error: {e}")
+        return False
+
+def test_guest_dedupe():
+    """Test duplicate guest merging and upserts keyed on the normalized email."""
+    print("\nTesting guest de-duplication...")
+    try:
+        from sqlalchemy import text
+        from models import db, Organizer, Event, Guest
+        from migrations import run_upgrades
+        from guest_import import upsert_guest, import_guests
+        app = make_test_app()
+        with app.app_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            event = Event(title="Party", date=datetime.now() + timedelta(days=7), organizerId=organizer.id)
+            db.session.add(event)
+            db.session.flush()
+            event_id = event.id
+            # A database from before the unique index, with duplicates
+            db.session.execute(text("DROP INDEX uq_guest_event_email"))
+            for i, (email, status) in enumerate([("Ann@Example.com", "pending"), ("ann@example.com ", "confirmed"),
+                                                 ("ANN@example.com", "declined"), ("bob@example.com", "pending")]):
+                db.session.add(Guest(eventId=event_id, name=f"G{i}", email=email, status=status,
+                                     phone="555" if i == 0 else None, uniqueAccessToken=f"tok{i}"))
+            db.session.commit()
+            db.session.execute(text("UPDATE Guests SET normalizedEmail = NULL"))
+            db.session.commit()
+
+            run_upgrades(batch_size=1)
+            guests = Guest.query.filter_by(eventId=event_id).order_by(Guest.id).all()
+            if [(g.uniqueAccessToken, g.status, g.phone) for g in guests] != [("tok1", "confirmed", "555"),
+                                                                              ("tok3", "pending", None)]:
+                print(f"❌ Unexpected guests after merge: {[(g.uniqueAccessToken, g.status) for g in guests]}")
+                return False
+
+            guest, created = upsert_guest(event_id, "Annie", "  ANN@EXAMPLE.COM")
+            if created or guest.uniqueAccessToken != "tok1" or guest.name != "Annie":
+                print("❌ Adding an existing address created a duplicate")
+                return False
+            result = import_guests(event_id, [
+                {"name": "Bob", "email": "Bob@example.com", "phone": "123"},
+                {"name": "Cy", "email": "cy@example.com", "phone": None},
+                {"name": "Cy Again", "email": "CY@example.com", "phone": None},
+                {"name": "", "email": "nobody", "phone": None}
+            ])
+            if result != {"created": 1, "updated": 1, "skipped": 1}:
+                print(f"❌ Unexpected import result: {result}")
+                return False
+            if Guest.query.filter_by(eventId=event_id).count() != 3:
+                print("❌ Import created duplicates")
+                return False
+        print("✅ Guest de-duplication works")
+        return True
+    except Exception as e:
+        print(f"❌ Guest de-duplication error: {e}")
+        return False
+
+def test_capacity_waitlist():
+    """Test that confirmations never exceed capacity and freed seats go to the waitlist."""
+    print("\nTesting capacity and waitlist...")
+    try:
+        from models import db, Organizer, Event, Guest
+        from seating import seats_taken_subquery
+        app = make_test_app()
+        with app.app_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            event = Event(title="Party", date=datetime.now() + timedelta(days=7), organizerId=organizer.id,
+                          capacity=5)
+            db.session.add(event)
+            db.session.flush()
+            event_id = event.id
+            for i in range(4):
+                db.session.add(Guest(eventId=event_id, name=f"G{i}", email=f"g{i}@example.com",
+                                     uniqueAccessToken=f"tok{i}"))
+            db.session.commit()
+
+        client = app.test_client()
+        statuses = [client.post(f"/rsvp/tok{i}", json={"status": "confirmed", "plus_one_count": 1})
+                    .get_json().get("status") for i in range(4)]
+        if statuses != ["confirmed", "confirmed", "waitlisted", "waitlisted"]:
+            print(f"❌ Unexpected RSVP results: {statuses}")
+            return False
+        if client.post("/rsvp/tok0", json={"status": "confirmed", "plus_one_count": 3}).status_code != 409:
+            print("❌ Growing a party beyond capacity was accepted")
+            return False
+
+        client.post("/rsvp/tok1", json={"status": "declined"})
+        with app.app_context():
+            event = db.session.get(Event, event_id)
+            status = {g.uniqueAccessToken: g.status for g in Guest.query.filter_by(eventId=event_id)}
+            if status != {"tok0": "confirmed", "tok1": "declined", "tok2": "confirmed", "tok3": "waitlisted"}:
+                print(f"❌ Freed seats not given to the first waitlisted guest: {status}")
+                return False
+            recount = db.session.execute(db.select(seats_taken_subquery(event_id))).scalar()
+            if event.seatsTaken != recount or event.seatsTaken > event.capacity:
+                print(f"❌ Seat count {event.seatsTaken} does not match confirmed guests ({recount})")
+                return False
+        print("✅ Capacity and waitlist work")
+        return True
+    except Exception as e:
+        print(f"❌ Capacity error: {e}")
+        return False
+
+def test_event_archival():
+    """Test archiving a past event in batches and restoring it intact."""
+    print("\nTesting event archival...")
+    try:
+        from models import db, Organizer, Event, Guest, GuestAnswer, RsvpChange, ArchivedEvent
+        from archive import archive_past_events, restore_event
+        from analytics import get_dashboard_summary
+        app = make_test_app()
+        with app.app_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            old = Event(title="Old", date=datetime.now() - timedelta(days=400), organizerId=organizer.id)
+            old.set_custom_fields({"meal_options": ["Fish", "Veg"]})
+            recent = Event(title="Recent", date=datetime.now() - timedelta(days=10), organizerId=organizer.id)
+            db.session.add_all([old, recent])
+            db.session.flush()
+            old_id = old.id
+            for i in range(7):
+                guest = Guest(eventId=old_id, name=f"G{i}", email=f"g{i}@example.com", uniqueAccessToken=f"tok{i}")
+                db.session.add(guest)
+                db.session.flush()
+                if i < 4:
+                    guest.update_status("confirmed", plus_one_count=1, responses={"meal_choice": "Fish"})
+            db.session.commit()
+            before = {g.uniqueAccessToken: (g.status, g.plusOneCount, g.updatedAt)
+                      for g in Guest.query.filter_by(eventId=old_id)}
+
+            if archive_past_events(older_than_days=365, batch_size=3) != [old_id]:
+                print("❌ Wrong events archived")
+                return False
+            archived = db.session.get(ArchivedEvent, old_id)
+            if (archived.guests, archived.confirmed, archived.attending) != (7, 4, 8) or archived.deletedAt is None:
+                print("❌ Final stats not frozen")
+                return False
+            if Guest.query.filter_by(eventId=old_id).count() or db.session.get(Event, old_id):
+                print("❌ Live rows left behind")
+                return False
+            totals = get_dashboard_summary(organizer.id, "past")["totals"]
+            if totals["total_events"] != 2 or totals["archived_events"] != 1 or totals["total_guests"] != 7:
+                print("❌ Archived event missing from the dashboard totals")
+                return False
+
+            restore_event(old_id, batch_size=3)
+            db.session.expire_all()
+            after = {g.uniqueAccessToken: (g.status, g.plusOneCount, g.updatedAt)
+                     for g in Guest.query.filter_by(eventId=old_id)}
+            if after != before or db.session.get(ArchivedEvent, old_id) is not None:
+                print("❌ Restored guests differ from the originals")
+                return False
+            if GuestAnswer.query.filter_by(eventId=old_id).count() != 4 or \
+                    RsvpChange.query.filter_by(eventId=old_id).count() != 4:
+                print("❌ Answers or change log not restored")
+                return False
+        print("✅ Event archival works")
+        return True
+    except Exception as e:
+        print(f"❌ Event archival error: {e}")
+        return False
+
+def test_mail_compose():
+    """Test composed messages: shared logo part, QR code part, escaped contact details and kept headers."""
+    print("\nTesting mail composition...")
+    try:
+        from email import message_from_bytes
+        from models import db, Organizer, Event, Guest
+        from email_utils import build_invitation_message, send_contact_email
+        app = make_test_app(MAIL_USERNAME="admin@example.com")
+        with app.app_context(), app.test_request_context():
+            organizer = Organizer(name="Org", email="org@example.com", passwordHash="x")
+            db.session.add(organizer)
+            db.session.flush()
+            event = Event(title="Party", date=datetime.now() + timedelta(days=7), organizerId=organizer.id)
+            db.session.add(event)
+            db.session.flush()
+            guests = [Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com", uniqueAccessToken=f"tok{i}")
+                      for i in range(2)]
+            db.session.add_all(guests)
+            db.session.commit()
+
+            first, second = (build_invitation_message(g, event, b"\x89PNG qr") for g in guests)
+            if first.inline_parts[0] is not second.inline_parts[0]:
+                print("❌ Logo part not shared between messages")
+                return False
+            parsed = message_from_bytes(first.as_bytes())
+            ids = [part["Content-ID"] for part in parsed.walk() if part["Content-ID"]]
+            related = parsed.get_payload(0)
+            if (parsed.get_content_type() != "multipart/mixed" or related.get_content_type() != "multipart/related"
+                    or ids != ["<logo>", "<qrcode>"]):
+                print(f"❌ Unexpected invitation structure: {parsed.get_content_type()} {ids}")
+                return False
+
+            with app.mail.record_messages() as outbox:
+                send_contact_email("Eve\nBcc: x@example.com", "eve@example.com", "<script>alert(1)</script>")
+            html = outbox[0].html
+            if "<script>" in html or "&lt;script&gt;" not in html or "\n" in outbox[0].subject:
+                print("❌ Contact form input not escaped")
+                return False
+
+            # Everything a plain Message carries survives the composed MIME tree
+            message = build_invitation_message(guests[0], event)
+            message.cc, message.bcc = ["cc@example.com"], ["bcc@example.com"]
+            message.reply_to = "org@example.com"
+            message.extra_headers = {"List-Unsubscribe": "<mailto:org@example.com>"}
+            message.body = "Plain text"
+            message.attach("notes.txt", "text/plain", b"Bring snacks")
+            parsed = message_from_bytes(message.as_bytes())
+            types = [part.get_content_type() for part in parsed.walk()]
+            if (parsed["Cc"] != "cc@example.com" or parsed["Reply-To"] != "org@example.com"
+                    or parsed["List-Unsubscribe"] != "<mailto:org@example.com>" or parsed["Bcc"]
+                    or "bcc@example.com" not in message.send_to
+                    or parsed.get_payload(0).get_content_type() != "multipart/alternative"
+                    or "text/plain" not in types or "text/calendar" not in types
+                    or parsed.get_payload()[-1].get_filename() != "notes.txt"):
+                print(f"❌ Composed message lost headers or parts: {types}")
+                return False
+        print("✅ Mail composition works")
+        return True
+    except Exception as e:
+        print(f"❌ Mail composition error: {e}")
+        return False
+
+def test_event_access():
+    """Test the ownership decorators: one joined query for event and guest, correct denials."""
+    print("\nTesting event access control...")
+    try:
+        from sqlalchemy import event as sa_event
+        from models import db, Organizer, Event, Guest
+        app = make_test_app()
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+            other = Organizer(name="Other", email="other@example.com", passwordHash="x")
+            db.session.add_all([owner, other])
+            db.session.flush()
+            events = [Event(title=f"E{i}", date=datetime.now() + timedelta(days=7), organizerId=owner.id)
+                      for i in range(2)]
+            db.session.add_all(events)
+            db.session.flush()
+            guest = Guest(eventId=events[0].id, name="G", email="g@example.com", uniqueAccessToken="tok")
+            db.session.add(guest)
+            db.session.commit()
+            owner_id, other_id, event_id, other_event_id, guest_id = \
+                owner.id, other.id, events[0].id, events[1].id, guest.id
+            engine = db.engine
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id)
+        sa_event.listen(engine, "before_cursor_execute", count)
+        try:
+            response = client.get(f"/event/{event_id}/guest/{guest_id}")
+        finally:
+            sa_event.remove(engine, "before_cursor_execute", count)
+        if response.status_code != 200 or response.get_json()["email"] != "g@example.com":
+            print(f"❌ Owner could not load the guest: {response.status_code}")
+            return False
+        if len(statements) > 2:
+            print(f"❌ Expected at most 2 queries, ran {len(statements)}")
+            return False
+        if client.get(f"/event/{other_event_id}/guest/{guest_id}").status_code != 404:
+            print("❌ Guest of another event was returned")
+            return False
+        if client.get(f"/event/999/guest/{guest_id}").status_code != 404:
+            print("❌ Unknown event not a 404")
+            return False
+
+        with client.session_transaction() as session:
+            session["_user_id"] = str(other_id)
+        if client.get(f"/event/{event_id}/guest/{guest_id}").status_code != 403:
+            print("❌ Another organizer was allowed in")
+            return False
+        if client.get(f"/event/{event_id}").status_code != 302:
+            print("❌ Event page did not redirect an unauthorized organizer")
+            return False
+        print("✅ Event access control works")
+        return True
+    except Exception as e:
+        print(f"❌ Event access control error: {e}")
+        return False
+
+def test_rate_limits():
+    """Test token buckets and daily mail quotas with both backends."""
+    print("\nTesting rate limits...")
+    try:
+        import tempfile
+        import time
+        from models import db, Organizer, Event, Guest, MailQuota
+        from rate_limit import limiter, MemoryBackend, RateLimitExceeded
+
+        app = make_test_app(RATE_LIMITS={"reminders": (2, 1), "invitations": (30, 300)},
+                            MAIL_DAILY_QUOTA_ORGANIZER=2)
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+            intruder = Organizer(name="Intruder", email="intruder@example.com", passwordHash="x")
+            db.session.add_all([owner, intruder])
+            db.session.flush()
+            event = Event(title="E", date=datetime.now() + timedelta(days=7), organizerId=owner.id)
+            db.session.add(event)
+            db.session.flush()
+            db.session.add_all([Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com",
+                                      uniqueAccessToken=f"tok{i}") for i in range(2)])
+            db.session.commit()
+            owner_id, intruder_id, event_id = owner.id, intruder.id, event.id
+
+        client = app.test_client()
+        url = f"/event/{event_id}/guests/remind"
+        # Access is checked first: requests to someone else's event take no tokens
+        with client.session_transaction() as session:
+            session["_user_id"] = str(intruder_id)
+        denied = [client.post(url, json={"recipientType": "pending"}).status_code for _ in range(3)]
+        if 429 in denied or limiter.backend.take(f"reminders:organizer:{intruder_id}", 2, 1):
+            print(f"❌ Denied requests used the rate limit: {denied}")
+            return False
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id)
+        first = client.post(url, json={"recipientType": "pending"})
+        if first.status_code != 200 or "sent to 2" not in first.get_json()["message"]:
+            print(f"❌ First reminder batch failed: {first.status_code}")
+            return False
+        # 2 + 2 emails exceed the quota of 2, though the bucket still has a token
+        second = client.post(url, json={"recipientType": "pending"})
+        if second.status_code != 429 or "daily limit" not in second.get_json()["error"]:
+            print(f"❌ Mail quota not enforced: {second.status_code}")
+            return False
+        third = client.post(url, json={"recipientType": "pending"})
+        if third.status_code != 429 or int(third.headers["Retry-After"]) < 3000:
+            print(f"❌ Token bucket not enforced: {third.status_code} {third.headers.get('Retry-After')}")
+            return False
+        # The quota is used up: a refused invitation must not add the guest either
+        refused = client.post(f"/event/{event_id}/guests",
+                              json={"name": "New", "email": "new@example.com", "sendInvite": True})
+        with app.app_context():
+            added = Guest.query.filter_by(eventId=event_id, email="new@example.com").count()
+        if refused.status_code != 429 or added:
+            print(f"❌ Refused invitation still added the guest: {refused.status_code}")
+            return False
+
+        # The memory backend keeps a bounded number of buckets: refilled ones go first, then idle ones
+        backend = MemoryBackend(max_keys=10)
+        for i in range(10):
+            backend.take(f"contact:ip:{i}", 1, 3600 * 1000)  # Refilled again within milliseconds
+        time.sleep(0.01)
+        backend.take("contact:ip:held", 1, 1)
+        backend.take("contact:ip:new", 1, 1)
+        if list(backend._buckets) != ["contact:ip:held", "contact:ip:new"]:
+            print(f"❌ Refilled buckets kept: {list(backend._buckets)}")
+            return False
+        for i in range(30):
+            backend.take(f"contact:ip:x{i}", 1, 1)
+        if len(backend._buckets) > 10 or not backend.take("contact:ip:x29", 1, 1):
+            print(f"❌ Memory buckets not bounded: {len(backend._buckets)}")
+            return False
+
+        # Behind a trusted proxy, anonymous clients get their own buckets
+        app = make_test_app(TRUSTED_PROXIES=1, RATE_LIMITS={"password_reset": (1, 1)})
+        client = app.test_client()
+        limited = []
+        for address in ("203.0.113.1", "203.0.113.2", "203.0.113.1"):
+            response = client.post("/forgot-password", data={"email": "nobody@example.com"},
+                                   headers={"X-Forwarded-For": address})
+            limited.append("Retry-After" in response.headers)
+        if limited != [False, False, True]:
+            print(f"❌ Forwarded client addresses not used: {limited}")
+            return False
+
+        with tempfile.TemporaryDirectory() as tmp:
+            app = make_test_app(f"sqlite:///{tmp}/limits.db", RATE_LIMIT_BACKEND="database")
+            with app.app_context():
+                backend = limiter.backend
+                if backend.take("s:k", 2, 1) or backend.take("s:k", 2, 1) or not backend.take("s:k", 2, 1):
+                    print("❌ Database bucket did not run out after its burst")
+                    return False
+                if not backend.charge("k", 3, 5) or backend.charge("k", 3, 5) or not backend.charge("k", 2, 5):
+                    print("❌ Database quota charged beyond its limit")
+                    return False
+                if backend.charge("other", 6, 5) or MailQuota.query.filter_by(key="k").one().count != 5:
+                    print("❌ Database quota counts are wrong")
+                    return False
+                # Counters are written on their own connection: staged request work is left alone
+                db.session.add(Organizer(name="Staged", email="staged@example.com", passwordHash="x"))
+                backend.charge("staged", 1, 5)
+                backend.take("s:staged", 2, 1)
+                db.session.rollback()
+                if Organizer.query.count() or MailQuota.query.filter_by(key="staged").one().count != 1:
+                    print("❌ Database backend committed or lost the request's session")
+                    return False
+                try:
+                    limiter.charge("k", 1, 5)
+                    print("❌ Exhausted quota did not raise")
+                    return False
+                except RateLimitExceeded as e:
+                    if e.code != 429:
+                        print(f"❌ Unexpected status {e.code}")
+                        return False
+                db.session.remove()
+                db.engine.dispose()
+        print("✅ Rate limits work")
+        return True
+    except Exception as e:
+        print(f"❌ Rate limit error: {e}")
+        return False
+
+def test_calendar_feeds():
+    """Test ICS attachments and organizer feeds: caching per event version and ETag/304."""
+    print("\nTesting calendar feeds...")
+    try:
+        import ical
+        from models import db, Organizer, Event, Guest
+        from email_utils import build_invitation_message
+        app = make_test_app()
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x", calendarToken="feedtoken")
+            db.session.add(owner)
+            db.session.flush()
+            event = Event(title="Launch, Party; 2", date=datetime(2030, 5, 1, 18, 30), organizerId=owner.id,
+                          location="Main Hall", description="Line one\nLine two " + "x" * 100)
+            db.session.add(event)
+            db.session.flush()
+            guest = Guest(eventId=event.id, name="G", email="g@example.com", uniqueAccessToken="tok")
+            db.session.add(guest)
+            db.session.commit()
+            event_id = event.id
+
+            body = ical.event_calendar(event).decode("utf-8")
+            if "SUMMARY:Launch\\, Party\\; 2" not in body or "DTSTART:20300501T183000" not in body:
+                print("❌ Event calendar has wrong fields")
+                return False
+            if any(len(line.encode("utf-8")) > 75 for line in body.split("\r\n")):
+                print("❌ Calendar lines are not folded")
+                return False
+            if ical.vevent(event) is not ical.vevent(event):
+                print("❌ VEVENT rendered again for the same version")
+                return False
+            message = build_invitation_message(guest, event).as_string()
+            if "multipart/mixed" not in message or "text/calendar" not in message or "invite.ics" not in message:
+                print("❌ Invitation has no calendar attachment")
+                return False
+
+        client = app.test_client()
+        first = client.get("/calendar/feedtoken.ics")
+        if first.status_code != 200 or first.mimetype != "text/calendar" or b"Launch" not in first.data:
+            print(f"❌ Feed not served: {first.status_code}")
+            return False
+        etag = first.headers["ETag"]
+        if client.get("/calendar/feedtoken.ics", headers={"If-None-Match": etag}).status_code != 304:
+            print("❌ Unchanged feed not answered with 304")
+            return False
+        if client.get("/calendar/wrong.ics").status_code != 404:
+            print("❌ Unknown feed token not a 404")
+            return False
+
+        with app.app_context():
+            event = db.session.get(Event, event_id)
+            event.title = event.title  # Unchanged fields keep the version
+            db.session.commit()
+            if client.get("/calendar/feedtoken.ics", headers={"If-None-Match": etag}).status_code != 304:
+                print("❌ Feed version changed without a change")
+                return False
+            event.location = "Garden"
+            db.session.commit()
+        changed = client.get("/calendar/feedtoken.ics", headers={"If-None-Match": etag})
+        if changed.status_code != 200 or b"Garden" not in changed.data or changed.headers["ETag"] == etag:
+            print("❌ Changed event not in the feed")
+            return False
+        print("✅ Calendar feeds work")
+        return True
+    except Exception as e:
+        print(f"❌ Calendar feed error: {e}")
+        return False
+
+def test_dashboard_summary():
+    """Test the dashboard summary API: keyset pages, scopes, local dates and totals in one query."""
+    print("\nTesting dashboard summary...")
+    try:
+        from sqlalchemy import event as sa_event
+        from models import db, Organizer, Event, Guest
+        app = make_test_app()
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+            other = Organizer(name="Other", email="other@example.com", passwordHash="x")
+            db.session.add_all([owner, other])
+            db.session.flush()
+            now = datetime.now()
+            upcoming = [Event(title=f"U{i}", date=now + timedelta(days=i + 1), organizerId=owner.id) for i in range(5)]
+            past = [Event(title=f"P{i}", date=now - timedelta(days=i + 1), organizerId=owner.id) for i in range(3)]
+            db.session.add_all(upcoming + past + [Event(title="X", date=now + timedelta(days=1), organizerId=other.id)])
+            db.session.flush()
+            statuses = ["confirmed", "confirmed", "pending", "declined"]
+            db.session.add_all([Guest(eventId=upcoming[0].id, name=f"G{i}", email=f"g{i}@example.com",
+                                      uniqueAccessToken=f"tok{i}", status=status, plusOneCount=1)
+                                for i, status in enumerate(statuses)])
+            db.session.commit()
+            owner_id, engine = owner.id, db.engine
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id)
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sa_event.listen(engine, "before_cursor_execute", count)
+        try:
+            first = client.get("/api/dashboard/summary?scope=upcoming&limit=2").get_json()
+        finally:
+            sa_event.remove(engine, "before_cursor_execute", count)
+        if len(statements) > 2:
+            print(f"❌ Expected the user and one summary query, ran {len(statements)}")
+            return False
+        card = first["events"][0]
+        if (card["title"] != "U0" or card["confirmed"] != 2 or card["pending"] != 1
+                or card["total_attending"] != 4 or card["guests"] != 4):
+            print(f"❌ Wrong card: {card}")
+            return False
+        totals = first["totals"]
+        if (totals["total_events"] != 8 or totals["upcoming_events"] != 5 or totals["past_events"] != 3
+                or totals["total_guests"] != 4 or totals["average_response_rate"] != 0.75):
+            print(f"❌ Wrong totals: {totals}")
+            return False
+
+        titles, cursor = [e["title"] for e in first["events"]], first["next_cursor"]
+        while cursor:
+            page = client.get("/api/dashboard/summary", query_string={"scope": "upcoming", "limit": 2,
+                                                                       "cursor": cursor}).get_json()
+            titles += [e["title"] for e in page["events"]]
+            cursor = page["next_cursor"]
+        if titles != ["U0", "U1", "U2", "U3", "U4"]:
+            print(f"❌ Upcoming pages wrong: {titles}")
+            return False
+        past_page = client.get("/api/dashboard/summary?scope=past").get_json()
+        if [e["title"] for e in past_page["events"]] != ["P0", "P1", "P2"] or past_page["next_cursor"]:
+            print("❌ Past events not latest first")
+            return False
+
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id + 1)
+        empty = client.get("/api/dashboard/summary?scope=past").get_json()
+        if empty["events"] or empty["totals"]["total_events"] != 1:
+            print("❌ Empty page lost its totals")
+            return False
+        if client.get("/api/dashboard/summary?cursor=bogus").status_code != 400:
+            print("❌ Invalid cursor accepted")
+            return False
+        if client.get("/api/dashboard/summary?scope=bogus").status_code != 400:
+            print("❌ Invalid scope accepted")
+            return False
+
+        # Event dates are local: an event in an hour is upcoming even west of UTC
+        import time
+        from analytics import get_dashboard_summary
+        saved_tz = os.environ.get("TZ")
+        os.environ["TZ"] = "Etc/GMT+10"
+        time.tzset()
+        try:
+            with app.app_context():
+                db.session.add(Event(title="Soon", date=datetime.now() + timedelta(hours=1), organizerId=owner_id))
+                db.session.commit()
+                soon = get_dashboard_summary(owner_id, "upcoming", limit=1)
+                try:
+                    get_dashboard_summary(owner_id, "bogus")
+                    print("❌ Unknown scope treated as a known one")
+                    return False
+                except ValueError:
+                    pass
+        finally:
+            if saved_tz is None:
+                os.environ.pop("TZ")
+            else:
+                os.environ["TZ"] = saved_tz
+            time.tzset()
+        if soon["events"][0]["title"] != "Soon" or soon["totals"]["upcoming_events"] != 6:
+            print(f"❌ Local event dates compared with UTC: {soon['events']}")
+            return False
+        if client.get("/dashboard").status_code != 200:
+            print("❌ Dashboard did not render")
+            return False
+        print("✅ Dashboard summary works")
+        return True
+    except Exception as e:
+        print(f"❌ Dashboard summary error: {e}")
+        return False
+
+def test_bulk_guest_operations():
+    """Test bulk guest selection by ids and filter, rejected selections and recorded rollups."""
+    print("\nTesting bulk guest operations...")
+    try:
+        from models import db, Organizer, Event, Guest, RsvpChange, RsvpDailyRollup
+        app = make_test_app()
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+            db.session.add(owner)
+            db.session.flush()
+            event = Event(title="E", date=datetime.now() + timedelta(days=7), organizerId=owner.id)
+            db.session.add(event)
+            db.session.flush()
+            guests = [Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com", uniqueAccessToken=f"tok{i}",
+                            status="declined" if i == 3 else "pending") for i in range(4)]
+            db.session.add_all(guests)
+            db.session.commit()
+            owner_id, event_id, ids = owner.id, event.id, [g.id for g in guests]
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id)
+        url = f"/event/{event_id}/guests/bulk"
+
+        for body in ({"action": "delete"}, {"action": "delete", "filter": {}},
+                     {"action": "delete", "filter": {"status": "confrimed"}},
+                     {"action": "delete", "filter": {"staus": "pending"}},
+                     {"action": "delete", "filter": {"search": "  "}},
+                     {"action": "delete", "guestIds": []},
+                     {"action": "set_status", "status": "confirmed", "filter": {"status": None}}):
+            response = client.post(url, json=body)
+            if response.status_code != 400:
+                print(f"❌ Selection accepted: {body} -> {response.status_code}")
+                return False
+        with app.app_context():
+            if Guest.query.filter_by(eventId=event_id).count() != 4:
+                print("❌ Rejected request changed guests")
+                return False
+
+        result = client.post(url, json={"action": "set_status", "status": "confirmed",
+                                        "guestIds": ids[:2]}).get_json()
+        if not result["success"] or result["affected"] != 2:
+            print(f"❌ Selection by ids failed: {result}")
+            return False
+        with app.app_context():
+            changes = RsvpChange.query.filter_by(eventId=event_id).all()
+            rollup = RsvpDailyRollup.query.filter_by(eventId=event_id).one()
+            if (sorted(c.guestId for c in changes) != ids[:2]
+                    or rollup.responses != 2 or rollup.confirmed != 2):
+                print("❌ set_status did not record its changes and rollups")
+                return False
+
+        result = client.post(url, json={"action": "delete", "filter": {"status": "pending"}}).get_json()
+        if not result["success"] or result["affected"] != 1:
+            print(f"❌ Selection by filter failed: {result}")
+            return False
+        result = client.post(url, json={"action": "delete", "filter": {"search": "g3@"}}).get_json()
+        with app.app_context():
+            left = sorted(g.id for g in Guest.query.filter_by(eventId=event_id))
+        if result["affected"] != 1 or left != ids[:2]:
+            print(f"❌ Filtered deletes removed the wrong guests: {left}")
+            return False
+        print("✅ Bulk guest operations work")
+        return True
+    except Exception as e:
+        print(f"❌ Bulk guest operation error: {e}")
+        return False
+
+def test_http_cache():
+    """Test static fingerprints, the page cache's ETag/304, gzip variants and bounded keys."""
+    print("\nTesting HTTP caching...")
+    try:
+        import gzip
+        import time
+        import http_cache
+        from flask import url_for
+        http_cache.clear_page_cache()
+        app = make_test_app(PAGE_CACHE_TTL=60, PAGE_CACHE_SIZE=2, PAGE_CACHE_QUERY_ARGS=("page",))
+        with app.test_request_context():
+            static_url = url_for("static", filename="styles.css")
+        if "?v=" not in static_url:
+            print(f"❌ Static URL has no fingerprint: {static_url}")
+            return False
+        client = app.test_client()
+        static = client.get(static_url)
+        if static.status_code != 200 or "immutable" not in static.headers.get("Cache-Control", ""):
+            print(f"❌ Fingerprinted static file not immutable: {static.headers.get('Cache-Control')}")
+            return False
+
+        first = client.get("/")
+        second = client.get("/")
+        etag = second.headers.get("ETag")
+        if first.headers.get("X-Page-Cache") != "MISS" or second.headers.get("X-Page-Cache") != "HIT" or not etag:
+            print("❌ Public page not served from the cache")
+            return False
+        if client.get("/", headers={"If-None-Match": etag}).status_code != 304:
+            print("❌ Unchanged page not answered with 304")
+            return False
+
+        zipped = client.get("/", headers={"Accept-Encoding": "gzip"})
+        if (zipped.headers.get("Content-Encoding") != "gzip" or zipped.headers.get("ETag") == etag
+                or gzip.decompress(zipped.data) != second.data):
+            print("❌ Gzip variant wrong")
+            return False
+        refused = client.get("/", headers={"Accept-Encoding": "gzip;q=0"})
+        if "Content-Encoding" in refused.headers or refused.data != second.data:
+            print("❌ gzip;q=0 treated as accepting gzip")
+            return False
+
+        for query in ("?x=1", "?x=2", "?utm_source=a", "?page=2", "?page=3"):
+            client.get("/" + query)
+        keys = list(http_cache._page_cache)
+        if keys != ["/?page=2", "/?page=3"]:
+            print(f"❌ Page cache keys not bounded to allowed arguments: {keys}")
+            return False
+        http_cache.clear_page_cache()
+
+        # Precompressed copies are only served for the content they were made from
+        import tempfile
+        with tempfile.TemporaryDirectory() as static_dir:
+            app.static_folder = static_dir
+            asset = os.path.join(static_dir, "site.css")
+            with open(asset, "w") as f:
+                f.write("body { color: red; }" * 50)
+            app.test_cli_runner().invoke(args=["compress-static"])
+            with app.test_request_context():
+                url = url_for("static", filename="site.css")
+            served = client.get(url, headers={"Accept-Encoding": "gzip"})
+            if served.headers.get("Content-Encoding") != "gzip":
+                print("❌ Precompressed copy not served")
+                return False
+            served.close()
+            with open(asset, "w") as f:
+                f.write("body { color: blue; }" * 50)
+            os.utime(asset, (time.time() + 5, time.time() + 5))
+            with app.test_request_context():
+                url = url_for("static", filename="site.css")
+            served = client.get(url, headers={"Accept-Encoding": "gzip"})
+            if "Content-Encoding" in served.headers or b"blue" not in served.data:
+                print("❌ Stale precompressed copy served for an edited file")
+                return False
+            served.close()
+            app.test_cli_runner().invoke(args=["compress-static"])
+            copies = sorted(name for name in os.listdir(static_dir) if name != "site.css")
+            current = http_cache.static_fingerprint(app, "site.css")
+            served = client.get(url, headers={"Accept-Encoding": "gzip"})
+            if not copies or any(current not in name for name in copies) or gzip.decompress(served.data) != open(asset, "rb").read():
+                print(f"❌ compress-static left stale copies: {copies}")
+                return False
+            served.close()
+        print("✅ HTTP caching works")
+        return True
+    except Exception as e:
+        print(f"❌ HTTP caching error: {e}")
+        return False
+
+def test_parallel_seat_claims():
+    """Test that parallel confirmations of the last seats never overbook the event."""
+    print("\nTesting parallel seat claims...")
+    try:
+        import tempfile
+        import threading
+        from models import db, Organizer, Event, Guest
+        from seating import apply_rsvp
+        with tempfile.TemporaryDirectory() as tmp:
+            app = make_test_app(f"sqlite:///{os.path.join(tmp, 'seats.db')}")
+            with app.app_context():
+                owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+                db.session.add(owner)
+                db.session.flush()
+                event = Event(title="E", date=datetime.now() + timedelta(days=7), organizerId=owner.id,
+                              capacity=5, seatsTaken=2)
+                db.session.add(event)
+                db.session.flush()
+                guests = [Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com",
+                                uniqueAccessToken=f"tok{i}") for i in range(8)]
+                db.session.add_all(guests)
+                db.session.commit()
+                event_id, guest_ids = event.id, [g.id for g in guests]
+
+            # Every thread has its own app context, so its own session and connection
+            barrier = threading.Barrier(len(guest_ids))
+            results, errors = {}, []
+            def confirm(guest_id):
+                try:
+                    with app.app_context():
+                        guest = db.session.get(Guest, guest_id)
+                        barrier.wait()
+                        results[guest_id] = apply_rsvp(guest, "confirmed")
+                        db.session.commit()
+                        db.session.remove()
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=confirm, args=(guest_id,)) for guest_id in guest_ids]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                print(f"❌ Parallel claim failed: {errors[0]}")
+                return False
+
+            with app.app_context():
+                event = db.session.get(Event, event_id)
+                statuses = [g.status for g in Guest.query.filter_by(eventId=event_id)]
+                if event.seatsTaken > event.capacity or event.seatsTaken != 5:
+                    print(f"❌ Event overbooked: {event.seatsTaken}/{event.capacity}")
+                    return False
+                if statuses.count("confirmed") != 3 or statuses.count("waitlisted") != 5:
+                    print(f"❌ Losers not waitlisted: {statuses}")
+                    return False
+                if sorted(results.values()) != sorted(statuses):
+                    print("❌ Reported statuses differ from the stored ones")
+                    return False
+                db.session.remove()
+                db.engine.dispose()
+        print("✅ Parallel seat claims work")
+        return True
+    except Exception as e:
+        print(f"❌ Parallel seat claim error: {e}")
+        return False
+
+def test_response_report():
+    """Test per-option response counts with plus ones, from one indexed aggregate query."""
+    print("\nTesting response report...")
+    try:
+        from sqlalchemy import event as sa_event
+        from models import db, Organizer, Event, Guest
+        from analytics import get_response_breakdown
+        app = make_test_app()
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+            db.session.add(owner)
+            db.session.flush()
+            event = Event(title="Dinner", date=datetime.now() + timedelta(days=7), organizerId=owner.id)
+            event.set_custom_fields({"meal_options": ["Fish", "Beef"], "dress_code": "Black tie",
+                                     "additional_info": "Allergies?"})
+            db.session.add(event)
+            db.session.flush()
+            answers = [("confirmed", 2, {"meal_choice": "Fish", "dress_code_ack": True, "additional_notes": "Nuts"}),
+                       ("confirmed", 0, {"meal_choice": "Fish", "dress_code_ack": False}),
+                       ("confirmed", 1, {"meal_choice": "Vegan"}),  # No longer offered, still counted
+                       ("declined", 0, {"meal_choice": "Beef", "dress_code_ack": True})]
+            for i, (status, plus_ones, responses) in enumerate(answers):
+                guest = Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com", uniqueAccessToken=f"tok{i}")
+                db.session.add(guest)
+                db.session.flush()
+                guest.update_status(status, plus_one_count=plus_ones, responses=responses)
+            db.session.commit()
+            owner_id, event_id, engine = owner.id, event.id, db.engine
+
+            statements = []
+            def count(conn, cursor, statement, parameters, *args):
+                statements.append((statement, parameters))
+            sa_event.listen(engine, "before_cursor_execute", count)
+            try:
+                get_response_breakdown(event_id)
+            finally:
+                sa_event.remove(engine, "before_cursor_execute", count)
+            if len(statements) != 2:
+                print(f"❌ Expected the questions and one aggregate query, ran {len(statements)}")
+                return False
+            connection = engine.raw_connection()
+            try:
+                plan = " ".join(str(row) for row in
+                                connection.cursor().execute("EXPLAIN QUERY PLAN " + statements[1][0], statements[1][1]))
+            finally:
+                connection.close()
+            if "GuestAnswers USING INDEX" not in plan:
+                print(f"❌ Report query does not use an index: {plan}")
+                return False
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id)
+        report = {q["key"]: q for q in client.get(f"/event/{event_id}/reports/responses").get_json()["questions"]}
+        meals = {o["value"]: (o["guests"], o["headcount"]) for o in report["meal_choice"]["options"]}
+        if meals != {"Fish": (2, 4), "Beef": (0, 0), "Vegan": (1, 2)}:
+            print(f"❌ Wrong meal counts: {meals}")
+            return False
+        acks = {o["value"]: o["guests"] for o in report["dress_code_ack"]["options"]}
+        if acks != {"Yes": 1, "No": 1} or report["additional_notes"]["answered"] != 1:
+            print(f"❌ Wrong acknowledgement or text counts: {acks}")
+            return False
+        print("✅ Response report works")
+        return True
+    except Exception as e:
+        print(f"❌ Response report error: {e}")
+        return False
+
+def test_invitation_campaigns():
+    """Test campaign audience selection, pause/resume across batches and per-recipient states."""
+    print("\nTesting invitation campaigns...")
+    try:
+        import smtplib
+        import campaigns
+        from models import db, Organizer, Event, Guest, CampaignRecipient, InvitationCampaign
+        app = make_test_app(RATE_LIMIT_ENABLED=False, CAMPAIGN_BATCH_SIZE=10, CAMPAIGN_SEND_RATE=0)
+        with app.app_context():
+            owner = Organizer(name="Owner", email="owner@example.com", passwordHash="x")
+            db.session.add(owner)
+            db.session.flush()
+            event = Event(title="E", date=datetime.now() + timedelta(days=7), organizerId=owner.id)
+            db.session.add(event)
+            db.session.flush()
+            statuses = ["confirmed", "declined", "pending", "pending", "pending", "pending"]
+            db.session.add_all([Guest(eventId=event.id, name=f"G{i}", email=f"g{i}@example.com",
+                                      uniqueAccessToken=f"tok{i}", status=status)
+                                for i, status in enumerate(statuses)])
+            db.session.commit()
+            owner_id, event_id = owner.id, event.id
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(owner_id)
+        # Invited the old way: must not be picked up again by a not_invited campaign
+        response = client.post(f"/event/{event_id}/guests", json={
+            "name": "Legacy", "email": "legacy@example.com", "sendInvite": True})
+        if not response.get_json()["success"]:
+            print("❌ Adding an invited guest failed")
+            return False
+
+        with app.app_context():
+            event = db.session.get(Event, event_id)
+            counts = {f: campaigns.count_campaign_guests(event, f) for f in campaigns.GUEST_FILTERS}
+        if counts != {"all": 7, "pending": 5, "confirmed": 1, "declined": 1, "not_invited": 6}:
+            print(f"❌ Wrong audiences: {counts}")
+            return False
+
+        campaign = client.post(f"/event/{event_id}/campaigns", json={"guestFilter": "not_invited"}).get_json()
+        campaign_id = campaign["campaign"]["id"]
+        if campaign["campaign"]["progress"]["queued"] != 6:
+            print(f"❌ Campaign queued the wrong guests: {campaign}")
+            return False
+
+        build = campaigns.build_invitation_message
+
+        def flaky_build(guest, event, qr_image=None):
+            if guest.email == "g3@example.com":
+                raise smtplib.SMTPRecipientsRefused({guest.email: (550, b"No such user")})
+            if guest.email == "g4@example.com":
+                raise ValueError("template error")
+            return build(guest, event, qr_image)
+
+        campaigns.build_invitation_message = flaky_build
+        try:
+            with app.app_context():
+                attempted = campaigns.run_campaign_batch(db.session.get(InvitationCampaign, campaign_id),
+                                                         batch_size=2, send_rate=0, qr_workers=2)
+                first = db.session.get(InvitationCampaign, campaign_id).get_progress()["progress"]
+            if attempted != 2 or first["sent"] != 2 or first["queued"] != 4:
+                print(f"❌ First batch sent the wrong number: {first}")
+                return False
+
+            client.post(f"/event/{event_id}/campaigns/{campaign_id}/pause")
+            with app.app_context():
+                campaigns.process_campaigns()
+                paused = db.session.get(InvitationCampaign, campaign_id).get_progress()["progress"]
+            if paused != first:
+                print("❌ A paused campaign kept sending")
+                return False
+
+            client.post(f"/event/{event_id}/campaigns/{campaign_id}/resume")
+            with app.app_context():
+                campaigns.process_campaigns()  # The rest of the queue
+                campaigns.process_campaigns()  # Nothing queued: completes
+                campaign = db.session.get(InvitationCampaign, campaign_id)
+                progress = campaign.get_progress()
+                states = {r.guest.email: r.state for r in CampaignRecipient.query.filter_by(campaignId=campaign_id)}
+                invited = {g.email for g in Guest.query.filter(Guest.invitedAt.isnot(None))}
+                retry = campaigns.count_campaign_guests(campaign.event, "not_invited")
+        finally:
+            campaigns.build_invitation_message = build
+
+        if progress["state"] != "completed" or progress["progress"]["sent"] != 4:
+            print(f"❌ Resumed campaign did not finish: {progress}")
+            return False
+        if states["g3@example.com"] != "bounced" or states["g4@example.com"] != "failed" \
+                or "legacy@example.com" in states:
+            print(f"❌ Wrong recipient states: {states}")
+            return False
+        if invited != {"legacy@example.com", "g0@example.com", "g1@example.com", "g2@example.com",
+                       "g5@example.com"} or retry != 2:
+            print(f"❌ Invitations not recorded: {invited}, {retry} left to invite")
+            return False
+        print("✅ Invitation campaigns work")
+        return True
+    except Exception as e:
+        print(f"❌ Invitation campaign error: {e}")
+        return False
+
 def main():
     """Run all tests."""
     print("🚀 RSVP Manager - Application Test")
@@ -115,7 +1488,26 @@ def main():
         test_config,
         test_app_creation,
         test_models,
-        test_qr_generation
+        test_qr_generation,
+        test_tracing,
+        test_custom_fields_migration,
+        test_rsvp_ingest_queue,
+        test_rsvp_rollups,
+        test_scheduler_locking,
+        test_replica_routing,
+        test_guest_dedupe,
+        test_capacity_waitlist,
+        test_event_archival,
+        test_mail_compose,
+        test_event_access,
+        test_rate_limits,
+        test_calendar_feeds,
+        test_dashboard_summary,
+        test_bulk_guest_operations,
+        test_http_cache,
+        test_parallel_seat_claims,
+        test_response_report,
+        test_invitation_campaigns
     ]
     
     passed = 0
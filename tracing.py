@@ -0,0 +1,273 @@
+"""Structured logging and sampled request tracing.
+
+Log records are written as one JSON object per line and carry the ID of the
+request that produced them. A configurable fraction of requests (and every
+scheduler job) is traced: SQL statements, template renders, mail sends and
+QR generation are recorded as spans, and finished traces are kept in an
+in-memory ring buffer that the admin traces page reads.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+# Traces for work that runs outside a request (scheduler jobs, CLI commands)
+_local = threading.local()
+_traces = deque(maxlen=200)
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class Trace:
+    """Spans collected for one request or job."""
+
+    __slots__ = ('trace_id', 'name', 'started_at', 'start', 'duration_ms',
+                 'status', 'spans', 'dropped', 'max_spans', '_template_starts')
+
+    def __init__(self, name, trace_id=None, max_spans=500):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.spans = []
+        self.dropped = 0
+        self.max_spans = max_spans
+        self._template_starts = []
+
+    def add_span(self, kind, name, start, duration_ms, **attrs):
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        self.spans.append({
+            'kind': kind,
+            'name': name,
+            'offset_ms': round((start - self.start) * 1000, 3),
+            'duration_ms': round(duration_ms, 3),
+            'attrs': attrs
+        })
+
+    def finish(self, status=None):
+        self.duration_ms = round((time.perf_counter() - self.start) * 1000, 3)
+        self.status = status
+        _traces.append(self)
+
+    def time_by_kind(self):
+        totals = {}
+        for s in self.spans:
+            totals[s['kind']] = totals.get(s['kind'], 0) + s['duration_ms']
+        return {k: round(v, 3) for k, v in totals.items()}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request or trace ID to every record."""
+
+    def filter(self, record):
+        request_id = g.get('request_id') if has_request_context() else None
+        if request_id is None:
+            trace = current_trace()
+            request_id = trace.trace_id if trace is not None else None
+        record.request_id = request_id
+        return True
+
+
+def incoming_request_id():
+    """The client's ``X-Request-ID`` if it is a plausible ID, else None.
+
+    It ends up in logs and response headers, so anything longer or with
+    other characters is replaced by a generated ID.
+    """
+    value = request.headers.get('X-Request-ID', '')
+    return value if REQUEST_ID_PATTERN.fullmatch(value) else None
+
+
+def current_trace():
+    """Return the trace being recorded for this request or thread, if any."""
+    if has_request_context():
+        trace = g.get('_trace')
+        if trace is not None:
+            return trace
+    # Background jobs may push a request context of their own to build URLs
+    return getattr(_local, 'trace', None)
+
+
+def recent_traces(limit=None):
+    """Most recent finished traces, newest first."""
+    traces = list(_traces)[::-1]
+    return traces[:limit] if limit else traces
+
+
+@contextmanager
+def span(kind, name=None, **attrs):
+    """Record the enclosed block as a span of the current trace.
+
+    Costs a single lookup when the current request is not sampled.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(kind, name, start, (time.perf_counter() - start) * 1000, **attrs)
+
+
+@contextmanager
+def job_trace(name, max_spans=500):
+    """Trace a unit of background work running outside a request."""
+    trace = Trace(name, max_spans=max_spans)
+    previous = getattr(_local, 'trace', None)
+    _local.trace = trace
+    status = 'ok'
+    try:
+        yield trace
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        _local.trace = previous
+        trace.finish(status)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_trace() is not None:
+        conn.info.setdefault('_trace_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = current_trace()
+    starts = conn.info.get('_trace_start')
+    if trace is None or not starts:
+        return
+    start = starts.pop()
+    trace.add_span('sql', statement.split(None, 1)[0].upper(), start,
+                   (time.perf_counter() - start) * 1000,
+                   statement=statement[:300], executemany=executemany)
+
+
+def _on_before_render(sender, template, context, **extra):
+    trace = current_trace()
+    if trace is not None:
+        trace._template_starts.append(time.perf_counter())
+
+
+def _on_template_rendered(sender, template, context, **extra):
+    trace = current_trace()
+    if trace is None or not trace._template_starts:
+        return
+    start = trace._template_starts.pop()
+    trace.add_span('template', template.name, start, (time.perf_counter() - start) * 1000)
+
+
+def configure_logging(app):
+    """Install the JSON (or plain text) handler on the root logger."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, '_rsvp_handler', False):
+            root.removeHandler(handler)
+
+    handler = logging.StreamHandler()
+    handler._rsvp_handler = True
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'))
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+
+def init_tracing(app):
+    """Wire request IDs, sampling and span collection into the app."""
+    configure_logging(app)
+
+    sample_rate = app.config.get('TRACE_SAMPLE_RATE', 0.0)
+    max_spans = app.config.get('TRACE_MAX_SPANS', 500)
+    slow_ms = app.config.get('TRACE_SLOW_MS', 1000)
+
+    global _traces
+    buffer_size = app.config.get('TRACE_BUFFER_SIZE', 200)
+    if _traces.maxlen != buffer_size:
+        _traces = deque(_traces, maxlen=buffer_size)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_template_rendered, app)
+
+    @app.before_request
+    def start_request_trace():
+        g.request_id = incoming_request_id() or uuid.uuid4().hex
+        g._request_start = time.perf_counter()
+        if sample_rate and random.random() < sample_rate:
+            g._trace = Trace(f"{request.method} {request.path}",
+                             trace_id=g.request_id, max_spans=max_spans)
+
+    @app.after_request
+    def tag_response(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        g._response_status = response.status_code
+        return response
+
+    # Teardown also runs for requests that raised, which after_request does not see
+    @app.teardown_request
+    def finish_request_trace(exc):
+        status = 500 if exc is not None else g.get('_response_status')
+        trace = g.pop('_trace', None)
+        if trace is not None:
+            trace.finish(status)
+        start = g.get('_request_start')
+        if start is None:
+            return
+        duration_ms = (time.perf_counter() - start) * 1000
+        details = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': status,
+            'duration_ms': round(duration_ms, 1)
+        }
+        if exc is not None:
+            # Flask has logged the traceback already
+            logger.error('Request failed', extra={**details, 'error': repr(exc)})
+        elif duration_ms >= slow_ms:
+            logger.warning('Slow request', extra=details)